@@ -0,0 +1,62 @@
+"""
+Compare the vectorized aggregation of exam results with the row by row reference
+implementation on a multi-year workbook. The workbook is built by repeating the sheets of
+the given results workbook, shifting their exam dates by a year for every repetition.
+
+Example usage:
+
+>>> python -m benchmarks.aggregation tests/test.xlsx --years 10 # doctest: +SKIP
+"""
+
+import argparse
+import timeit
+
+import pandas as pd
+
+from tentahjalpen.scraper.scraper import load_dataframe
+from tentahjalpen.scraper.scraper import aggregate_results, aggregate_results_iterrows
+
+
+def multi_year_workbook(sheets, years):
+    """ Repeat the given sheets, shifting their exam dates by one year per repetition
+
+    :param sheets: sheets as returned by load_dataframe
+    :param years: number of times to repeat the sheets
+    :return: dictionary of sheets covering the given number of years
+    """
+    workbook = {}
+    for year in range(years):
+        for name, sheet in sheets.items():
+            sheet = sheet.copy()
+            sheet["Provdatum"] = pd.to_datetime(sheet["Provdatum"]) - pd.DateOffset(years=year)
+            workbook["{}_{}".format(name, year)] = sheet
+
+    return workbook
+
+
+def main():
+    """ Time both implementations and verify that their output is identical """
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("workbook", help="results workbook to build the benchmark from")
+    parser.add_argument("--years", type=int, default=10, help="years to simulate")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per implementation")
+    args = parser.parse_args()
+
+    sheets = multi_year_workbook(load_dataframe(args.workbook), args.years)
+    rows = sum(len(sheet) for sheet in sheets.values())
+    print("{} sheets, {} rows".format(len(sheets), rows))
+
+    vectorized = aggregate_results(sheets)
+    if vectorized != aggregate_results_iterrows(sheets):
+        raise SystemExit("Implementations differ")
+    print("{} exam occasions, output identical".format(len(vectorized)))
+
+    for name, function in (("iterrows", aggregate_results_iterrows),
+                           ("vectorized", aggregate_results)):
+        best = min(timeit.repeat(lambda: function(sheets), number=1, repeat=args.repeat))
+        print("{:>10}: {:.3f}s".format(name, best))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Measure the throughput of PdfSpider against a synthetic mirror of chalmerstenta.se served
+locally, so that the concurrency and AutoThrottle settings of scrapy can be tuned without
+touching the real site. The mirror has the given number of courses with the given number
+of sittings each, every sitting having an exam and a solution, and answers every request
+after the given latency. The exam results are loaded into a disposable database created
+on the given postgres server and dropped afterwards, so that every PDF is new to the
+spider. Reports pages and PDFs per second, the database time per stored item and the
+peak memory of the crawling process.
+
+The reactor can't be restarted, so every run measures a single configuration. Any scrapy
+setting can be overridden, taking precedence over the settings of PdfSpider.
+
+Example usage:
+
+>>> python -m benchmarks.crawl postgresql://postgres@localhost:5432/postgres \
+        --courses 200 --latency 0.05 --set CONCURRENT_REQUESTS_PER_DOMAIN=32 # doctest: +SKIP
+"""
+
+import os
+import time
+import argparse
+import resource
+import threading
+import multiprocessing
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+from scrapy.crawler import CrawlerProcess
+from scrapy.settings import Settings
+
+from tentahjalpen.blob_store import create_blob_store
+from tentahjalpen.db_interface import DBInterface, init_db
+from tentahjalpen.scraper.pdf_spider import PdfSpider
+from tentahjalpen.scraper.pipelines import SuggestionPipeline
+from tentahjalpen.scraper.scraper import upsert_results
+
+
+class TimedSuggestionPipeline(SuggestionPipeline):
+    """SuggestionPipeline recording the time spent writing batches in the stats of the
+    crawler, as benchmark/db_seconds and benchmark/db_items"""
+
+    def __init__(self, **kwargs):
+        """ Create pipeline, the stats are those of the crawler it is created from """
+
+        super().__init__(**kwargs)
+        self.stats = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """ Create pipeline configured by the settings of the crawler """
+
+        pipeline = super().from_crawler(crawler)
+        pipeline.stats = crawler.stats
+        return pipeline
+
+    def write_batch(self, batch):
+        """ Write batch and record how long it took """
+
+        start = time.perf_counter()
+        try:
+            return super().write_batch(batch)
+        finally:
+            elapsed = time.perf_counter() - start
+
+            # batches are written from several threads at once
+            with self.lock:
+                self.stats.inc_value("benchmark/db_seconds", elapsed)
+                self.stats.inc_value("benchmark/db_items", len(batch))
+
+
+def course_code(index):
+    """ Return a course code unique to index, such as AAA000 for 0 and AAB001 for 1001 """
+
+    letters = index // 1000
+    return "".join(chr(ord("A") + letters // 26 ** power % 26) for power in (2, 1, 0)) + \
+        "{:03d}".format(index % 1000)
+
+
+def sitting_dates(sittings):
+    """ Return the exam dates of a course with the given number of sittings """
+
+    return [date(2019, 1, 14) - timedelta(days=120 * sitting) for sitting in range(sittings)]
+
+
+class Mirror(BaseHTTPRequestHandler):
+    """Request handler serving the course list, the course pages and the PDFs of the
+    synthetic mirror, configured through the attributes of the server"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ Serve the requested page after the latency of the mirror """
+
+        time.sleep(self.server.latency)
+
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path.startswith("/pdf/"):
+            self.respond(url.path.encode("ascii") + self.server.pdf, "application/pdf")
+        elif "kurs" in query:
+            self.respond(self.course_page(query["kurs"][0]), "text/html; charset=utf-8")
+        elif query.get("page") == ["listcourse"]:
+            self.respond(self.course_list(), "text/html; charset=utf-8")
+        else:
+            self.send_error(404)
+
+    def respond(self, body, content_type):
+        """ Send body with status 200 """
+
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def course_list(self):
+        """ Return the page linking every course page """
+
+        links = "".join('<a href="/?kurs={0}_Course_{1}">{0}</a>'.format(course_code(index),
+                                                                        index)
+                        for index in range(self.server.courses))
+        return "<html><body>{}</body></html>".format(links).encode("utf-8")
+
+    def course_page(self, title):
+        """ Return the course page of title, shaped like those of chalmerstenta.se """
+
+        code = title.split("_")[0]
+        rows = "".join(
+            '<tr><td>{1}</td><td>Tenta</td><td><a href="/pdf/{0}/{1}/exam.pdf">PDF</a></td>'
+            '<td><a href="/pdf/{0}/{1}/solution.pdf">PDF</a></td></tr>'.format(code, taken)
+            for taken in sitting_dates(self.server.sittings))
+
+        return ("<html><body><table><tr><td><table>"
+                "<tr><td>{}</td></tr>"
+                "<tr><td>Datum</td><td>Typ</td><td>Tenta</td><td>Lösning</td></tr>"
+                "{}</table></td></tr></table></body></html>").format(
+                    title.replace("_", " "), rows).encode("utf-8")
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """ Keep the requests out of the output of the benchmark """
+
+
+def start_mirror(courses, sittings, pdf_size, latency):
+    """ Serve the mirror from a process of its own, so that it doesn't compete with the
+    spider for the interpreter
+
+    :return: base URL of the mirror, and the process serving it
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Mirror)
+    server.daemon_threads = True
+    server.courses = courses
+    server.sittings = sittings
+    server.latency = latency
+
+    # the path is prepended to the body of every PDF, which keeps their hashes unique
+    server.pdf = b"%PDF-1.4\n" + os.urandom(pdf_size)
+
+    process = multiprocessing.get_context("fork").Process(target=server.serve_forever,
+                                                          daemon=True)
+    process.start()
+    server.socket.close()
+    return "http://127.0.0.1:{}".format(server.server_address[1]), process
+
+
+def fill_results(db, courses, sittings):
+    """ Add exam results without any PDFs for every sitting of the mirror """
+
+    upsert_results([{"taken": taken, "code": course_code(index),
+                     "name": "Course {}".format(index), "failures": 10, "threes": 10,
+                     "fours": 10, "fives": 10}
+                    for index in range(courses) for taken in sitting_dates(sittings)], db)
+
+
+def parse_overrides(values):
+    """ Parse NAME=VALUE pairs into a dictionary """
+
+    overrides = {}
+    for value in values:
+        name, _, setting = value.partition("=")
+        overrides[name] = setting
+
+    return overrides
+
+
+def crawl(db, blob_store, url, overrides):
+    """ Crawl the mirror at url using PdfSpider, with the settings in overrides
+
+    :return: stats of the crawl, and its duration in seconds
+    """
+    settings = Settings({"LOG_LEVEL": "WARNING", "TELNETCONSOLE_ENABLED": False})
+    settings.setdict({"ITEM_PIPELINES": {"benchmarks.crawl.TimedSuggestionPipeline": 300}},
+                     priority="cmdline")
+    settings.setdict(overrides, priority="cmdline")
+
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(PdfSpider)
+    process.crawl(crawler, db=db, blob_store=blob_store, start_urls=[url + "/?page=listcourse"],
+                  allowed_domains=["127.0.0.1"])
+
+    start = time.monotonic()
+    process.start()
+    return crawler.stats.get_stats(), time.monotonic() - start
+
+
+def report(stats, elapsed, expected, stored):
+    """ Print the throughput and resource usage of the crawl """
+
+    pdfs = stats.get("item_scraped_count", 0)
+    pages = stats.get("response_received_count", 0) - pdfs
+    items = stats.get("benchmark/db_items", 0)
+
+    print("{:>16}: {:.1f}s, finished: {}".format("duration", elapsed,
+                                                 stats.get("finish_reason")))
+    print("{:>16}: {} ({:.1f}/s)".format("pages", pages, pages / elapsed))
+    print("{:>16}: {} ({:.1f}/s), {} of {} stored".format("pdfs", pdfs, pdfs / elapsed,
+                                                          stored, expected))
+    print("{:>16}: {:.1f}MiB".format("downloaded",
+                                     stats.get("downloader/response_bytes", 0) / 2 ** 20))
+    if items:
+        print("{:>16}: {:.2f}ms per item".format(
+            "database", 1000 * stats["benchmark/db_seconds"] / items))
+
+    # kilobytes on linux
+    print("{:>16}: {:.1f}MiB".format("peak memory",
+                                     resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def main():
+    """ Set up the mirror and the database, crawl and report """
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("server", help="connection URL of a postgres server to create the "
+                                       "disposable database on")
+    parser.add_argument("--courses", type=int, default=100, help="courses of the mirror")
+    parser.add_argument("--sittings", type=int, default=10, help="sittings per course")
+    parser.add_argument("--pdf-size", type=int, default=200 * 1024, help="bytes per PDF")
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per response")
+    parser.add_argument("--blob-dir", help="keep PDFs in this directory instead of postgres")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                        help="scrapy setting to override, may be given several times")
+    args = parser.parse_args()
+
+    overrides = parse_overrides(args.set)
+    url, mirror = start_mirror(args.courses, args.sittings, args.pdf_size, args.latency)
+
+    server = DBInterface(url=args.server)
+    name = "crawl_benchmark_{}".format(os.getpid())
+    server.query("CREATE DATABASE " + name)
+    db = None
+    try:
+        db = DBInterface(url=urlsplit(args.server)._replace(path="/" + name).geturl())
+        init_db("schema.sql", db)
+        fill_results(db, args.courses, args.sittings)
+
+        print("{} courses, {} sittings each, {}KiB per PDF, {}s latency, settings: {}".format(
+            args.courses, args.sittings, args.pdf_size // 1024, args.latency,
+            overrides or "defaults"))
+
+        stats, elapsed = crawl(db, create_blob_store(db, args.blob_dir), url, overrides)
+        stored = db.query("SELECT COUNT(exam_hash) + COUNT(solution_hash) AS stored "
+                          "FROM exam_suggestions")[0]["stored"]
+        report(stats, elapsed, 2 * args.courses * args.sittings, stored)
+    finally:
+        if db is not None:
+            db.connection.close()
+        server.query("DROP DATABASE " + name)
+        mirror.terminate()
+
+
+if __name__ == "__main__":
+    main()
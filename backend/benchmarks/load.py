@@ -0,0 +1,133 @@
+"""
+Measure the latency of small API requests against a running server, first on their own
+and then while many clients are slowly downloading a PDF. Every download reads at a
+limited rate, so that the server has to keep the downloads open for a long time, which
+is what clients on slow connections do.
+
+Example usage, against a server started with gunicorn -c gunicorn_config.py wsgi:app:
+
+>>> python -m benchmarks.load http://localhost:80 EDA322 1998-12-26 # doctest: +SKIP
+"""
+
+import time
+import socket
+import asyncio
+import argparse
+import statistics
+from urllib.parse import urlsplit
+
+
+async def request(host, port, path, rate=None):
+    """ Send GET request and read the whole response
+
+    :param host: host of the server
+    :param port: port of the server
+    :param path: path to request
+    :param rate: bytes per second to read the response at, unlimited if not given
+    :return: number of bytes received
+    """
+    reader, writer = await asyncio.open_connection(host, port, limit=4096)
+    if rate is not None:
+
+        # keep the kernel from buffering the response on our behalf
+        writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+
+    writer.write("GET {} HTTP/1.1\r\nHost: {}\r\nConnection: close\r\n\r\n".format(
+        path, host).encode("ascii"))
+    await writer.drain()
+
+    received = 0
+    while True:
+        chunk = await reader.read(1024 if rate is not None else 65536)
+        if not chunk:
+            break
+
+        received += len(chunk)
+        if rate is not None:
+            await asyncio.sleep(len(chunk) / rate)
+
+    writer.close()
+    return received
+
+
+async def latencies(host, port, path, count, concurrency, timeout):
+    """ Send count requests for path, concurrency at a time, and time each of them
+
+    :return: list of latencies in seconds, None for requests that timed out
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    timings = []
+
+    async def timed():
+        async with semaphore:
+            start = time.monotonic()
+            try:
+                await asyncio.wait_for(request(host, port, path), timeout)
+                timings.append(time.monotonic() - start)
+            except asyncio.TimeoutError:
+                timings.append(None)
+
+    await asyncio.gather(*(timed() for _ in range(count)))
+    return timings
+
+
+def summarize(name, timings):
+    """ Print the median, 95th percentile and maximum of timings in milliseconds """
+
+    timeouts = timings.count(None)
+    timings = sorted(timing for timing in timings if timing is not None)
+    if not timings:
+        print("{:>22}: all {} requests timed out".format(name, timeouts))
+        return
+
+    print("{:>22}: p50 {:7.1f}ms  p95 {:7.1f}ms  max {:7.1f}ms  timeouts {}".format(
+        name, 1000 * statistics.median(timings),
+        1000 * timings[int(0.95 * (len(timings) - 1))], 1000 * timings[-1], timeouts))
+
+
+async def run(args):
+    """ Measure latencies without and with downloads in flight """
+
+    url = urlsplit(args.url)
+    host, port = url.hostname, url.port or 80
+    course = "/courses/" + args.code
+    pdf = "{}/{}/exam".format(course, args.date)
+
+    summarize("idle", await latencies(host, port, course, args.requests, args.concurrency,
+                                      args.timeout))
+
+    downloads = [asyncio.ensure_future(request(host, port, pdf, args.rate))
+                 for _ in range(args.downloads)]
+
+    # let the downloads get going before measuring
+    await asyncio.sleep(1.0)
+    summarize("{} downloads".format(args.downloads),
+              await latencies(host, port, course, args.requests, args.concurrency,
+                                args.timeout))
+
+    unfinished = sum(not download.done() for download in downloads)
+    print("{} of {} downloads still in flight".format(unfinished, args.downloads))
+    for download in downloads:
+        download.cancel()
+    await asyncio.gather(*downloads, return_exceptions=True)
+
+
+def main():
+    """ Parse arguments and run the load test """
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("url", help="base URL of the server")
+    parser.add_argument("code", help="course to request")
+    parser.add_argument("date", help="sitting of the course whose exam is downloaded")
+    parser.add_argument("--downloads", type=int, default=500, help="slow downloads at once")
+    parser.add_argument("--rate", type=int, default=16384, help="bytes/s per download")
+    parser.add_argument("--requests", type=int, default=200, help="small requests to time")
+    parser.add_argument("--concurrency", type=int, default=10, help="small requests at once")
+    parser.add_argument("--timeout", type=float, default=10.0, help="seconds per small request")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Compare the serialization of course responses with the previous implementation, which
+mutated every row, built the PDF URLs with url_for and serialized the rows using jsonify.
+Both are timed on a single course with the given number of sittings, each having both an
+exam and a solution.
+
+Example usage:
+
+>>> python -m benchmarks.serialization --sittings 200 # doctest: +SKIP
+"""
+
+import argparse
+import json
+import timeit
+from datetime import date, timedelta
+
+from flask import Flask, jsonify, url_for
+from psycopg2.extras import RealDictRow
+
+from tentahjalpen import serialization
+from tentahjalpen.blob_store import blob_hash
+
+
+def course_rows(sittings):
+    """ Build rows shaped as queried by get_course for a course with the given number of
+    sittings
+
+    :param sittings: number of rows to build
+    :return: list of RealDictRow instances
+    """
+    rows = []
+    for sitting in range(sittings):
+        row = RealDictRow()
+        row.update({
+            "exam": blob_hash(b"exam" + bytes([sitting % 256])),
+            "solution": blob_hash(b"solution" + bytes([sitting % 256])),
+            "failures": 33, "threes": 39, "fours": 15, "fives": 5,
+            "taken": date(2019, 3, 8) - timedelta(days=120 * sitting),
+            "name": "Digital konstruktion",
+            "code": "EDA322",
+        })
+        rows.append(row)
+
+    return rows
+
+
+def create_app():
+    """ Create application with the routes the previous implementation built URLs for """
+
+    app = Flask(__name__)
+    app.config["JSON_AS_ASCII"] = False
+    app.add_url_rule("/courses", "get_courses")
+    app.add_url_rule("/courses/<string:code>/<string:date>/exam", "get_exam")
+    app.add_url_rule("/courses/<string:code>/<string:date>/solution", "get_solution")
+    return app
+
+
+def previous(rows):
+    """ Serialize rows the way get_course used to """
+
+    entries = [RealDictRow(row) for row in rows]
+    for entry in entries:
+        entry["taken"] = str(entry["taken"])
+        entry["exam"] = url_for("get_exam", code=entry["code"], date=entry["taken"],
+                                _external=True)
+        entry["solution"] = url_for("get_solution", code=entry["code"],
+                                    date=entry["taken"], _external=True)
+
+    return jsonify(entries).get_data()
+
+
+def current(rows):
+    """ Serialize rows the way get_course does now """
+
+    return serialization.dumps(serialization.format_results(
+        rows, url_for("get_courses", _external=True)))
+
+
+def main():
+    """ Time both implementations and verify that their output is equivalent """
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sittings", type=int, default=200, help="sittings of the course")
+    parser.add_argument("--number", type=int, default=100, help="responses per run")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per implementation")
+    args = parser.parse_args()
+
+    rows = course_rows(args.sittings)
+    print("{} sittings, encoder: {}".format(
+        args.sittings, "orjson" if serialization.orjson is not None else "json"))
+
+    with create_app().test_request_context():
+        if json.loads(previous(rows)) != json.loads(current(rows)):
+            raise SystemExit("Implementations differ")
+        print("{} bytes, output equivalent".format(len(current(rows))))
+
+        for name, function in (("previous", previous), ("current", current)):
+            best = min(timeit.repeat(lambda: function(rows), number=args.number,
+                                     repeat=args.repeat))
+            print("{:>10}: {:.3f}ms per response".format(name, 1000 * best / args.number))
+
+
+if __name__ == "__main__":
+    main()
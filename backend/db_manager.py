@@ -2,8 +2,11 @@
 Executing this class starts a REPL session wherein the user may show, remove or approve
 the entries in the exam_suggestions table. The user may also scrape chalmerstenta.se
 for new exam suggestions which then get added to the exam_suggestions table for further
-investigation. It is also possible to initialize the database from here. When executing
-this file a postgresql connection URL is expected as the first argument.
+investigation. Scraping runs in background jobs, which may be repeated, scheduled and run
+alongside each other without leaving the session. It is also possible to initialize the
+database from here. When executing
+this file a postgresql connection URL is expected as the first argument. PDFs are kept in
+the database unless the environment variable BLOB_DIR names a directory to keep them in.
 
 Example usage:
 
@@ -11,13 +14,52 @@ Example usage:
 """
 
 
+import os
 import sys
+from datetime import datetime
+from tabulate import tabulate
+from tentahjalpen.blob_store import create_blob_store, move_blobs, rewrite_blobs
 from tentahjalpen.db_interface import DBInterface, init_db, list_suggestions
 from tentahjalpen.db_interface import remove, remove_all, approve, approve_all, show
-from tentahjalpen.scraper import scraper
+from tentahjalpen.jobs import JobRunner
+from tentahjalpen.stats import refresh_course_stats
 
 
-def main(connected_db):
+def _started(job):
+    """Return the time job was started at, or an empty string for jobs which are pending
+    or were cancelled before they started"""
+
+    if job.started is None:
+        return ""
+
+    return datetime.fromtimestamp(job.started).strftime("%H:%M:%S")
+
+
+def list_jobs(runner):
+    """Print table of the jobs and schedules of runner
+
+    >>> list_jobs(runner) # doctest: +SKIP
+      ID  Kind    Arguments      Status       Attempts  Started    Progress
+    ----  ------  -------------  ---------  ----------  ---------  ----------------------
+       1  ingest  results.xlsx   succeeded           1  12:00:01   Inserted 200, updated...
+       2  crawl                  pending             0
+    ...
+
+    """
+    print(tabulate([[job.id, job.kind, " ".join(map(str, job.args)), job.status,
+                     job.attempts, _started(job), job.progress] for job in runner.jobs()],
+                   headers=["ID", "Kind", "Arguments", "Status", "Attempts", "Started",
+                            "Progress"]))
+
+    schedules = runner.schedules()
+    if schedules:
+        print()
+        print(tabulate([[schedule_id, kind, " ".join(map(str, args)), interval // 60]
+                        for schedule_id, (kind, interval, args) in schedules.items()],
+                       headers=["Schedule", "Kind", "Arguments", "Minutes"]))
+
+
+def main(connected_db, runner, blob_store=None):
     """Enter interactive session where commands can
     be issued and their effects are printed in context
 
@@ -27,7 +69,17 @@ def main(connected_db):
     Available commands:
     init FILENAME: initialize table using given file and scrape exam data
     list: print table of exam suggestions in database
-    scrape: scrape statistics from given file argument and PDFs from chalmerstenta.se
+    scrape FILENAME: ingest statistics from given file, then crawl chalmerstenta.se for PDFs
+    ingest FILENAME: ingest statistics from given file in the background
+    crawl: crawl chalmerstenta.se for PDFs in the background
+    every MINUTES ingest FILENAME|crawl: run job now and every given number of minutes
+    unschedule ID: stop running the job of the schedule with the given ID
+    jobs: print table of jobs and schedules
+    restart ID: run job with the given ID again
+    cancel ID: stop job with the given ID
+    stats: recompute the statistics of every course
+    move_blobs: move PDFs kept in the database to the blob store, such as BLOB_DIR
+    rewrite_blobs: store PDFs kept in the database uncompressed, once after upgrading
     show ID: open file in browser
     remove ID: remove entry with the given ID
     remove_all: remove all entries
@@ -36,7 +88,11 @@ def main(connected_db):
 
     ...
 
+    :param connected_db: DBInterface instance to manage
+    :param runner: JobRunner instance running the scraping jobs against the same database
+    :param blob_store: blob store holding the PDFs, the blobs table is used if not given
     """
+    blob_store = blob_store or create_blob_store(connected_db)
     print("Issue 'help' to print a list of commands")
     while True:
         command = input(">").split()
@@ -44,8 +100,21 @@ def main(connected_db):
             print("Available commands:")
             print("init FILENAME: initialize table using given file and scrape exam data")
             print("list: print table of exam suggestions in database")
-            print(
-                "scrape: scrape statistics from Chalmers and PDFs from chalmerstenta.se")
+            print("scrape FILENAME: ingest statistics from given file, then crawl "
+                  "chalmerstenta.se for PDFs")
+            print("ingest FILENAME: ingest statistics from given file in the background")
+            print("crawl: crawl chalmerstenta.se for PDFs in the background")
+            print("every MINUTES ingest FILENAME|crawl: run job now and every given number "
+                  "of minutes")
+            print("unschedule ID: stop running the job of the schedule with the given ID")
+            print("jobs: print table of jobs and schedules")
+            print("restart ID: run job with the given ID again")
+            print("cancel ID: stop job with the given ID")
+            print("stats: recompute the statistics of every course")
+            print("move_blobs: move PDFs kept in the database to the blob store, such as "
+                  "BLOB_DIR")
+            print("rewrite_blobs: store PDFs kept in the database uncompressed, once after "
+                  "upgrading")
             print("show ID: open file in browser")
             print("remove ID: remove entry with the given ID")
             print("remove_all: remove all entries")
@@ -56,22 +125,50 @@ def main(connected_db):
         elif len(command) == 1 and command[0] == "list":
             list_suggestions(connected_db)
         elif len(command) == 1 and command[0] == "remove_all":
-            remove_all(connected_db)
+            remove_all(connected_db, blob_store)
         elif len(command) == 1 and command[0] == "approve_all":
-            approve_all(connected_db)
+            approve_all(connected_db, blob_store)
         elif len(command) == 2 and command[0] == "scrape":
-            print("Scraping statistics...")
-            df = scraper.load_dataframe(command[1])
-            scraper.update_db(df, connected_db)
-            print("Scraping exam pdfs...")
-            scraper.scrape_pdfs(connected_db)
-            print("Done")
+            ingest = runner.submit("ingest", command[1])
+            crawl = runner.submit_after(ingest.id, "crawl")
+            print("Started job {}, job {} crawls once it has succeeded, issue 'jobs' to "
+                  "follow their progress".format(ingest.id, crawl.id))
+        elif len(command) == 2 and command[0] == "ingest":
+            print("Started job " + str(runner.submit("ingest", command[1]).id))
+        elif len(command) == 1 and command[0] == "crawl":
+            print("Started job " + str(runner.submit("crawl").id))
+        elif len(command) == 3 and command[0] == "every" and command[1].isdigit() and \
+                command[2] == "crawl":
+            schedule_id, job = runner.schedule("crawl", 60 * int(command[1]))
+            print("Created schedule {}, started job {}".format(schedule_id, job.id))
+        elif len(command) == 4 and command[0] == "every" and command[1].isdigit() and \
+                command[2] == "ingest":
+            schedule_id, job = runner.schedule("ingest", 60 * int(command[1]), command[3])
+            print("Created schedule {}, started job {}".format(schedule_id, job.id))
+        elif len(command) == 1 and command[0] == "jobs":
+            list_jobs(runner)
+        elif len(command) == 2 and command[0] in ("unschedule", "restart", "cancel") and \
+                command[1].isdigit():
+            try:
+                getattr(runner, command[0])(int(command[1]))
+            except KeyError:
+                print("No such ID: " + command[1])
+            except ValueError as error:
+                print(error)
+        elif len(command) == 1 and command[0] == "stats":
+            with connected_db.transaction() as cursor:
+                print("Refreshed statistics of " + str(refresh_course_stats(cursor)) +
+                      " courses")
+        elif len(command) == 1 and command[0] == "move_blobs":
+            print("Moved " + str(move_blobs(connected_db, blob_store)) + " PDFs")
+        elif len(command) == 1 and command[0] == "rewrite_blobs":
+            print("Rewrote " + str(rewrite_blobs(connected_db)) + " PDFs")
         elif len(command) == 2 and command[0] == "remove":
-            remove(command[1], connected_db)
+            remove(command[1], connected_db, blob_store)
         elif len(command) == 2 and command[0] == "show":
-            show(command[1], connected_db)
+            show(command[1], connected_db, blob_store)
         elif len(command) == 2 and command[0] == "approve":
-            approve(command[1], connected_db)
+            approve(command[1], connected_db, blob_store)
         else:
             print("Unknown command")
 
@@ -80,4 +177,5 @@ if __name__ == "__main__":
     CONNECTED_DB = DBInterface(url=sys.argv[1])
 
     print("Connection established to: " + sys.argv[1])
-    main(CONNECTED_DB)
+    main(CONNECTED_DB, JobRunner({"url": sys.argv[1]}, os.environ.get("BLOB_DIR")),
+         create_blob_store(CONNECTED_DB, os.environ.get("BLOB_DIR")))
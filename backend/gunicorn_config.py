@@ -0,0 +1,45 @@
+"""
+Configuration of gunicorn when serving the app in production. Requests are served by
+gevent workers, which multiplex every connection of a process on greenlets, so that
+clients slowly downloading PDFs don't keep other requests waiting. psycopg2 is made
+cooperative as well, and the greenlets share the connection pool of the worker.
+
+Example usage:
+
+>>> gunicorn -c gunicorn_config.py wsgi:app # doctest: +SKIP
+
+The worker class can be set through WORKER_CLASS, e.g. to sync for the previous behaviour
+of one request at a time per worker.
+"""
+
+# pylint: disable=invalid-name
+import os
+
+
+bind = os.environ.get("BIND", "0.0.0.0:80")
+workers = int(os.environ.get("WEB_CONCURRENCY", 2))
+worker_class = os.environ.get("WORKER_CLASS", "gevent")
+
+# maximum number of clients served at once by every worker
+worker_connections = int(os.environ.get("WORKER_CONNECTIONS", 1000))
+
+# downloads of large PDFs over slow connections may take a while
+timeout = 300
+loglevel = "info"
+errorlog = "-"
+
+
+def post_fork(server, worker):
+    """ Let psycopg2 yield to other greenlets while waiting for postgres, and make sure
+    the greenlets share a pool rather than a single connection """
+
+    if worker_class != "gevent":
+        return
+
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+
+    # a single connection can't be used by several greenlets at once
+    os.environ.setdefault("DB_POOL_MAX", "10")
+    server.log.info("Worker %s serving cooperatively, pool of %s connections", worker.pid,
+                    os.environ["DB_POOL_MAX"])
@@ -0,0 +1,85 @@
+-- ---
+-- Table 'results'
+--
+-- ---
+
+CREATE TABLE IF NOT EXISTS results (
+	id            SERIAL PRIMARY KEY,
+	taken         DATE,
+	code          VARCHAR(6),
+	name          VARCHAR,
+	failures      INTEGER,
+	threes        INTEGER,
+	fours         INTEGER,
+	fives         INTEGER,
+	exam_hash     CHAR(64),
+	solution_hash CHAR(64)
+);
+
+-- ---
+-- Table 'exam_suggestions'
+--
+-- ---
+
+CREATE TABLE IF NOT EXISTS exam_suggestions (
+	id            SERIAL PRIMARY KEY,
+	taken         DATE,
+	code          VARCHAR(6),
+	exam_hash     CHAR(64),
+	solution_hash CHAR(64)
+);
+
+-- ---
+-- Table 'blobs'
+-- PDFs referenced by results and exam_suggestions, keyed by SHA-256 digest
+-- ---
+
+CREATE TABLE IF NOT EXISTS blobs (
+	hash CHAR(64) PRIMARY KEY,
+	size INTEGER NOT NULL,
+	data BYTEA NOT NULL
+);
+
+-- ---
+-- Databases created before the migrations kept the PDFs in BYTEA columns of results and
+-- exam_suggestions, which the statements above leave untouched. Move those PDFs into the
+-- blobs table and reference them by digest instead. Requires postgres 11 or later for
+-- the sha256 function.
+-- ---
+
+DO $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM information_schema.columns
+	           WHERE table_schema = current_schema() AND table_name = 'results'
+	             AND column_name = 'exam') THEN
+		INSERT INTO blobs (hash, size, data)
+		SELECT encode(sha256(pdf), 'hex'), length(pdf), pdf
+		FROM (SELECT exam AS pdf FROM results WHERE exam IS NOT NULL
+		      UNION ALL SELECT solution FROM results WHERE solution IS NOT NULL) AS pdfs
+		ON CONFLICT (hash) DO NOTHING;
+
+		ALTER TABLE results ADD COLUMN IF NOT EXISTS exam_hash CHAR(64),
+		                    ADD COLUMN IF NOT EXISTS solution_hash CHAR(64);
+		UPDATE results SET exam_hash = encode(sha256(exam), 'hex'),
+		                   solution_hash = encode(sha256(solution), 'hex');
+		ALTER TABLE results DROP COLUMN exam, DROP COLUMN solution;
+	END IF;
+
+	IF EXISTS (SELECT 1 FROM information_schema.columns
+	           WHERE table_schema = current_schema() AND table_name = 'exam_suggestions'
+	             AND column_name = 'exam') THEN
+		INSERT INTO blobs (hash, size, data)
+		SELECT encode(sha256(pdf), 'hex'), length(pdf), pdf
+		FROM (SELECT exam AS pdf FROM exam_suggestions WHERE exam IS NOT NULL
+		      UNION ALL SELECT solution FROM exam_suggestions WHERE solution IS NOT NULL)
+		     AS pdfs
+		ON CONFLICT (hash) DO NOTHING;
+
+		ALTER TABLE exam_suggestions ADD COLUMN IF NOT EXISTS exam_hash CHAR(64),
+		                             ADD COLUMN IF NOT EXISTS solution_hash CHAR(64);
+		UPDATE exam_suggestions SET exam_hash = encode(sha256(exam), 'hex'),
+		                            solution_hash = encode(sha256(solution), 'hex');
+		ALTER TABLE exam_suggestions DROP COLUMN exam, DROP COLUMN solution;
+	END IF;
+END
+$$;
@@ -0,0 +1,38 @@
+-- ---
+-- Indexes for the lookups performed by the API, the scraper and the spider, which
+-- all filter results and exam_suggestions on the course code and exam date.
+-- ---
+
+-- merge any duplicated exam occasions into the row that was inserted first,
+-- keeping PDFs that were only attached to one of the duplicates
+UPDATE results AS kept
+SET exam_hash = COALESCE(kept.exam_hash, duplicate.exam_hash),
+    solution_hash = COALESCE(kept.solution_hash, duplicate.solution_hash)
+FROM results AS duplicate
+WHERE duplicate.code = kept.code AND duplicate.taken = kept.taken
+  AND duplicate.id > kept.id
+  AND NOT EXISTS (SELECT 1 FROM results AS earlier
+                  WHERE earlier.code = kept.code AND earlier.taken = kept.taken
+                    AND earlier.id < kept.id);
+
+DELETE FROM results AS duplicate
+USING results AS kept
+WHERE kept.code = duplicate.code AND kept.taken = duplicate.taken
+  AND kept.id < duplicate.id;
+
+-- single exam occasion lookups, also serves lookups on the code alone
+ALTER TABLE results ADD CONSTRAINT results_code_taken_key UNIQUE (code, taken);
+
+-- covers the course list, which only needs the code and name
+CREATE INDEX results_code_name_idx ON results (code, name);
+
+-- checking whether a blob is still referenced when releasing it
+CREATE INDEX results_exam_hash_idx ON results (exam_hash) WHERE exam_hash IS NOT NULL;
+CREATE INDEX results_solution_hash_idx ON results (solution_hash)
+	WHERE solution_hash IS NOT NULL;
+
+CREATE INDEX exam_suggestions_code_taken_idx ON exam_suggestions (code, taken);
+CREATE INDEX exam_suggestions_exam_hash_idx ON exam_suggestions (exam_hash)
+	WHERE exam_hash IS NOT NULL;
+CREATE INDEX exam_suggestions_solution_hash_idx ON exam_suggestions (solution_hash)
+	WHERE solution_hash IS NOT NULL;
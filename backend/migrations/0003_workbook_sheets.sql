@@ -0,0 +1,12 @@
+-- ---
+-- Table 'workbook_sheets'
+-- Fingerprints of the results workbook sheets that have been ingested, used to skip
+-- sheets that haven't changed since the last ingest
+-- ---
+
+CREATE TABLE workbook_sheets (
+	name         VARCHAR PRIMARY KEY,
+	content_hash CHAR(64) NOT NULL,
+	rows         INTEGER NOT NULL,
+	ingested     TIMESTAMP NOT NULL DEFAULT now()
+);
@@ -0,0 +1,35 @@
+-- ---
+-- Table 'data_version'
+-- Single row counting the changes made to results, used to answer conditional
+-- requests for the course data without querying it
+-- ---
+
+CREATE TABLE data_version (
+	id       BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+	version  BIGINT NOT NULL,
+	modified TIMESTAMP WITH TIME ZONE NOT NULL
+);
+
+INSERT INTO data_version (version, modified) VALUES (1, now());
+
+-- bump the version once per statement that actually changed any rows
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+BEGIN
+	IF EXISTS (SELECT 1 FROM changed_rows) THEN
+		UPDATE data_version SET version = version + 1, modified = now();
+	END IF;
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER results_insert_data_version AFTER INSERT ON results
+	REFERENCING NEW TABLE AS changed_rows
+	FOR EACH STATEMENT EXECUTE PROCEDURE bump_data_version();
+
+CREATE TRIGGER results_update_data_version AFTER UPDATE ON results
+	REFERENCING NEW TABLE AS changed_rows
+	FOR EACH STATEMENT EXECUTE PROCEDURE bump_data_version();
+
+CREATE TRIGGER results_delete_data_version AFTER DELETE ON results
+	REFERENCING OLD TABLE AS changed_rows
+	FOR EACH STATEMENT EXECUTE PROCEDURE bump_data_version();
@@ -0,0 +1,25 @@
+-- ---
+-- Notify the results_changed channel with the comma separated course codes whose results
+-- changed, or * if there are too many of them to fit in a notification, so that workers
+-- can invalidate their cached course responses
+-- ---
+
+CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+DECLARE
+	codes TEXT;
+BEGIN
+	IF NOT EXISTS (SELECT 1 FROM changed_rows) THEN
+		RETURN NULL;
+	END IF;
+
+	UPDATE data_version SET version = version + 1, modified = now();
+
+	SELECT string_agg(DISTINCT code, ',') INTO codes FROM changed_rows;
+	IF codes IS NULL OR length(codes) > 7000 THEN
+		codes := '*';
+	END IF;
+	PERFORM pg_notify('results_changed', codes);
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,39 @@
+-- ---
+-- Table 'course_stats'
+-- Statistics computed from the results of every course, refreshed whenever the results
+-- are ingested. Use the stats command of db_manager.py to recompute them for every course.
+-- ---
+
+CREATE TABLE course_stats (
+	code               VARCHAR(6) PRIMARY KEY,
+	adjusted_fail_rate REAL,
+	sittings           INTEGER NOT NULL,
+	computed           TIMESTAMP NOT NULL DEFAULT now()
+);
+
+-- statistics of the courses already in results, computed the same way as by
+-- adjusted_fail_rates in tentahjalpen/stats.py with its default parameters: the fail
+-- rates of the three sittings with the most participants, at least 20, of the three
+-- years before the latest sitting are averaged
+WITH sittings AS (
+	SELECT code, taken,
+	       coalesce(failures, 0) AS failures,
+	       coalesce(failures, 0) + coalesce(threes, 0) + coalesce(fours, 0) +
+	       coalesce(fives, 0) AS participants,
+	       max(taken) OVER (PARTITION BY code) AS latest
+	FROM results
+	WHERE code IS NOT NULL
+), major AS (
+	SELECT code, failures, participants,
+	       row_number() OVER (PARTITION BY code
+	                          ORDER BY participants DESC, taken DESC) AS rank
+	FROM sittings
+	WHERE taken > latest - INTERVAL '3 years' AND participants >= 20
+)
+INSERT INTO course_stats (code, adjusted_fail_rate, sittings)
+SELECT code,
+       avg(failures * 100.0 / participants) FILTER (WHERE rank <= 3),
+       count(*) FILTER (WHERE rank <= 3)
+FROM (SELECT DISTINCT code FROM sittings) AS courses
+LEFT JOIN major USING (code)
+GROUP BY code;
@@ -0,0 +1,59 @@
+-- ---
+-- Table 'course_catalog'
+-- One row per course summarizing its results, kept up to date by triggers on results
+-- for the courses changed by every statement
+-- ---
+
+CREATE TABLE course_catalog (
+	code        VARCHAR(6) PRIMARY KEY,
+	name        VARCHAR,
+	sittings    INTEGER NOT NULL,
+	first_taken DATE,
+	last_taken  DATE,
+	exams       INTEGER NOT NULL,
+	solutions   INTEGER NOT NULL
+);
+
+CREATE OR REPLACE FUNCTION refresh_course_catalog() RETURNS trigger AS $$
+BEGIN
+	INSERT INTO course_catalog (code, name, sittings, first_taken, last_taken, exams, solutions)
+	SELECT code, (array_agg(name ORDER BY taken DESC NULLS LAST))[1], count(*), min(taken),
+	       max(taken), count(exam_hash), count(solution_hash)
+	FROM results
+	WHERE code IN (SELECT code FROM changed_rows)
+	GROUP BY code
+	ON CONFLICT (code) DO UPDATE SET
+		name = EXCLUDED.name, sittings = EXCLUDED.sittings,
+		first_taken = EXCLUDED.first_taken, last_taken = EXCLUDED.last_taken,
+		exams = EXCLUDED.exams, solutions = EXCLUDED.solutions;
+
+	-- courses whose last result was removed
+	DELETE FROM course_catalog
+	WHERE code IN (SELECT code FROM changed_rows)
+	  AND NOT EXISTS (SELECT 1 FROM results WHERE results.code = course_catalog.code);
+
+	RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER results_insert_course_catalog AFTER INSERT ON results
+	REFERENCING NEW TABLE AS changed_rows
+	FOR EACH STATEMENT EXECUTE PROCEDURE refresh_course_catalog();
+
+CREATE TRIGGER results_update_course_catalog AFTER UPDATE ON results
+	REFERENCING NEW TABLE AS changed_rows
+	FOR EACH STATEMENT EXECUTE PROCEDURE refresh_course_catalog();
+
+CREATE TRIGGER results_delete_course_catalog AFTER DELETE ON results
+	REFERENCING OLD TABLE AS changed_rows
+	FOR EACH STATEMENT EXECUTE PROCEDURE refresh_course_catalog();
+
+INSERT INTO course_catalog (code, name, sittings, first_taken, last_taken, exams, solutions)
+SELECT code, (array_agg(name ORDER BY taken DESC NULLS LAST))[1], count(*), min(taken),
+       max(taken), count(exam_hash), count(solution_hash)
+FROM results
+WHERE code IS NOT NULL
+GROUP BY code;
+
+-- the course list no longer reads results, so its covering index is unused
+DROP INDEX IF EXISTS results_code_name_idx;
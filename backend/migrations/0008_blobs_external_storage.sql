@@ -0,0 +1,10 @@
+-- ---
+-- Keep blob data uncompressed out of line, so that a range of a PDF can be read with
+-- substring without fetching and decompressing the entire blob. PDFs are compressed
+-- already, so little space is lost.
+-- ---
+
+-- the storage setting only applies to new values, the blobs already stored are rewritten
+-- outside of the migration by the rewrite_blobs command of db_manager.py, since
+-- rewriting all of them here would hold up startup and lock every blob meanwhile
+ALTER TABLE blobs ALTER COLUMN data SET STORAGE EXTERNAL;
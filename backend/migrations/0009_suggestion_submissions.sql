@@ -0,0 +1,37 @@
+-- ---
+-- Collapse identical suggestions for the same exam into one row, counting how many times
+-- the PDF has been submitted in the submissions column
+-- ---
+
+ALTER TABLE exam_suggestions ADD COLUMN submissions INTEGER NOT NULL DEFAULT 1;
+
+-- merge the suggestions that are already duplicated into the one submitted first
+UPDATE exam_suggestions AS kept
+SET submissions = duplicates.submissions
+FROM (SELECT MIN(id) AS id, COUNT(*) AS submissions FROM exam_suggestions
+      WHERE exam_hash IS NOT NULL GROUP BY code, taken, exam_hash
+      HAVING COUNT(*) > 1) AS duplicates
+WHERE kept.id = duplicates.id;
+
+DELETE FROM exam_suggestions AS duplicate
+USING exam_suggestions AS kept
+WHERE kept.code = duplicate.code AND kept.taken = duplicate.taken
+  AND kept.exam_hash = duplicate.exam_hash AND kept.id < duplicate.id;
+
+UPDATE exam_suggestions AS kept
+SET submissions = duplicates.submissions
+FROM (SELECT MIN(id) AS id, COUNT(*) AS submissions FROM exam_suggestions
+      WHERE solution_hash IS NOT NULL GROUP BY code, taken, solution_hash
+      HAVING COUNT(*) > 1) AS duplicates
+WHERE kept.id = duplicates.id;
+
+DELETE FROM exam_suggestions AS duplicate
+USING exam_suggestions AS kept
+WHERE kept.code = duplicate.code AND kept.taken = duplicate.taken
+  AND kept.solution_hash = duplicate.solution_hash AND kept.id < duplicate.id;
+
+-- the conflict targets of resubmissions
+CREATE UNIQUE INDEX exam_suggestions_exam_key ON exam_suggestions (code, taken, exam_hash)
+	WHERE exam_hash IS NOT NULL;
+CREATE UNIQUE INDEX exam_suggestions_solution_key
+	ON exam_suggestions (code, taken, solution_hash) WHERE solution_hash IS NOT NULL;
@@ -0,0 +1,15 @@
+-- ---
+-- Table 'crawled_urls'
+-- Validators and content hash of every course page and PDF fetched from chalmerstenta.se
+-- by the last successful crawl, used to skip the ones that haven't changed since. They
+-- are only trusted while the results are at the data version they were recorded at.
+-- ---
+
+CREATE TABLE crawled_urls (
+	url           VARCHAR PRIMARY KEY,
+	etag          VARCHAR,
+	last_modified VARCHAR,
+	content_hash  CHAR(64) NOT NULL,
+	data_version  BIGINT NOT NULL,
+	crawled       TIMESTAMP NOT NULL DEFAULT now()
+);
@@ -0,0 +1,16 @@
+-- ---
+-- Bump the data version and notify the results_changed channel when the statistics of
+-- courses change, which the stats command of db_manager.py does without touching results
+-- ---
+
+CREATE TRIGGER course_stats_insert_data_version AFTER INSERT ON course_stats
+	REFERENCING NEW TABLE AS changed_rows
+	FOR EACH STATEMENT EXECUTE PROCEDURE bump_data_version();
+
+CREATE TRIGGER course_stats_update_data_version AFTER UPDATE ON course_stats
+	REFERENCING NEW TABLE AS changed_rows
+	FOR EACH STATEMENT EXECUTE PROCEDURE bump_data_version();
+
+CREATE TRIGGER course_stats_delete_data_version AFTER DELETE ON course_stats
+	REFERENCING OLD TABLE AS changed_rows
+	FOR EACH STATEMENT EXECUTE PROCEDURE bump_data_version();
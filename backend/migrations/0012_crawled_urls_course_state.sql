@@ -0,0 +1,12 @@
+-- ---
+-- Trust the course pages in crawled_urls while the exam occasions of their course are
+-- unchanged, rather than while every result is, so that changing the results of one
+-- course only has its own page fetched again. The digest of the exam occasions is
+-- computed by PdfSpider.course_state, and is NULL for PDFs. The recorded state can't be
+-- converted, so it is dropped and rebuilt by the next crawl.
+-- ---
+
+TRUNCATE crawled_urls;
+
+ALTER TABLE crawled_urls DROP COLUMN data_version;
+ALTER TABLE crawled_urls ADD COLUMN course_state CHAR(64);
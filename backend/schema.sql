@@ -1,34 +1,15 @@
 -- ---
--- Table 'results'
---
+-- Reset the database by dropping every table, including the record of applied
+-- migrations. The tables themselves are created by the files in migrations/,
+-- which init_db applies after executing this file.
 -- ---
 
 DROP TABLE IF EXISTS results;
-
-CREATE TABLE results (
-	id       SERIAL PRIMARY KEY,
-	taken    DATE,
-	code     VARCHAR(6),
-	name     VARCHAR,
-	failures INTEGER,
-	threes   INTEGER,
-	fours    INTEGER,
-	fives    INTEGER,
-	exam     BYTEA,
-	solution BYTEA
-);
-
--- ---
--- Table 'exam_suggestions'
---
--- ---
-
 DROP TABLE IF EXISTS exam_suggestions;
-
-CREATE TABLE exam_suggestions (
-	id        SERIAL PRIMARY KEY,
-	taken     DATE,
-	code      VARCHAR(6),
-	exam      BYTEA,
-	solution  BYTEA
-);
+DROP TABLE IF EXISTS blobs;
+DROP TABLE IF EXISTS workbook_sheets;
+DROP TABLE IF EXISTS data_version;
+DROP TABLE IF EXISTS course_stats;
+DROP TABLE IF EXISTS course_catalog;
+DROP TABLE IF EXISTS crawled_urls;
+DROP TABLE IF EXISTS schema_version;
@@ -4,15 +4,25 @@ the application is sourced, and any eventual testing or production specific logi
 here.
 """
 
-import os
 import io
+import os
 import base64
+import functools
+from datetime import timezone
 
-from flask import Flask, make_response, Response, jsonify, abort, send_file, url_for
+from flask import Flask, make_response, Response, jsonify, abort, url_for
 from flask import request, session
 from flask.logging import create_logger
 from flask_cors import CORS
-from .db_interface import DBInterface, init_db
+from .db_interface import DBInterface, add_suggestion, SUGGESTION_COLUMNS
+from .db_interface import COURSE_LIST_QUERY, COURSE_QUERY, COURSE_BATCH_QUERY, PDF_QUERY
+from .db_interface import COURSES_EXIST_QUERY
+from .migrations import migrate
+from . import compression
+from . import serialization
+from .blob_store import create_blob_store, spool_file, blob_hash, BlobTooLarge
+from .data_version import DataVersion
+from .cache import ResponseCache, NotificationListener, RESULTS_CHANNEL, ALL_COURSES
 from .scraper import scraper
 
 
@@ -35,14 +45,13 @@ def create_app(production=False, test_db=None):
     connected_db = None
 
     def init():
-        """Check if database is initialized and initialize if necessary."""
+        """Bring the database schema up to date by applying any pending migrations."""
 
-        logger.info("Checking if database is initialized...")
-        entries = connected_db.query("SELECT * FROM results")
+        logger.info("Checking schema version of database...")
+        applied = migrate(connected_db)
 
-        if not entries:
-            logger.info("Initializing database...")
-            init_db("schema.sql", connected_db)
+        if applied:
+            logger.info("Applied migrations: %s", ", ".join(map(str, applied)))
 
     # provide default configs for app
     # some of these should be overridden in config.py
@@ -58,60 +67,284 @@ def create_app(production=False, test_db=None):
         DB_HOST="localhost",
         DB_PORT=5432,
         SSL="disable",
+
+        # connection pool size, a single shared connection is used if DB_POOL_MAX isn't set
+        DB_POOL_MIN=1,
+        DB_POOL_MAX=None,
+        DB_POOL_TIMEOUT=30.0,
+
+        # directory for storing PDFs, they're kept in the database if not set
+        BLOB_DIR=None,
+
+        # seconds the version of the course data is remembered for conditional requests
+        DATA_VERSION_TTL=5.0,
+
+        # number of course responses cached by every worker, 0 disables the cache
+        RESPONSE_CACHE_SIZE=512,
+
+        # maximum number of courses requested at once from /courses/batch
+        MAX_BATCH_COURSES=50,
+
+        # size in bytes below which JSON responses are sent uncompressed
+        COMPRESS_MIN_SIZE=1024,
+
+        # maximum size in bytes of the body of a suggestion upload
+        MAX_UPLOAD_SIZE=20 * 1024 * 1024,
     )
 
     if production:
 
         # connect to postgres using environment variables
-        connected_db = DBInterface(url=os.environ["DATABASE_URL"])
+        app.config["BLOB_DIR"] = os.environ.get("BLOB_DIR")
+        if os.environ.get("DB_POOL_MAX"):
+            app.config["DB_POOL_MIN"] = int(os.environ.get("DB_POOL_MIN", 1))
+            app.config["DB_POOL_MAX"] = int(os.environ["DB_POOL_MAX"])
+        connected_db = DBInterface(url=os.environ["DATABASE_URL"],
+                                   min_connections=app.config["DB_POOL_MIN"],
+                                   max_connections=app.config["DB_POOL_MAX"],
+                                   pool_timeout=app.config["DB_POOL_TIMEOUT"])
 
     elif test_db is None:
 
+        # load the instance config, if it exists, when not testing
+        app.config.from_pyfile("config.py", silent=True)
+
         # connect to postgres
         connected_db = DBInterface(dbname=app.config["DB_NAME"],
                                    user=app.config["DB_USER"],
                                    password=app.config["DB_PASSWD"],
                                    host=app.config["DB_HOST"],
                                    port=app.config["DB_PORT"],
-                                   sslmode=app.config["SSL"])
-
-        # load the instance config, if it exists, when not testing
-        app.config.from_pyfile("config.py", silent=True)
+                                   sslmode=app.config["SSL"],
+                                   min_connections=app.config["DB_POOL_MIN"],
+                                   max_connections=app.config["DB_POOL_MAX"],
+                                   pool_timeout=app.config["DB_POOL_TIMEOUT"])
 
     else:
 
         # load the test database
         connected_db = test_db
 
+    # blob store used for all exam and solution PDFs
+    blob_store = create_blob_store(connected_db, app.config["BLOB_DIR"])
+
+    # version of the course data, used to answer conditional requests
+    data_version = DataVersion(connected_db, app.config["DATA_VERSION_TTL"])
+
+    # cache of course responses, only used while listening for changes to the results
+    response_cache = ResponseCache(app.config["RESPONSE_CACHE_SIZE"])
+
+    def results_changed(payload):
+        """Drop cached responses of the courses whose results changed"""
+
+        data_version.invalidate()
+        if payload == ALL_COURSES:
+            response_cache.invalidate()
+        else:
+            response_cache.invalidate(payload.split(","))
+
+    def listening(connected):
+        """Only use the cache while no changes to the results can be missed"""
+
+        data_version.invalidate()
+        response_cache.enable(connected)
+
+    results_listener = NotificationListener(connected_db.connect, RESULTS_CHANNEL,
+                                            results_changed, listening)
+    app.extensions["response_cache"] = response_cache
+    app.extensions["results_listener"] = results_listener
+
     # allow CORS headers
     CORS(app)
 
+    @app.teardown_appcontext
+    def release_connection(_):
+        """Return the database connection used by the request to the pool"""
+
+        connected_db.release()
+
     # only run init if not running tests
     if test_db is None:
 
         # perform manual check of database on startup
         init()
 
+        if app.config["RESPONSE_CACHE_SIZE"] > 0:
+            results_listener.start()
+
+    def conditional(exists):
+        """Give successful responses of the view an ETag and Last-Modified header from the
+        version of the course data, and answer requests for a version the client already
+        has with 304 without running the view.
+
+        :param exists: function called with the arguments of the view, returning whether
+        the requested resource exists; it is only called before answering with 304, which
+        a missing resource mustn't be answered with
+        """
+
+        def decorator(view):
+
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+                version, modified = data_version.get()
+                etag = str(version)
+
+                # every encoding of the same version is its own representation with its
+                # own ETag, but any of them tells that the client has the current version
+                etags = [etag] + [etag + "-" + encoding
+                                  for encoding in compression.ENCODINGS]
+
+                # If-Modified-Since is only considered when there is no If-None-Match
+                if request.if_none_match:
+                    matching = [tag for tag in etags if request.if_none_match.contains(tag)]
+                    not_modified = bool(matching)
+                    if matching:
+                        etag = matching[0]
+                else:
+                    since = request.if_modified_since
+                    if since is not None and since.tzinfo is None:
+                        since = since.replace(tzinfo=timezone.utc)
+                    not_modified = since is not None and since >= modified
+
+                if not_modified and exists(*args, **kwargs):
+                    response = Response(status=304)
+                    response.vary.add("Accept-Encoding")
+                else:
+
+                    # errors carry no validators
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+
+                    if response.content_encoding:
+                        etag = etag + "-" + response.content_encoding
+
+                response.set_etag(etag)
+                response.last_modified = modified
+                return response
+
+            return wrapper
+
+        return decorator
+
+    def courses_exist(codes):
+        """Return whether there are results for every one of the distinct course codes"""
+
+        entries = connected_db.query(COURSES_EXIST_QUERY, (codes,))
+        return bool(entries) and entries[0]["courses"] == len(codes)
+
+    def batch_codes():
+        """Return the distinct course codes given in the codes parameter in the order they
+        were given, answering with 400 unless there are between 1 and MAX_BATCH_COURSES"""
+
+        codes = request.args.get("codes", "").split(",")
+        codes = list(dict.fromkeys(code for code in codes if code))
+
+        if not codes or len(codes) > app.config["MAX_BATCH_COURSES"]:
+            abort(400)
+
+        return codes
+
+    def encoded_response(encoding, body):
+        """Build JSON response from body, which has been compressed using encoding unless
+        encoding is None"""
+
+        response = Response(body, mimetype="application/json")
+        if encoding is not None:
+            response.content_encoding = encoding
+
+        # the body depends on Accept-Encoding, which caches in between have to respect
+        response.vary.add("Accept-Encoding")
+        return response
+
+    def cached(courses):
+        """Serve responses of the view from the response cache. Responses are compressed
+        using the best encoding the client accepts, and the compressed bodies are cached
+        next to the uncompressed ones so that every body is only compressed once.
+
+        :param courses: function called with the arguments of the view, returning the
+        course code the response concerns, a tuple of codes if it concerns several
+        courses, or None if it concerns every course; responses are cached by it
+        """
+
+        def decorator(view):
+
+            @functools.wraps(view)
+            def wrapper(*args, **kwargs):
+
+                # the host is part of the key since the responses contain external URLs
+                key = (view.__name__, courses(*args, **kwargs), request.host_url)
+                accepted = compression.negotiate(request.accept_encodings)
+                if accepted is not None:
+                    entry = response_cache.get(key + (accepted,))
+                    if entry is not None:
+                        return encoded_response(*entry)
+
+                generation = response_cache.generation
+                body = response_cache.get(key)
+                if body is None:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+
+                    body = response.get_data()
+                    response_cache.put(key, body, generation)
+
+                if accepted is None:
+                    return encoded_response(None, body)
+
+                # small bodies are cached as is under the encoding, to not retry
+                # compressing them
+                entry = compression.encode(body, accepted, app.config["COMPRESS_MIN_SIZE"])
+                response_cache.put(key + (accepted,), entry, generation)
+                return encoded_response(*entry)
+
+            return wrapper
+
+        return decorator
+
+    def json_response(value):
+        """Build JSON response from value using the serializer of course responses"""
+
+        return Response(serialization.dumps(value), mimetype="application/json")
+
     @app.route("/courses", methods=["GET"])
+    @conditional(lambda: True)
+    @cached(lambda: None)
     def get_courses():
-        """ Return list of courses with different course codes
+        """ Return list of courses from the course catalog, along with their adjusted fail
+        rate in percent as computed by the stats module
 
-        >>> get_courses() # doctest: +ELLIPSIS
-        '[...]'
+        >>> get_courses() # doctest: +SKIP
+        [
+            {
+                "code": "EDA322",
+                "name": "Digital konstruktion",
+                "sittings": 12,
+                "first_taken": "2014-03-12",
+                "last_taken": "2019-03-08",
+                "exams": 4,
+                "solutions": 2,
+                "adjusted_fail_rate": 33.3
+            },
+        ...
+        ]
 
         :return: string of JSONed course list
         """
 
-        entries = connected_db.query(
-            "SELECT DISTINCT ON (code) code, name FROM results")
+        entries = connected_db.query(COURSE_LIST_QUERY)
 
         logger.info("Sending course list")
-        return jsonify(entries)
+        return json_response(entries)
 
     # return list of results by date from given course code
     @app.route("/courses/<string:code>", methods=["GET"])
+    @conditional(lambda code: courses_exist([code]))
+    @cached(lambda code: code)
     def get_course(code):
-        """ Return all exam results associated with the given course code
+        """ Return all exam results associated with the given course code, each carrying
+        the adjusted fail rate of the course as in get_courses
 
         >>> get_course("EDA322") # doctest: +SKIP
         [
@@ -124,7 +357,8 @@ def create_app(production=False, test_db=None):
                 "fours": 15,
                 "name": "Digital konstruktion",
                 "taken": "2014-03-12",
-                "threes": 39
+                "threes": 39,
+                "adjusted_fail_rate": 33.3
             },
         ...
         ]
@@ -135,33 +369,99 @@ def create_app(production=False, test_db=None):
 
         # perform query using given course code
         # safe since using %s protects from SQL injections
-        entries = connected_db.query(
-            "SELECT exam, solution, failures, threes, fours, fives, taken, name, code FROM results "
-            "WHERE code=%s ORDER BY taken",
-            (code,))
+        entries = connected_db.query(COURSE_QUERY, (code,))
 
         # there were no matches on the course code
         if not entries:
             abort(404)
 
-        # format the entries nicely
-        for entry in entries:
+        logger.info("Responding to request for %s", code)
+        return json_response(serialization.format_results(
+            entries, url_for("get_courses", _external=True)))
+
+    @app.route("/courses/batch", methods=["GET"])
+    @conditional(lambda: courses_exist(batch_codes()))
+    @cached(lambda: tuple(batch_codes()))
+    def get_course_batch():
+        """ Return all exam results associated with each of the comma separated course codes
+        given in the codes parameter, grouped by course code
+
+        >>> get_course_batch() # doctest: +SKIP
+        {
+            "EDA322": [
+                {
+                    "code": "EDA322",
+                    "exam": "http://localhost:5000/exams/1989",
+                    ...
+                },
+            ...
+            ],
+            "EDA321": [...]
+        }
+
+        :return: JSONed dictionary mapping course codes to lists of exam results shaped as
+        in get_course
+        """
+        codes = batch_codes()
+        entries = connected_db.query(COURSE_BATCH_QUERY, (codes,))
 
-            # necessary since jsoned version of datetime has timestamp
-            entry["taken"] = str(entry["taken"])
+        courses = {code: [] for code in codes}
+        for entry in serialization.format_results(
+                entries, url_for("get_courses", _external=True)):
+            courses[entry["code"]].append(entry)
 
-            # give easy access to exam pdf
-            if entry["exam"] is not None:
-                entry["exam"] = url_for(
-                    "get_exam", code=code, date=entry["taken"], _external=True)
+        # answer the same way as get_course when any of the courses is missing
+        if not all(courses.values()):
+            abort(404)
 
-            # give easy access to solution pdf
-            if entry["solution"] is not None:
-                entry["solution"] = url_for(
-                    "get_solution", code=code, date=entry["taken"], _external=True)
+        logger.info("Responding to batch request for %s", ", ".join(codes))
+        return json_response(courses)
 
-        logger.info("Responding to request for %s", code)
-        return jsonify(entries)
+    def send_blob(digest):
+        """Stream the PDF stored under digest in chunks, answering requests for a single
+        byte range with 206 and only that range. The digest doubles as a strong ETag
+        since the contents stored under it never change."""
+
+        size = blob_store.size(digest)
+        if size is None:
+            abort(404)
+
+        if request.if_none_match.contains(digest):
+            response = Response(status=304)
+            response.set_etag(digest)
+            return response
+
+        # a range is only served if the client still has the same version of the PDF
+        ranges = request.range
+        if_range = request.if_range
+        if if_range.date is not None or (if_range.etag is not None and
+                                         if_range.etag != digest):
+            ranges = None
+
+        # multiple ranges are answered with the whole PDF
+        if ranges is not None and len(ranges.ranges) == 1:
+            span = ranges.range_for_length(size)
+            if span is None:
+                response = make_response(jsonify({"error": "Range not satisfiable"}), 416)
+                response.headers["Content-Range"] = "bytes */{}".format(size)
+                return response
+
+            start, end = span
+            status = 206
+        else:
+            start, end = 0, size
+            status = 200
+
+        # the chunks are read after the request has been torn down, so no connection
+        # is held while the client downloads
+        response = Response(blob_store.iter_range(digest, start, end), status=status,
+                            mimetype="application/pdf", direct_passthrough=True)
+        response.headers["Accept-Ranges"] = "bytes"
+        response.headers["Content-Length"] = str(end - start)
+        if status == 206:
+            response.headers["Content-Range"] = "bytes {}-{}/{}".format(start, end - 1, size)
+        response.set_etag(digest)
+        return response
 
     @app.route("/courses/<string:code>/<string:date>/exam", methods=["GET"])
     def get_exam(code, date):
@@ -175,14 +475,13 @@ def create_app(production=False, test_db=None):
         :param date: date when exam was taken
         :return: response containing exam pdf
         """
-        entries = connected_db.query(
-            "SELECT exam FROM results WHERE code=%s AND taken=%s", (code, date))
-        if not entries or entries[0]["exam"] is None:
+        entries = connected_db.query(PDF_QUERY.format(column="exam_hash"), (code, date))
+        if not entries or entries[0]["exam_hash"] is None:
             abort(404)
 
         logger.info(
             "Responding to request for exam in course %s taken on %s", code, date)
-        return send_file(io.BytesIO(entries[0]["exam"]), mimetype="application/pdf")
+        return send_blob(entries[0]["exam_hash"])
 
     @app.route("/courses/<string:code>/<string:date>/solution", methods=["GET"])
     def get_solution(code, date):
@@ -196,100 +495,112 @@ def create_app(production=False, test_db=None):
         :param date: date when exam was taken
         :return: response containing exam pdf
         """
-        entries = connected_db.query(
-            "SELECT solution FROM results WHERE code=%s AND taken=%s", (code, date))
-        if not entries or entries[0]["solution"] is None:
+        entries = connected_db.query(PDF_QUERY.format(column="solution_hash"), (code, date))
+        if not entries or entries[0]["solution_hash"] is None:
             abort(404)
 
         logger.info(
             "Responding to request for solution in course %s taken on %s", code, date)
-        return send_file(io.BytesIO(entries[0]["solution"]), mimetype="application/pdf")
-
-    # submit exam pdf suggestion in base64 encoding
-    @app.route("/courses/<string:code>/<string:date>/exam", methods=["PUT"])
-    def put_suggestion(code, date):
-        """ Submit exam PDF suggestion in base64 encoding to exam suggestions table
+        return send_blob(entries[0]["solution_hash"])
 
-        >>> put_suggestion(code, date) # doctest: +SKIP
-        <Response 0 bytes [200 OK]>
+    def read_upload(kind):
+        """Read the PDF uploaded in the body of the request, either as is with the content
+        type application/pdf, as the file field named kind of a multipart/form-data body,
+        or base64 encoded in the field named kind of a JSON body. The first two are
+        streamed to a temporary file, the latter is kept for older clients.
 
-
-        :param code: course code for the exam
-        :return: empty response with response code indicating success of operation
+        :param kind: either exam or solution
+        :return: digest of the PDF, and binary file object holding it
         """
-        content = request.json
-
-        # make sure data is non-empty
-        if not content:
-            abort(400)
-
-        # we need the actual exam, and it should also be a string
-        if "exam" in content and not isinstance(content["exam"], str):
-            abort(400)
-
-        # check that the exam exists
-        exam = connected_db.query(
-            "SELECT exam FROM results WHERE code=%s AND taken=%s", (code, date))
+        if request.mimetype == "application/pdf":
+            stream = request.stream
+
+        elif request.mimetype == "multipart/form-data":
+            upload = request.files.get(kind)
+            if upload is None:
+                abort(400)
+            stream = upload.stream
+
+        elif request.is_json:
+            content = request.get_json(silent=True)
+
+            # we need the actual pdf, and it should also be a string
+            if not content or not isinstance(content.get(kind), str):
+                abort(400)
+
+            # convert base64 into bytes object
+            data = base64.b64decode(content[kind])
+            return blob_hash(data), io.BytesIO(data)
+
+        else:
+            abort(415)
+
+        try:
+            return spool_file(stream, max_size=app.config["MAX_UPLOAD_SIZE"])
+        except BlobTooLarge:
+            abort(413)
+
+    def put_pdf_suggestion(code, date, kind):
+        """Store the PDF uploaded for the exam taken in course code on date, and suggest it
+        as the exam or solution of that exam depending on kind"""
+
+        # refuse oversized uploads before reading any of them
+        length = request.content_length
+        if length is not None and length > app.config["MAX_UPLOAD_SIZE"]:
+            abort(413)
+
+        # check that the exam exists, column is either exam_hash or solution_hash
+        column = SUGGESTION_COLUMNS[kind]
+        exam = connected_db.query(PDF_QUERY.format(column=column), (code, date))
         if not exam:
             abort(404)
 
-        # check if exam file is already present
-        if exam[0]["exam"] is not None:
+        # check if file is already present
+        if exam[0][column] is not None:
             abort(409)  # conflict
 
-        # convert base64 into bytes object
-        decoded = base64.b64decode(content["exam"])
+        digest, upload = read_upload(kind)
 
-        # insert binary data as an exam suggestion
-        connected_db.query(
-            "INSERT INTO exam_suggestions (taken, code, exam) VALUES (%s, %s, %s)",
-            (date, code, decoded))
+        # store the pdf and reference it in an exam suggestion, identical submissions are
+        # collapsed
+        with upload:
+            submissions = add_suggestion(code, date, kind, digest, connected_db, blob_store,
+                                         upload)
+        if submissions is None:
+            abort(409)  # the identical pdf has already been approved
 
-        logger.info("Inserting exam suggestion for code %s", code)
+        logger.info("Inserting %s suggestion for code %s, submitted %d times", kind, code,
+                    submissions)
         return Response(status=200)
 
-    # submit solution pdf suggestion in base64 encoding
-    @app.route("/courses/<string:code>/<string:date>/solution", methods=["PUT"])
-    def put_solution_suggestion(code, date):
-        """ Submit exam solution PDF suggestion in base64 encoding to exam suggestions table
+    @app.route("/courses/<string:code>/<string:date>/exam", methods=["PUT"])
+    def put_suggestion(code, date):
+        """ Submit exam PDF suggestion to exam suggestions table, the PDF is sent as the
+        body with content type application/pdf, as the file field exam of a
+        multipart/form-data body, or base64 encoded in the field exam of a JSON body
 
-        >>> put_solution_suggestion(code, date) # doctest: +SKIP
+        >>> put_suggestion(code, date) # doctest: +SKIP
         <Response 0 bytes [200 OK]>
 
 
         :param code: course code for the exam
         :return: empty response with response code indicating success of operation
         """
-        content = request.json
-
-        # make sure data is non-empty
-        if not content:
-            abort(400)
+        return put_pdf_suggestion(code, date, "exam")
 
-        # we need the actual pdf, and it should also be a string
-        if "solution" in content and not isinstance(content["solution"], str):
-            abort(400)
-
-        # check that the exam exists
-        exam = connected_db.query(
-            "SELECT solution FROM results WHERE code=%s AND taken=%s", (code, date))
-        if not exam:
-            abort(404)
-
-        # check if exam file is already present
-        if exam[0]["solution"] is not None:
-            abort(409)  # conflict
+    @app.route("/courses/<string:code>/<string:date>/solution", methods=["PUT"])
+    def put_solution_suggestion(code, date):
+        """ Submit exam solution PDF suggestion to exam suggestions table, sent the same
+        ways as for put_suggestion using the field name solution
 
-        # convert base64 into bytes object
-        decoded = base64.b64decode(content["solution"])
+        >>> put_solution_suggestion(code, date) # doctest: +SKIP
+        <Response 0 bytes [200 OK]>
 
-        # insert binary data as an exam suggestion
-        connected_db.query(
-            "INSERT INTO exam_suggestions (taken, code, solution) VALUES (%s, %s, %s)",
-            (date, code, decoded))
 
-        logger.info("Inserting solution suggestion for code %s", code)
-        return Response(status=200)
+        :param code: course code for the exam
+        :return: empty response with response code indicating success of operation
+        """
+        return put_pdf_suggestion(code, date, "solution")
 
     @app.errorhandler(400)
     def bad_request(_):
@@ -312,4 +623,18 @@ def create_app(production=False, test_db=None):
         logger.error("RESOURCE ALREADY EXISTS: %s", request.url)
         return make_response(jsonify({"error": "Resource already present"}), 409)
 
+    @app.errorhandler(413)
+    def too_large(_):
+        """Return JSON response indicating that the upload was too large (413)"""
+
+        logger.error("UPLOAD TOO LARGE: %s", request.url)
+        return make_response(jsonify({"error": "Upload too large"}), 413)
+
+    @app.errorhandler(415)
+    def unsupported_media_type(_):
+        """Return JSON response indicating that the upload was of an unsupported type (415)"""
+
+        logger.error("UNSUPPORTED MEDIA TYPE: %s", request.url)
+        return make_response(jsonify({"error": "Unsupported media type"}), 415)
+
     return app
@@ -0,0 +1,404 @@
+"""
+Content-addressed storage for exam and solution PDFs. Every blob is keyed by the hex
+encoded SHA-256 digest of its contents, meaning that identical files are only stored
+once, and that the results and exam_suggestions tables only have to keep a reference
+to the digest. Two backends are provided: one keeping the blobs in the blobs table of
+the postgres database, and one keeping them as files in a local directory.
+"""
+
+import os
+import re
+import hashlib
+import tempfile
+
+
+# hex encoded SHA-256 digest, used to validate references before touching storage
+DIGEST_PATTERN = re.compile("^[0-9a-f]{64}$")
+
+# number of bytes read from storage at a time when streaming a blob
+CHUNK_SIZE = 256 * 1024
+
+
+class BlobTooLarge(Exception):
+    """Raised when a blob being stored from a file exceeds the maximum size."""
+
+
+def blob_hash(data):
+    """ Compute the key used to store the given data
+
+    >>> blob_hash(b"") # doctest: +ELLIPSIS
+    'e3b0c44298fc1c149afbf4c8996fb924...'
+
+    :param data: bytes to compute digest of
+    :return: hex encoded SHA-256 digest of data
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def _copy_hashing(source, destination, max_size=None, chunk_size=CHUNK_SIZE):
+    """ Copy the contents of file object source to destination one chunk at a time,
+    computing their digest on the way
+
+    :param source: binary file object to read from
+    :param destination: binary file object to write to
+    :param max_size: maximum number of bytes to copy before raising BlobTooLarge
+    :param chunk_size: number of bytes to read at a time
+    :return: digest of the copied contents
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = source.read(chunk_size)
+        if not chunk:
+            return hasher.hexdigest()
+
+        size += len(chunk)
+        if max_size is not None and size > max_size:
+            raise BlobTooLarge("Blob exceeds {} bytes".format(max_size))
+
+        hasher.update(chunk)
+        destination.write(chunk)
+
+
+def spool_file(file, max_size=None):
+    """ Copy the contents of a file object to a temporary file while hashing them, so that
+    their digest is known before they are stored. The temporary file is only written to
+    disk once the contents exceed CHUNK_SIZE.
+
+    >>> digest, spool = spool_file(request.stream) # doctest: +SKIP
+
+    :param file: binary file object to read the contents from
+    :param max_size: maximum size in bytes, BlobTooLarge is raised for larger contents
+    :return: digest of the contents, and the temporary file positioned at their start,
+    which the caller has to close
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE)
+    try:
+        digest = _copy_hashing(file, spool, max_size)
+    except BaseException:
+        spool.close()
+        raise
+
+    spool.seek(0)
+    return digest, spool
+
+
+class PostgresBlobStore:
+    """Blob store keeping PDFs in the blobs table of the database behind the given
+    DBInterface instance."""
+
+    def __init__(self, connected_db):
+        """ Save DBInterface instance used for all operations on the blobs table """
+
+        self.connected_db = connected_db
+
+    def put(self, data):
+        """ Store data unless an identical blob is already present
+
+        >>> put(file_bytes) # doctest: +SKIP
+        '9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08'
+
+        :param data: bytes to store
+        :return: digest under which the data can be retrieved
+        """
+        digest = blob_hash(data)
+
+        # avoid sending the data to the database when it is already stored
+        if self.exists(digest):
+            return digest
+
+        self.connected_db.query(
+            "INSERT INTO blobs (hash, size, data) VALUES (%s, %s, %s) "
+            "ON CONFLICT (hash) DO NOTHING",
+            (digest, len(data), data))
+
+        return digest
+
+    def put_file(self, file, max_size=None):
+        """ Store the contents of a file object unless an identical blob is already
+        present. The contents are spooled to a temporary file while being hashed, so they
+        are only held in memory at once if they have to be inserted.
+
+        >>> put_file(request.stream, max_size=20 * 1024 * 1024) # doctest: +SKIP
+        '9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08'
+
+        :param file: binary file object to read the contents from
+        :param max_size: maximum size in bytes, BlobTooLarge is raised for larger contents
+        :return: digest under which the contents can be retrieved
+        """
+        with tempfile.SpooledTemporaryFile(max_size=CHUNK_SIZE) as spool:
+            digest = _copy_hashing(file, spool, max_size)
+            if self.exists(digest):
+                return digest
+
+            size = spool.tell()
+            spool.seek(0)
+            self.connected_db.query(
+                "INSERT INTO blobs (hash, size, data) VALUES (%s, %s, %s) "
+                "ON CONFLICT (hash) DO NOTHING",
+                (digest, size, spool.read()))
+
+        return digest
+
+    def get(self, digest):
+        """ Retrieve blob stored under digest
+
+        :param digest: digest returned when storing the blob
+        :return: bytes of blob, or None if there is no such blob
+        """
+        entries = self.connected_db.query(
+            "SELECT data FROM blobs WHERE hash=%s", (digest,))
+        if not entries:
+            return None
+
+        return bytes(entries[0]["data"])
+
+    def size(self, digest):
+        """ Return the size in bytes of the blob stored under digest, or None if there is
+        no such blob """
+
+        entries = self.connected_db.query(
+            "SELECT size FROM blobs WHERE hash=%s", (digest,))
+        if not entries:
+            return None
+
+        return entries[0]["size"]
+
+    def iter_range(self, digest, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """ Read the bytes from start up to, but not including, end of the blob stored
+        under digest, one chunk at a time. Each chunk is fetched with its own query,
+        which only reads the pages of the blob holding the chunk since the blobs are
+        stored uncompressed, and no connection is held in between chunks.
+
+        >>> b"".join(blob_store.iter_range(digest, 0, 4)) # doctest: +SKIP
+        b'%PDF'
+
+        :param digest: digest returned when storing the blob
+        :param start: offset of the first byte to read
+        :param end: offset after the last byte to read, defaults to the end of the blob
+        :param chunk_size: maximum number of bytes in each chunk
+        :return: generator of bytes objects
+        """
+        if end is None:
+            end = self.size(digest) or 0
+
+        # substring counts from 1
+        for offset in range(start, end, chunk_size):
+            entries = self.connected_db.query(
+                "SELECT substring(data FROM %s FOR %s) AS chunk FROM blobs WHERE hash=%s",
+                (offset + 1, min(chunk_size, end - offset), digest))
+            if not entries:
+                return
+
+            yield bytes(entries[0]["chunk"])
+
+    def exists(self, digest):
+        """ Check whether a blob is stored under digest """
+
+        return bool(self.connected_db.query(
+            "SELECT 1 FROM blobs WHERE hash=%s", (digest,)))
+
+    def delete(self, digest):
+        """ Remove blob stored under digest, does nothing if there is no such blob """
+
+        self.connected_db.query("DELETE FROM blobs WHERE hash=%s", (digest,))
+
+
+class FileBlobStore:
+    """Blob store keeping PDFs as files in a local directory. Files are spread over
+    subdirectories named after the first two characters of the digest to keep the
+    directories reasonably small."""
+
+    def __init__(self, directory):
+        """ Create the directory used for storing blobs if it doesn't already exist """
+
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, digest):
+        """ Return path of the file holding the blob stored under digest """
+
+        # never let a malformed reference escape the blob directory
+        if not DIGEST_PATTERN.match(digest):
+            raise ValueError("Invalid blob digest: " + repr(digest))
+
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def put(self, data):
+        """ Store data unless an identical blob is already present
+
+        :param data: bytes to store
+        :return: digest under which the data can be retrieved
+        """
+        digest = blob_hash(data)
+        path = self._path(digest)
+
+        if os.path.exists(path):
+            return digest
+
+        # write to temporary file first so that readers never see a partial blob
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        file_descriptor, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        try:
+            with os.fdopen(file_descriptor, "wb") as file:
+                file.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+        return digest
+
+    def put_file(self, file, max_size=None):
+        """ Store the contents of a file object unless an identical blob is already
+        present, copying them to a temporary file in the blob directory while hashing them
+
+        :param file: binary file object to read the contents from
+        :param max_size: maximum size in bytes, BlobTooLarge is raised for larger contents
+        :return: digest under which the contents can be retrieved
+        """
+        file_descriptor, temp_path = tempfile.mkstemp(dir=self.directory)
+        try:
+            with os.fdopen(file_descriptor, "wb") as temp_file:
+                digest = _copy_hashing(file, temp_file, max_size)
+
+            path = self._path(digest)
+            if os.path.exists(path):
+                os.remove(temp_path)
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        return digest
+
+    def get(self, digest):
+        """ Retrieve blob stored under digest
+
+        :param digest: digest returned when storing the blob
+        :return: bytes of blob, or None if there is no such blob
+        """
+        try:
+            with open(self._path(digest), "rb") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def size(self, digest):
+        """ Return the size in bytes of the blob stored under digest, or None if there is
+        no such blob """
+
+        try:
+            return os.path.getsize(self._path(digest))
+        except FileNotFoundError:
+            return None
+
+    def iter_range(self, digest, start=0, end=None, chunk_size=CHUNK_SIZE):
+        """ Read the bytes from start up to, but not including, end of the blob stored
+        under digest, one chunk at a time
+
+        :param digest: digest returned when storing the blob
+        :param start: offset of the first byte to read
+        :param end: offset after the last byte to read, defaults to the end of the blob
+        :param chunk_size: maximum number of bytes in each chunk
+        :return: generator of bytes objects
+        """
+        try:
+            file = open(self._path(digest), "rb")
+        except FileNotFoundError:
+            return
+
+        with file:
+            file.seek(start)
+            remaining = None if end is None else end - start
+            while remaining is None or remaining > 0:
+                chunk = file.read(chunk_size if remaining is None else min(chunk_size, remaining))
+                if not chunk:
+                    return
+
+                if remaining is not None:
+                    remaining -= len(chunk)
+                yield chunk
+
+    def exists(self, digest):
+        """ Check whether a blob is stored under digest """
+
+        return os.path.exists(self._path(digest))
+
+    def delete(self, digest):
+        """ Remove blob stored under digest, does nothing if there is no such blob """
+
+        try:
+            os.remove(self._path(digest))
+        except FileNotFoundError:
+            pass
+
+
+def create_blob_store(connected_db, directory=None):
+    """ Create the blob store to use given the configuration
+
+    >>> create_blob_store(connected_db) # doctest: +ELLIPSIS +SKIP
+    <tentahjalpen.blob_store.PostgresBlobStore object at ...>
+
+    :param connected_db: DBInterface instance used by the postgres backend
+    :param directory: directory to keep blobs in, postgres is used if not given
+    :return: blob store instance
+    """
+    if directory:
+        return FileBlobStore(directory)
+
+    return PostgresBlobStore(connected_db)
+
+
+def move_blobs(connected_db, blob_store):
+    """ Move every blob in the blobs table into blob_store, one at a time. Databases
+    migrated from the schema that kept the PDFs in the results and exam_suggestions tables
+    have them in the blobs table, where a deployment keeping its blobs in a directory
+    can't find them. Does nothing if blob_store is the blobs table itself.
+
+    >>> move_blobs(connected_db, FileBlobStore("/var/lib/tentahjalpen")) # doctest: +SKIP
+    12
+
+    :param connected_db: DBInterface instance of the database holding the blobs table
+    :param blob_store: blob store to move the blobs to
+    :return: number of blobs moved
+    """
+    if isinstance(blob_store, PostgresBlobStore):
+        return 0
+
+    source = PostgresBlobStore(connected_db)
+    digests = [entry["hash"] for entry in connected_db.query("SELECT hash FROM blobs")]
+    for digest in digests:
+
+        # only removed once stored intact, so an interrupted move can simply be resumed
+        if blob_store.put(source.get(digest)) != digest:
+            raise ValueError("Blob stored under {} doesn't match its digest".format(digest))
+        source.delete(digest)
+
+    return len(digests)
+
+
+def rewrite_blobs(connected_db):
+    """ Rewrite the blobs in the blobs table which are stored compressed, as those stored
+    before the storage of their data was made external may be, so that ranges of them can
+    be read without decompressing them whole. Every blob is rewritten by a statement of
+    its own, so the blobs can be served meanwhile and an interrupted rewrite resumed.
+
+    >>> rewrite_blobs(connected_db) # doctest: +SKIP
+    12
+
+    :param connected_db: DBInterface instance of the database holding the blobs table
+    :return: number of blobs rewritten
+    """
+
+    # compressed data takes up less space than its length, uncompressed data doesn't
+    digests = [entry["hash"] for entry in connected_db.query(
+        "SELECT hash FROM blobs WHERE pg_column_size(data) < octet_length(data)")]
+    for digest in digests:
+        connected_db.query("UPDATE blobs SET data = data || ''::BYTEA WHERE hash=%s",
+                           (digest,))
+
+    return len(digests)
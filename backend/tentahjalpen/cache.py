@@ -0,0 +1,177 @@
+"""
+In-process cache of serialized course responses. Every worker keeps its own size bounded
+cache, which is invalidated per course code by the notifications the triggers on the
+results table send on the results_changed channel. The cache is only used while the
+worker is listening for those notifications, so a worker that has lost its listening
+connection falls back to querying the database rather than risk serving stale data.
+"""
+
+import select
+import logging
+import threading
+from collections import OrderedDict
+
+import psycopg2
+
+
+# channel the triggers on results notify with the changed course codes
+RESULTS_CHANNEL = "results_changed"
+
+# payload sent instead of the course codes when too many courses changed at once
+ALL_COURSES = "*"
+
+
+class ResponseCache:
+    """Least recently used cache of at most maxsize responses. Keys are tuples whose
+    second item is the course code the response concerns, a tuple of the course codes
+    for responses concerning several courses, or None for responses concerning every
+    course."""
+
+    def __init__(self, maxsize=512):
+        """ Create empty cache, disabled until enable is called
+
+        :param maxsize: maximum number of responses to keep
+        """
+        self.maxsize = maxsize
+        self.enabled = False
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._generation = 0
+
+    @property
+    def generation(self):
+        """ Counter increased by every invalidation, pass it to put to avoid caching a
+        response built from data that was invalidated while building it """
+
+        with self._lock:
+            return self._generation
+
+    def get(self, key):
+        """ Return cached response, or None if it isn't cached """
+
+        with self._lock:
+            if not self.enabled or key not in self._entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key, value, generation):
+        """ Cache response unless the cache has been invalidated since generation
+
+        :param key: tuple of the response kind and the course code or codes it concerns
+        :param value: response to cache
+        :param generation: value of the generation property before the response was built
+        """
+        with self._lock:
+            if not self.enabled or generation != self._generation or self.maxsize <= 0:
+                return
+
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, codes=None):
+        """ Drop the cached responses concerning the given course codes, together with the
+        responses concerning every course
+
+        :param codes: iterable of course codes, every response is dropped if not given
+        """
+        with self._lock:
+            self._generation += 1
+            if codes is None:
+                self._entries.clear()
+                return
+
+            codes = set(codes)
+            for key in [key for key in self._entries if self._concerns(key, codes)]:
+                del self._entries[key]
+
+    @staticmethod
+    def _concerns(key, codes):
+        """ Return whether the response cached under key concerns any of the codes """
+
+        if key[1] is None:
+            return True
+
+        if isinstance(key[1], tuple):
+            return not codes.isdisjoint(key[1])
+
+        return key[1] in codes
+
+    def enable(self, enabled=True):
+        """ Start or stop using the cache, it is emptied either way """
+
+        self.invalidate()
+        with self._lock:
+            self.enabled = enabled
+
+
+class NotificationListener(threading.Thread):
+    """Daemon thread listening for notifications on a channel using its own connection,
+    calling on_notification with the payload of every notification."""
+
+    def __init__(self, connect, channel, on_notification, on_connection, retry_interval=5.0):
+        """ Create listener, call start to begin listening
+
+        :param connect: function returning a new psycopg2 connection
+        :param channel: channel to listen on
+        :param on_notification: function called with the payload of every notification
+        :param on_connection: function called with True once listening and with False when
+        the connection has been lost, notifications may have been missed in between
+        :param retry_interval: seconds to wait before reconnecting after an error
+        """
+        super().__init__(name="listener-" + channel, daemon=True)
+        self.connect = connect
+        self.channel = channel
+        self.on_notification = on_notification
+        self.on_connection = on_connection
+        self.retry_interval = retry_interval
+        self._stopped = threading.Event()
+        self._logger = logging.getLogger(__name__)
+
+    def stop(self):
+        """ Stop listening, the connection is closed within a second """
+
+        self._stopped.set()
+
+    def run(self):
+        """ Listen for notifications until stopped, reconnecting on errors """
+
+        while not self._stopped.is_set():
+            connection = None
+            try:
+                connection = self.connect()
+                connection.autocommit = True
+                with connection.cursor() as cursor:
+                    cursor.execute("LISTEN " + self.channel)
+
+                self.on_connection(True)
+                self._listen(connection)
+
+            except psycopg2.Error:
+                self._logger.exception("Listening on %s failed, retrying", self.channel)
+                self.on_connection(False)
+                self._stopped.wait(self.retry_interval)
+
+            finally:
+                if connection is not None and not connection.closed:
+                    connection.close()
+
+        self.on_connection(False)
+
+    def _listen(self, connection):
+        """ Dispatch notifications arriving on connection until stopped """
+
+        while not self._stopped.is_set():
+            if select.select([connection], [], [], 1.0) == ([], [], []):
+                continue
+
+            connection.poll()
+            while connection.notifies:
+                self.on_notification(connection.notifies.pop(0).payload)
@@ -0,0 +1,60 @@
+"""
+Compression of JSON response bodies. The encoding is negotiated from the Accept-Encoding
+header of the request, preferring brotli over gzip. Brotli is only offered when the brotli
+package is installed, gzip is always available.
+"""
+
+import gzip
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+# encodings offered to clients, in order of preference
+ENCODINGS = ["br", "gzip"] if brotli is not None else ["gzip"]
+
+# compressed bodies are cached, so they are worth compressing hard
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+
+def negotiate(accept_encodings):
+    """ Pick the encoding to compress a response with
+
+    >>> negotiate(request.accept_encodings) # doctest: +SKIP
+    'gzip'
+
+    :param accept_encodings: werkzeug Accept object parsed from the Accept-Encoding header
+    :return: name of the encoding, or None if the client accepts none of ENCODINGS
+    """
+    return accept_encodings.best_match(ENCODINGS)
+
+
+def encode(body, encoding, min_size=1024):
+    """ Compress body using encoding, unless it is too small to be worth compressing or
+    compressing it doesn't make it smaller
+
+    >>> encode(b"[]", "gzip")
+    (None, b'[]')
+
+    :param body: bytes to compress
+    :param encoding: one of ENCODINGS
+    :param min_size: size in bytes below which body is left uncompressed
+    :return: tuple of the encoding used, None if left uncompressed, and the resulting bytes
+    """
+    if len(body) < min_size:
+        return None, body
+
+    if encoding == "br":
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    elif encoding == "gzip":
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    else:
+        raise ValueError("Unsupported encoding: " + repr(encoding))
+
+    if len(compressed) >= len(body):
+        return None, body
+
+    return encoding, compressed
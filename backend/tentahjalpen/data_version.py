@@ -0,0 +1,57 @@
+"""
+Tracking of the version of the course data. The data_version table holds a counter that
+triggers on the results table bump whenever a statement changes any results, together with
+the time of the change. The version is used as the ETag of the course responses, and is
+remembered for a short while so that conditional requests can be answered without querying
+the database.
+"""
+
+import time
+import threading
+from datetime import timezone
+
+
+class DataVersion:
+    """Remembers the version of the course data in the database behind the given
+    DBInterface instance for ttl seconds at a time."""
+
+    def __init__(self, connected_db, ttl=5.0):
+        """ Save DBInterface instance used when looking up the version
+
+        :param connected_db: DBInterface instance of the database holding the course data
+        :param ttl: seconds to remember a version for before looking it up again
+        """
+        self.connected_db = connected_db
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._current = None
+        self._expires = 0.0
+
+    def get(self):
+        """ Return the current version of the course data
+
+        >>> data_version.get() # doctest: +SKIP
+        (42, datetime.datetime(2019, 5, 1, 12, 0, tzinfo=datetime.timezone.utc))
+
+        :return: tuple of the version number and the time of the last change in UTC,
+        truncated to whole seconds as used in HTTP dates
+        """
+        with self._lock:
+            if self._current is not None and time.monotonic() < self._expires:
+                return self._current
+
+        entry = self.connected_db.query("SELECT version, modified FROM data_version")[0]
+        current = (entry["version"],
+                   entry["modified"].astimezone(timezone.utc).replace(microsecond=0))
+
+        with self._lock:
+            self._current = current
+            self._expires = time.monotonic() + self.ttl
+
+        return current
+
+    def invalidate(self):
+        """ Forget the remembered version, making the next call to get look it up again """
+
+        with self._lock:
+            self._current = None
@@ -6,36 +6,121 @@ database and scraping chalmerstenta.se for new exam_suggestions automatically.
 
 import os
 import webbrowser
+from contextlib import contextmanager
+from functools import partial
+from flask import g, has_app_context
 from tabulate import tabulate
 import psycopg2
 import psycopg2.extras
 
+from .blob_store import PostgresBlobStore
+from .pool import ConnectionPool
+from .migrations import migrate
 
-class DBInterface: # pylint: disable=too-few-public-methods
+
+class DBInterface:
     """Class to increase convenience in interfacing with a postgres database using the
     psycopg2 module. Connections can be established either using keyword arguments, or
     a connection URL. The class allows for effortless passing of testing databases for
-    mocking purposes."""
+    mocking purposes.
+
+    Passing max_connections switches to pooled mode, where connections are taken from a
+    ConnectionPool instead of sharing a single one. Within a Flask app context the same
+    connection is used until release() is called when the context is torn down, outside
+    of one a connection is checked out for every query or transaction."""
 
     def __init__(self, **kwargs):
-        """ Establish persistent connection to Postgres database using connection parameters """
+        """ Establish persistent connection to Postgres database using connection parameters,
+        or a pool of them if max_connections is given. The optional arguments
+        min_connections and pool_timeout set the number of connections kept open while
+        idle and the seconds to wait for a connection when the pool is exhausted. """
 
-        if kwargs.get("url", None) is not None:
-            self.connection = psycopg2.connect(kwargs["url"])
+        self.connection = None
+        self.pool = None
 
-        elif kwargs.get("test_connection", None) is not None:
+        if kwargs.get("test_connection", None) is not None:
             self.connection = kwargs["test_connection"]
+            self._connect = partial(psycopg2.connect, self.connection.dsn)
+
+            # avoid having to commit manually
+            self.connection.autocommit = True
+            return
+
+        if kwargs.get("url", None) is not None:
+            connect = partial(psycopg2.connect, kwargs["url"])
 
         elif kwargs.get("test_connection_url", None) is not None:
-            self.connection = psycopg2.connect(kwargs["test_connection_url"])
+            connect = partial(psycopg2.connect, kwargs["test_connection_url"])
 
         else:
-            self.connection = psycopg2.connect(dbname=kwargs["dbname"], user=kwargs["user"],
-                                               password=kwargs["password"], host=kwargs["host"],
-                                               port=kwargs["port"], sslmode=kwargs["sslmode"])
+            connect = partial(psycopg2.connect, dbname=kwargs["dbname"], user=kwargs["user"],
+                              password=kwargs["password"], host=kwargs["host"],
+                              port=kwargs["port"], sslmode=kwargs["sslmode"])
+
+        self._connect = connect
+
+        if kwargs.get("max_connections", None) is not None:
+            self.pool = ConnectionPool(kwargs.get("min_connections", 1),
+                                       kwargs["max_connections"], connect,
+                                       timeout=kwargs.get("pool_timeout", 30.0))
+        else:
+            self.connection = connect()
+
+            # avoid having to commit manually
+            self.connection.autocommit = True
+
+    def connect(self):
+        """ Open a new connection to the database that is neither shared nor pooled, such
+        as for listening for notifications. The caller is responsible for closing it.
+
+        :return: psycopg2 connection
+        """
+        return self._connect()
+
+    @contextmanager
+    def _checkout(self):
+        """ Provide the connection to use for the current operation """
+
+        if self.pool is None:
+            yield self.connection
+
+        # keep using the connection checked out for the current app context
+        elif has_app_context():
+            key = "db_connection_" + str(id(self))
+            if key not in g:
+                setattr(g, key, self.pool.getconn())
+            yield getattr(g, key)
+
+        else:
+            connection = self.pool.getconn()
+            try:
+                yield connection
+            finally:
+                self.pool.putconn(connection)
+
+    def release(self):
+        """ Return the connection checked out for the current app context to the pool,
+        does nothing if no connection is checked out or the instance isn't pooled """
 
-        # avoid having to commit manually
-        self.connection.autocommit = True
+        if self.pool is None or not has_app_context():
+            return
+
+        connection = g.pop("db_connection_" + str(id(self)), None)
+        if connection is not None:
+            self.pool.putconn(connection)
+
+    def pool_stats(self):
+        """ Return statistics of the connection pool, see ConnectionPool.stats
+
+        >>> pool_stats() # doctest: +SKIP
+        {'size': 2, 'idle': 1, 'in_use': 1, 'waiting': 0, 'checkouts': 40, ...}
+
+        :return: dictionary of pool statistics, or None if the instance isn't pooled
+        """
+        if self.pool is None:
+            return None
+
+        return self.pool.stats()
 
     def query(self, query, args=None):
         """ Executes query string with optional arguments
@@ -52,55 +137,239 @@ class DBInterface: # pylint: disable=too-few-public-methods
         :return: dictionary of entries
         """
 
+        # a pooled connection that the server dropped while it was idle is only noticed
+        # once it is used, in which case it is discarded and the query tried once more
+        # using another connection
+        for attempt in range(2):
+
+            # gather connection
+            with self._checkout() as connected_db:
+
+                # create cursor reference
+                cursor = connected_db.cursor(
+                    cursor_factory=psycopg2.extras.RealDictCursor)
+
+                try:
+                    if args is None:
+                        cursor.execute(query)
+
+                    # execute query safely provided string uses %s token
+                    else:
+                        cursor.execute(query, args)
+
+                    if cursor.description is not None:
+                        return cursor.fetchall()
+
+                    return None
+
+                except psycopg2.DataError:
+                    connected_db.rollback()
+                    return []
+
+                except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                    if self.pool is None or not connected_db.closed or attempt > 0:
+                        raise
+
+            # return the broken connection checked out for the app context
+            self.release()
+
+    @contextmanager
+    def transaction(self):
+        """ Execute statements in a single transaction, committed when the block exits
+        and rolled back if it raises
+
+        >>> with connected_db.transaction() as cursor: # doctest: +SKIP
+        ...     cursor.execute("DELETE FROM EXAMPLE")
+
+        :return: RealDictCursor to execute the statements with
+        """
+
         # gather connection
-        connected_db = self.connection
+        with self._checkout() as connected_db:
 
-        # create cursor reference
-        cursor = connected_db.cursor(
-            cursor_factory=psycopg2.extras.RealDictCursor)
+            connected_db.autocommit = False
+            try:
+                with connected_db:
+                    with connected_db.cursor(
+                            cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                        yield cursor
+            finally:
+                if not connected_db.closed:
+                    connected_db.autocommit = True
 
-        try:
-            if args is None:
-                cursor.execute(query)
 
-            # execute query safely provided string uses %s token
-            else:
-                cursor.execute(query, args)
+class CursorInterface:
+    """Stand-in for DBInterface executing every query with the given cursor, typically of
+    a transaction, so that code written against DBInterface such as PostgresBlobStore
+    takes part in that transaction."""
 
-            if cursor.description is not None:
-                return cursor.fetchall()
+    def __init__(self, cursor):
+        """ Save cursor used for all queries """
 
-            return None
+        self.cursor = cursor
+
+    def query(self, query, args=None):
+        """ Executes query string with optional arguments, see DBInterface.query. Errors
+        are raised rather than rolling back, which is left to the transaction.
+
+        :param query: string query to execute
+        :param args: tuple of strings to insert on '%s' in query
+        :return: dictionary of entries, or None for statements not returning any
+        """
+        self.cursor.execute(query, args)
+        if self.cursor.description is not None:
+            return self.cursor.fetchall()
+
+        return None
 
-        except psycopg2.DataError:
-            connected_db.rollback()
-            return []
+
+def transaction_blob_store(blob_store, cursor):
+    """ Return blob store taking part in the transaction of cursor if blob_store keeps the
+    blobs in the database, which is used if blob_store is None. Other blob stores are
+    returned as they are, since files can't be part of a transaction.
+
+    :param blob_store: blob store to use, or None
+    :param cursor: cursor of the transaction
+    :return: blob store instance
+    """
+    if blob_store is None or isinstance(blob_store, PostgresBlobStore):
+        return PostgresBlobStore(CursorInterface(cursor))
+
+    return blob_store
+
+
+# column of results and exam_suggestions referencing the PDF of each kind of suggestion
+SUGGESTION_COLUMNS = {"exam": "exam_hash", "solution": "solution_hash"}
+
+# queries performed by the routes of the API, which tests/test_indexes.py verifies are
+# served by indexes
+COURSE_LIST_QUERY = (
+    "SELECT code, name, course_catalog.sittings, first_taken, last_taken, exams, "
+    "solutions, adjusted_fail_rate FROM course_catalog "
+    "LEFT JOIN course_stats USING (code) ORDER BY code")
+
+COURSE_QUERY = (
+    "SELECT exam_hash AS exam, solution_hash AS solution, failures, threes, fours, fives, "
+    "taken, name, code, adjusted_fail_rate FROM results "
+    "LEFT JOIN course_stats USING (code) WHERE code=%s ORDER BY taken")
+
+COURSE_BATCH_QUERY = (
+    "SELECT exam_hash AS exam, solution_hash AS solution, failures, threes, fours, fives, "
+    "taken, name, code, adjusted_fail_rate FROM results "
+    "LEFT JOIN course_stats USING (code) WHERE code = ANY(%s) ORDER BY code, taken")
+
+# counts which of the distinct course codes have results, checked before answering
+# conditional requests for courses without running the course queries
+COURSES_EXIST_QUERY = "SELECT count(*) AS courses FROM course_catalog WHERE code = ANY(%s)"
+
+# formatted with the column of the kind of PDF, one of SUGGESTION_COLUMNS
+PDF_QUERY = "SELECT {column} FROM results WHERE code=%s AND taken=%s"
+
+# advisory lock on a digest, held by transactions storing or referencing a blob as well
+# as by release_blob, so that a blob can't be released while it is about to be
+# referenced; the key pairs don't clash with the single key of MIGRATION_LOCK
+LOCK_BLOB_QUERY = "SELECT pg_advisory_xact_lock(5542, hashtext(%s))"
+
+# finds whether a blob is still referenced, performed by release_blob
+BLOB_REFERENCES_QUERY = (
+    "SELECT 1 FROM results WHERE exam_hash=%(hash)s OR solution_hash=%(hash)s "
+    "UNION ALL "
+    "SELECT 1 FROM exam_suggestions WHERE exam_hash=%(hash)s OR solution_hash=%(hash)s "
+    "LIMIT 1")
+
+# statement performed by add_suggestion, formatted with the column of the kind of suggestion
+ADD_SUGGESTION_QUERY = (
+    "INSERT INTO exam_suggestions (taken, code, {column}) "
+    "SELECT %(taken)s::DATE, %(code)s, %(hash)s "
+    "WHERE NOT EXISTS (SELECT 1 FROM results WHERE code=%(code)s AND taken=%(taken)s "
+    "AND {column}=%(hash)s) "
+    "ON CONFLICT (code, taken, {column}) WHERE {column} IS NOT NULL "
+    "DO UPDATE SET submissions = exam_suggestions.submissions + 1 "
+    "RETURNING submissions")
+
+
+def add_suggestion(code, taken, kind, digest, connected_db, blob_store=None, file=None):
+    """Suggest the PDF as the exam or solution of an exam, unless the identical PDF has
+    already been approved as such for that exam. Submitting a PDF identical to a pending
+    suggestion for the same exam only counts another submission of that suggestion. The
+    PDF is stored and referenced while holding the lock on its digest, so that a
+    concurrent release_blob can't remove an identical blob that was already stored.
+
+    >>> add_suggestion("EDA322", "1998-12-26", "exam", digest, connected_db, # doctest: +SKIP
+    ...                blob_store, spool)
+    1
+
+    :param code: course code of the exam
+    :param taken: date the exam was taken
+    :param kind: either exam or solution
+    :param digest: digest of the suggested PDF
+    :param blob_store: blob store to keep the PDF in, the blobs table is used if not given
+    :param file: binary file object holding the PDF, such as returned by spool_file, or
+    None if the PDF has already been stored
+    :return: number of times the PDF has been submitted for the exam, or None if it has
+    already been approved for the exam
+    """
+    with connected_db.transaction() as cursor:
+        cursor.execute(LOCK_BLOB_QUERY, (digest,))
+        if file is not None:
+            transaction_blob_store(blob_store, cursor).put_file(file)
+
+        cursor.execute(ADD_SUGGESTION_QUERY.format(column=SUGGESTION_COLUMNS[kind]),
+                       {"code": code, "taken": taken, "hash": digest})
+        entry = cursor.fetchone()
+
+    if entry is None:
+        return None
+
+    return entry["submissions"]
 
 
 def list_suggestions(connected_db):
     """Print list of current course suggestions
 
     >>> list_suggestions(connected_db) # doctest: +SKIP
-    Code    Taken         ID
-    ------  ----------  ----
+    Type    Code    Taken         Submissions    ID
+    ------  ------  ----------  -------------  ----
     ...
 
     """
-    exams = connected_db.query("SELECT * FROM exam_suggestions")
+    exams = connected_db.query(
+        "SELECT id, code, taken, exam_hash, solution_hash, submissions "
+        "FROM exam_suggestions ORDER BY id")
     for i, _ in enumerate(exams):
         suggestion_type = None
-        if exams[i].get("exam", None) is not None:
+        if exams[i].get("exam_hash", None) is not None:
             suggestion_type = "exam"
-        elif exams[i].get("solution", None) is not None:
+        elif exams[i].get("solution_hash", None) is not None:
             suggestion_type = "solution"
 
         exams[i] = [suggestion_type, exams[i]["code"],
-                    exams[i]["taken"], exams[i]["id"]]
+                    exams[i]["taken"], exams[i]["submissions"], exams[i]["id"]]
+
+    print(tabulate(exams, headers=["Type", "Code", "Taken", "Submissions", "ID"]))
+
 
-    print(tabulate(exams, headers=["Type", "Code", "Taken", "ID"]))
+def release_blob(digest, connected_db, blob_store=None):
+    """Remove blob from the blob store unless it is still referenced by a result or an
+    exam suggestion. The references are checked and the blob removed while holding the
+    lock on its digest, which waits for suggestions of the same PDF being added.
 
+    >>> release_blob(digest, connected_db) # doctest: +SKIP
 
-def remove(suggestion_id, connected_db):
+    :param digest: digest of blob that is no longer referenced by the caller
+    :param blob_store: blob store holding the blob, the blobs table is used if not given
+    """
+    if digest is None:
+        return
+
+    with connected_db.transaction() as cursor:
+        cursor.execute(LOCK_BLOB_QUERY, (digest,))
+        cursor.execute(BLOB_REFERENCES_QUERY, {"hash": digest})
+        if cursor.fetchone() is None:
+            transaction_blob_store(blob_store, cursor).delete(digest)
+
+
+def remove(suggestion_id, connected_db, blob_store=None):
     """Remove exam suggestion from database
 
     >>> remove(1, connected_db) # doctest: +SKIP
@@ -108,53 +377,78 @@ def remove(suggestion_id, connected_db):
 
 
     :param id: id of exam suggestion to remove from database
+    :param blob_store: blob store holding the suggested PDF, the blobs table is used if
+    not given
 
     """
     try:
         entry = connected_db.query(
-            "SELECT code, taken FROM exam_suggestions WHERE id=%s", (suggestion_id,))[0]
+            "SELECT code, taken, exam_hash, solution_hash FROM exam_suggestions WHERE id=%s",
+            (suggestion_id,))[0]
         connected_db.query(
             "DELETE FROM exam_suggestions WHERE id=%s", (suggestion_id,))
+
+        # drop the pdf as well unless it has been approved or suggested elsewhere
+        release_blob(entry["exam_hash"], connected_db, blob_store)
+        release_blob(entry["solution_hash"], connected_db, blob_store)
+
         print("Removed " + entry["code"] + " " +
               str(entry["taken"]) + " id=" + str(suggestion_id) + " from database")
     except IndexError:
         print("Entry not in database")
 
 
-def remove_all(connected_db):
+def remove_all(connected_db, blob_store=None):
     """ Remove all exam suggestions from database
 
     >>> remove_all(connected_db) # doctest: +SKIP
     Removed ... exam suggestions from database
 
+    :param blob_store: blob store holding the suggested PDFs, the blobs table is used if
+    not given
+
     """
-    amount = len(connected_db.query("SELECT * FROM exam_suggestions"))
-    connected_db.query(
-        "DELETE FROM exam_suggestions", None)
+    entries = connected_db.query(
+        "DELETE FROM exam_suggestions RETURNING exam_hash, solution_hash", None)
 
-    print("Removed " + str(amount) + " exam suggestions from database")
+    for entry in entries:
+        release_blob(entry["exam_hash"], connected_db, blob_store)
+        release_blob(entry["solution_hash"], connected_db, blob_store)
 
+    print("Removed " + str(len(entries)) + " exam suggestions from database")
 
-def approve(suggestion_id, connected_db):
+
+def approve(suggestion_id, connected_db, blob_store=None):
     """ Approve exam suggestion and add to database
 
     >>> approve(1, connected_db) # doctest: +SKIP
     Added ... taken on ... to database
 
     :param id: id of exam suggestion to add to results in database
+    :param blob_store: blob store holding the suggested PDF, the blobs table is used if
+    not given
 
     """
     try:
         entry = connected_db.query(
-            "SELECT * FROM exam_suggestions WHERE id=%s", (suggestion_id,))[0]
-        remove(suggestion_id, connected_db)
-
-        if entry.get("exam", None) is not None:
-            connected_db.query("UPDATE results SET exam=%s WHERE code=%s AND taken=%s",
-                               (entry["exam"], entry["code"], entry["taken"]))
-        elif entry.get("solution", None) is not None:
-            connected_db.query("UPDATE results SET solution=%s WHERE code=%s AND taken=%s",
-                               (entry["solution"], entry["code"], entry["taken"]))
+            "SELECT code, taken, exam_hash, solution_hash FROM exam_suggestions WHERE id=%s",
+            (suggestion_id,))[0]
+
+        # only the reference is moved, the pdf itself stays in the blob store, while the
+        # pdf it replaces is dropped unless it is referenced elsewhere
+        replaced = []
+        for column in SUGGESTION_COLUMNS.values():
+            if entry.get(column, None) is not None:
+                replaced = connected_db.query(
+                    "UPDATE results SET {0}=%s FROM results AS previous "
+                    "WHERE results.id=previous.id AND results.code=%s AND results.taken=%s "
+                    "RETURNING previous.{0} AS replaced".format(column),
+                    (entry[column], entry["code"], entry["taken"]))
+                break
+
+        remove(suggestion_id, connected_db, blob_store)
+        for row in replaced:
+            release_blob(row["replaced"], connected_db, blob_store)
 
         print("Added " + entry["code"] + " taken on " +
               str(entry["taken"]) + " to database")
@@ -162,47 +456,86 @@ def approve(suggestion_id, connected_db):
         print("Entry not in database")
 
 
-def approve_all(connected_db):
-    """ Approve all exam suggestions and add to database
+def approve_all(connected_db, blob_store=None):
+    """ Approve all exam suggestions and add to database. The suggestions are moved into
+    the results by a single statement, so that suggestions arriving meanwhile are kept for
+    the next approval rather than deleted, and nothing is approved if it fails. Where a
+    sitting has several suggestions of the same kind, the most submitted one is approved.
 
     >>> approve_all(connected_db) # doctest: +SKIP
     Added ... exams to database
 
-    """
-    entries = connected_db.query("SELECT * FROM exam_suggestions", None)
-    remove_all(connected_db)
-
-    for entry in entries:
-        if entry.get("exam", None) is not None:
-            connected_db.query("UPDATE results SET exam=%s WHERE code=%s AND taken=%s",
-                               (entry["exam"], entry["code"], entry["taken"]))
-        elif entry.get("solution", None) is not None:
-            connected_db.query("UPDATE results SET solution=%s WHERE code=%s AND taken=%s",
-                               (entry["solution"], entry["code"], entry["taken"]))
-
-    print("Added " + str(len(entries)) + " exams to database")
-
+    :param blob_store: blob store holding the suggested PDFs, the blobs table is used if
+    not given
 
-def show(suggestion_id, connected_db):
+    """
+    with connected_db.transaction() as cursor:
+        cursor.execute(
+            "WITH approved AS ("
+            "    DELETE FROM exam_suggestions "
+            "    RETURNING id, code, taken, exam_hash, solution_hash, submissions"
+            "), chosen AS ("
+            "    SELECT code, taken, "
+            "    (ARRAY_AGG(exam_hash ORDER BY submissions DESC, id DESC) "
+            "        FILTER (WHERE exam_hash IS NOT NULL))[1] AS exam_hash, "
+            "    (ARRAY_AGG(solution_hash ORDER BY submissions DESC, id DESC) "
+            "        FILTER (WHERE solution_hash IS NOT NULL))[1] AS solution_hash "
+            "    FROM approved GROUP BY code, taken"
+            "), previous AS ("
+            "    SELECT results.exam_hash, results.solution_hash "
+            "    FROM results JOIN chosen USING (code, taken)"
+            "), updated AS ("
+            "    UPDATE results SET exam_hash=COALESCE(chosen.exam_hash, results.exam_hash), "
+            "    solution_hash=COALESCE(chosen.solution_hash, results.solution_hash) "
+            "    FROM chosen WHERE results.code=chosen.code AND results.taken=chosen.taken "
+            "    RETURNING results.exam_hash, results.solution_hash"
+            ") "
+            "SELECT (SELECT COUNT(*) FROM approved) AS approved, "
+            "ARRAY(SELECT exam_hash FROM approved WHERE exam_hash IS NOT NULL "
+            "      UNION SELECT solution_hash FROM approved WHERE solution_hash IS NOT NULL "
+            "      UNION SELECT exam_hash FROM previous WHERE exam_hash IS NOT NULL "
+            "      UNION SELECT solution_hash FROM previous WHERE solution_hash IS NOT NULL "
+            "      EXCEPT SELECT exam_hash FROM updated "
+            "      EXCEPT SELECT solution_hash FROM updated) AS unused")
+        entry = cursor.fetchone()
+
+    # drop the pdfs that weren't approved and those replaced by the approved ones, unless
+    # they have been approved or suggested elsewhere
+    for digest in entry["unused"]:
+        release_blob(digest, connected_db, blob_store)
+
+    print("Added " + str(entry["approved"]) + " exams to database")
+
+
+def show(suggestion_id, connected_db, blob_store=None):
     """ Open file from id in webbrowser
 
     opens file in browser
     >>> show(1, connected_db) # doctest: +SKIP
 
     :param id: id of suggestion
+    :param blob_store: blob store holding the suggested PDF, the blobs table is used if
+    not given
 
     """
-    exam = connected_db.query(
-        "SELECT exam FROM exam_suggestions WHERE id=%s", (suggestion_id,))
+    blob_store = blob_store or PostgresBlobStore(connected_db)
+    entry = connected_db.query(
+        "SELECT COALESCE(exam_hash, solution_hash) AS hash FROM exam_suggestions WHERE id=%s",
+        (suggestion_id,))
+    if not entry or entry[0]["hash"] is None:
+        print("Entry not in database")
+        return
+
     with open("temp.pdf", "wb") as file:
-        file.write(exam[0]["exam"])
+        file.write(blob_store.get(entry[0]["hash"]))
         file.close()
 
     webbrowser.open_new_tab("file://" + os.path.realpath("temp.pdf"))
 
 
 def init_db(filename, connected_db):
-    """ Initiailze database using given file containing SQL statements
+    """ Initiailze database using given file containing SQL statements, and bring the
+    schema up to date with the migrations afterwards
 
     >>> init_db("mock.sql", connected_db) # doctest: +SKIP
 
@@ -210,3 +543,5 @@ def init_db(filename, connected_db):
     """
     with open(filename, "r") as file:
         connected_db.query(file.read())
+
+    migrate(connected_db)
@@ -0,0 +1,102 @@
+"""
+Versioned schema migrations. Every file in the migrations directory is named after the
+schema version it brings the database to, e.g. 0001_initial.sql, and the versions that
+have been applied are recorded in the schema_version table. Checking whether a database
+is up to date is a single lookup on that table, so it is cheap enough to do every time
+a worker starts.
+"""
+
+import os
+import re
+
+
+# directory holding the migration files shipped with the backend
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                              "migrations")
+
+# migration files are named VERSION_DESCRIPTION.sql
+MIGRATION_PATTERN = re.compile(r"^(\d+)_\w+\.sql$")
+
+# key of the advisory lock keeping concurrently starting workers from migrating at once
+MIGRATION_LOCK = 5541
+
+
+def load_migrations(directory=MIGRATIONS_DIR):
+    """ List migration files in directory ordered by version
+
+    >>> load_migrations() # doctest: +SKIP
+    [(1, '.../migrations/0001_initial.sql')]
+
+    :param directory: directory containing the migration files
+    :return: list of (version, path) tuples
+    """
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_PATTERN.match(filename)
+        if match is not None:
+            migrations.append((int(match.group(1)), os.path.join(directory, filename)))
+
+    migrations.sort()
+
+    # two files claiming the same version would be applied in arbitrary order
+    versions = [version for version, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError("Duplicate migration versions in " + directory)
+
+    return migrations
+
+
+def schema_version(connected_db):
+    """ Return the version of the schema in the database, 0 if nothing has been applied
+
+    >>> schema_version(connected_db) # doctest: +SKIP
+    1
+
+    :param connected_db: DBInterface instance of the database to check
+    """
+    present = connected_db.query(
+        "SELECT to_regclass('schema_version') IS NOT NULL AS present")[0]["present"]
+    if not present:
+        return 0
+
+    return connected_db.query(
+        "SELECT COALESCE(MAX(version), 0) AS version FROM schema_version")[0]["version"]
+
+
+def migrate(connected_db, directory=MIGRATIONS_DIR):
+    """ Apply every migration newer than the current schema version. All pending
+    migrations are applied in a single transaction, so a failing migration leaves the
+    database untouched.
+
+    >>> migrate(connected_db) # doctest: +SKIP
+    [1]
+
+    :param connected_db: DBInterface instance of the database to migrate
+    :param directory: directory containing the migration files
+    :return: list of versions that were applied
+    """
+    migrations = load_migrations(directory)
+    if not migrations or schema_version(connected_db) >= migrations[-1][0]:
+        return []
+
+    applied = []
+    with connected_db.transaction() as cursor:
+
+        # another worker may be migrating, wait for it and check the version again
+        cursor.execute("SELECT pg_advisory_xact_lock(%s)", (MIGRATION_LOCK,))
+        cursor.execute("CREATE TABLE IF NOT EXISTS schema_version ("
+                       "version INTEGER PRIMARY KEY, "
+                       "applied TIMESTAMP NOT NULL DEFAULT now())")
+        cursor.execute("SELECT COALESCE(MAX(version), 0) AS version FROM schema_version")
+        current = cursor.fetchone()["version"]
+
+        for version, path in migrations:
+            if version <= current:
+                continue
+
+            with open(path, "r") as file:
+                cursor.execute(file.read())
+            cursor.execute("INSERT INTO schema_version (version) VALUES (%s)", (version,))
+            applied.append(version)
+
+    return applied
@@ -0,0 +1,226 @@
+"""
+Thread safe pool of postgres connections used by DBInterface in pooled mode. Unlike the
+pools shipped with psycopg2, a checkout blocks until a connection is available instead
+of failing when the pool is exhausted, connections are health checked before being
+handed out, and statistics are kept on how long callers had to wait.
+"""
+
+import time
+import threading
+
+import psycopg2
+import psycopg2.extensions
+
+
+class PoolTimeout(Exception):
+    """Raised when no connection became available before the checkout timed out."""
+
+
+class PoolClosed(Exception):
+    """Raised when checking out a connection from a pool that has been closed."""
+
+
+class ConnectionPool:
+    """Pool keeping between min_connections and max_connections connections open, all of
+    them in autocommit mode. Connections are created using the given connect function,
+    which takes no arguments and returns a new psycopg2 connection."""
+
+    def __init__(self, min_connections, max_connections, connect, timeout=30.0,
+                 check_interval=30.0):
+        """ Open min_connections connections up front
+
+        :param min_connections: number of connections to keep open while idle
+        :param max_connections: maximum number of connections open at once
+        :param connect: function returning a new psycopg2 connection
+        :param timeout: seconds to wait for a connection before raising PoolTimeout
+        :param check_interval: seconds a connection may be idle before it is health
+        checked again on checkout
+        """
+        if not 0 <= min_connections <= max_connections or max_connections < 1:
+            raise ValueError("Invalid pool size: min={}, max={}".format(
+                min_connections, max_connections))
+
+        self.min_connections = min_connections
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self._connect = connect
+        self._condition = threading.Condition()
+
+        # idle connections together with the time they were returned
+        self._idle = []
+        self._open = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._closed = False
+
+        # counters exposed through stats()
+        self._checkouts = 0
+        self._reconnects = 0
+        self._timeouts = 0
+        self._wait_time = 0.0
+        self._max_wait_time = 0.0
+
+        for _ in range(min_connections):
+            self._idle.append((self._new_connection(), time.monotonic()))
+            self._open += 1
+
+    def _new_connection(self):
+        """ Open a new connection in autocommit mode """
+
+        connection = self._connect()
+        connection.autocommit = True
+        return connection
+
+    def _healthy(self, connection, idle_since):
+        """ Check whether an idle connection can still be used, only performing a round
+        trip to the server if it has been idle for longer than check_interval """
+
+        if connection.closed:
+            return False
+
+        if time.monotonic() - idle_since < self.check_interval:
+            return True
+
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    @staticmethod
+    def _close(connection):
+        """ Close connection, ignoring errors from connections that are already broken """
+
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def getconn(self):
+        """ Check out a connection, waiting for one to be returned if the pool is exhausted
+
+        >>> connection = pool.getconn() # doctest: +SKIP
+
+        :return: psycopg2 connection in autocommit mode
+        """
+        start = time.monotonic()
+        deadline = start + self.timeout
+
+        with self._condition:
+            self._waiting += 1
+            try:
+                while not self._closed and not self._idle and \
+                        self._open >= self.max_connections:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout("No connection available after {} seconds".format(
+                            self.timeout))
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+
+            if self._closed:
+                raise PoolClosed("Connection pool is closed")
+
+            waited = time.monotonic() - start
+            self._checkouts += 1
+            self._wait_time += waited
+            self._max_wait_time = max(self._max_wait_time, waited)
+
+            # reserve the slot while connecting or checking health outside of the lock
+            if self._idle:
+                connection, idle_since = self._idle.pop()
+            else:
+                connection, idle_since = None, None
+                self._open += 1
+            self._in_use += 1
+
+        try:
+            if connection is not None and not self._healthy(connection, idle_since):
+                self._close(connection)
+                with self._condition:
+                    self._reconnects += 1
+                connection = None
+
+            if connection is None:
+                connection = self._new_connection()
+
+        except BaseException:
+            with self._condition:
+                self._open -= 1
+                self._in_use -= 1
+                self._condition.notify()
+            raise
+
+        return connection
+
+    def putconn(self, connection):
+        """ Return a checked out connection to the pool, discarding it if it is broken
+
+        >>> pool.putconn(connection) # doctest: +SKIP
+
+        :param connection: connection previously returned by getconn
+        """
+        if not connection.closed:
+            try:
+
+                # never hand out a connection in the middle of a transaction
+                status = connection.get_transaction_status()
+                if status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                connection.autocommit = True
+            except psycopg2.Error:
+                self._close(connection)
+
+        with self._condition:
+            self._in_use -= 1
+
+            # connections in use when the pool was closed are closed once returned
+            if self._closed and not connection.closed:
+                self._close(connection)
+
+            if connection.closed:
+                self._open -= 1
+            else:
+                self._idle.append((connection, time.monotonic()))
+
+            self._condition.notify()
+
+    def closeall(self):
+        """ Close every idle connection, connections in use are closed when returned and
+        checking out raises PoolClosed from now on """
+
+        with self._condition:
+            self._closed = True
+            for connection, _ in self._idle:
+                self._close(connection)
+            self._open -= len(self._idle)
+            self._idle = []
+
+            # waiting callers would otherwise wait for connections that never come back
+            self._condition.notify_all()
+
+    def stats(self):
+        """ Return statistics on the use of the pool
+
+        >>> pool.stats() # doctest: +SKIP
+        {'size': 2, 'idle': 1, 'in_use': 1, 'waiting': 0, 'checkouts': 40, ...}
+
+        :return: dictionary of counters, times are given in seconds
+        """
+        with self._condition:
+            return {
+                "size": self._open,
+                "idle": len(self._idle),
+                "in_use": self._in_use,
+                "waiting": self._waiting,
+                "max_size": self.max_connections,
+                "checkouts": self._checkouts,
+                "reconnects": self._reconnects,
+                "timeouts": self._timeouts,
+                "wait_time": self._wait_time,
+                "max_wait_time": self._max_wait_time,
+            }
@@ -0,0 +1,20 @@
+"""
+Items produced by PdfSpider, which are persisted by the pipelines in the pipelines module.
+"""
+
+import scrapy
+
+
+class SuggestionItem(scrapy.Item):
+    """Downloaded PDF to suggest as the exam or solution of an exam"""
+
+    # course code and date of the exam
+    code = scrapy.Field()
+    taken = scrapy.Field()
+
+    # either exam or solution
+    kind = scrapy.Field()
+
+    # bytes of the PDF, and the URL it was fetched from
+    body = scrapy.Field()
+    url = scrapy.Field()
@@ -0,0 +1,183 @@
+"""
+Downloader middlewares used by PdfSpider. ConditionalRequestMiddleware makes crawls of
+chalmerstenta.se incremental, by remembering the validators and content hash of every
+course page and PDF in the crawled_urls table and skipping those that haven't changed
+since they were last crawled successfully.
+"""
+
+import hashlib
+
+from psycopg2.extras import execute_values
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
+
+from .pipelines import suggestions_stored
+
+
+class ConditionalRequestMiddleware:
+    """Middleware sending conditional requests for the URLs recorded by earlier crawls,
+    and dropping responses which are either 304 Not Modified or identical to what was
+    fetched last time. The start URLs are always fetched, since they are needed to find
+    the course pages.
+
+    A course page is recorded along with the state of the exam occasions of its course in
+    the database, see PdfSpider.course_state, and only trusted while that is unchanged:
+    a page that hasn't changed may still hold new PDFs once exam occasions of its course
+    have been added or have lost a PDF. A PDF is recorded once its suggestion has been
+    committed, and isn't downloaded again unless it has changed according to its
+    validators; PDFs served without any are never fetched again. A course page is only
+    recorded if every PDF requested from it was, so that the PDFs that failed are
+    requested again by the next crawl. Spiders can opt out by setting their incremental
+    attribute to False."""
+
+    def __init__(self, stats):
+        """ Create middleware, the recorded state is loaded when the spider is opened
+
+        :param stats: stats collector of the crawler, counting the skipped URLs
+        """
+        self.stats = stats
+
+        # url -> recorded state, and url -> (etag, last_modified, content_hash,
+        # course_state) of the responses fetched by this crawl
+        self.known = {}
+        self.fetched = {}
+
+        # url of every PDF requested by this crawl that hasn't been stored yet -> url of
+        # the course page it was requested from
+        self.unstored = {}
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """ Create middleware loading and saving its state along with the spider """
+
+        middleware = cls(crawler.stats)
+        crawler.signals.connect(middleware.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(middleware.suggestions_stored, signal=suggestions_stored)
+        return middleware
+
+    def spider_opened(self, spider):
+        """ Load the recorded state """
+
+        if not getattr(spider, "incremental", True):
+            return
+
+        entries = spider.db.query(
+            "SELECT url, etag, last_modified, content_hash, course_state FROM crawled_urls")
+        self.known = {entry["url"]: entry for entry in entries}
+        spider.log("Loaded state of {} crawled URLs".format(len(self.known)))
+
+    def spider_closed(self, spider, reason):
+        """ Record the state of the fetched URLs whose PDFs have all been stored, unless
+        the crawl didn't finish """
+
+        if reason != "finished":
+            return
+
+        incomplete = set(self.unstored) | set(self.unstored.values())
+        rows = [(url,) + state for url, state in self.fetched.items() if url not in incomplete]
+        if not rows:
+            return
+
+        with spider.db.transaction() as cursor:
+            execute_values(cursor,
+                           "INSERT INTO crawled_urls "
+                           "(url, etag, last_modified, content_hash, course_state) VALUES %s "
+                           "ON CONFLICT (url) DO UPDATE SET etag = EXCLUDED.etag, "
+                           "last_modified = EXCLUDED.last_modified, "
+                           "content_hash = EXCLUDED.content_hash, "
+                           "course_state = EXCLUDED.course_state, crawled = now()",
+                           rows)
+
+    def suggestions_stored(self, items, spider):  # pylint: disable=unused-argument
+        """ Consider the PDFs of a committed batch of SuggestionItems stored """
+
+        for item in items:
+            self.unstored.pop(item["url"], None)
+
+    def process_request(self, request, spider):
+        """ Add the recorded validators of the URL to the request, or drop requests for
+        PDFs recorded without any """
+
+        if request.url in spider.start_urls:
+            return None
+
+        page = request.meta.get("page")
+        state = self._trusted(request.url, spider)
+        if state is not None and page is not None and \
+                state["etag"] is None and state["last_modified"] is None:
+            self.stats.inc_value("incremental/skipped", spider=spider)
+            raise IgnoreRequest("Already fetched: " + request.url)
+
+        if page is not None:
+            self.unstored[request.url] = page
+
+        if state is None:
+            return None
+
+        if state["etag"] is not None:
+            request.headers.setdefault("If-None-Match", state["etag"])
+        if state["last_modified"] is not None:
+            request.headers.setdefault("If-Modified-Since", state["last_modified"])
+
+        return None
+
+    def process_response(self, request, response, spider):
+        """ Drop responses for URLs that haven't changed, and remember the state of the
+        others """
+
+        if request.url in spider.start_urls:
+            return response
+
+        if response.status == 304:
+            self.unstored.pop(request.url, None)
+            self.stats.inc_value("incremental/not_modified", spider=spider)
+            raise IgnoreRequest("Not modified: " + request.url)
+
+        if response.status != 200:
+            return response
+
+        # PDFs are stored under the URL they were redirected to
+        for url in request.meta.get("redirect_urls", []):
+            self.unstored.pop(url, None)
+
+        course_state = None
+        if request.meta.get("page") is None:
+            course_state = spider.course_state(spider.course_code(request.url))
+
+        content_hash = hashlib.sha256(response.body).hexdigest()
+        self.fetched[request.url] = (self._header(response, "ETag"),
+                                     self._header(response, "Last-Modified"),
+                                     content_hash, course_state)
+
+        # servers without validators are caught by the content hash instead
+        state = self._trusted(request.url, spider)
+        if state is not None and state["content_hash"] == content_hash:
+            self.unstored.pop(request.url, None)
+            self.stats.inc_value("incremental/unchanged", spider=spider)
+            raise IgnoreRequest("Unchanged: " + request.url)
+
+        return response
+
+    def _trusted(self, url, spider):
+        """ Return the recorded state of url, or None if there is none or it belongs to a
+        course page whose course has changed since """
+
+        state = self.known.get(url)
+        if state is None or state["course_state"] is None:
+            return state
+
+        if state["course_state"] != spider.course_state(spider.course_code(url)):
+            return None
+
+        return state
+
+    @staticmethod
+    def _header(response, name):
+        """ Return value of header as a string, or None if it isn't present """
+
+        value = response.headers.get(name)
+        if value is None:
+            return None
+
+        return value.decode("latin-1")
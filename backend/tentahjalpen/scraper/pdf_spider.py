@@ -1,10 +1,14 @@
 import re
+import hashlib
 from dateutil.parser import parse
 
-from scrapy import Request
+from scrapy import Request, signals
 from scrapy.spiders import CrawlSpider, Rule
 from scrapy.linkextractors import LinkExtractor
 
+from ..blob_store import PostgresBlobStore
+from .items import SuggestionItem
+
 
 class PdfSpider(CrawlSpider):
     """ Scrapy CrawlSpider used for scraping exam PDFs from chalmerstenta.se """
@@ -18,58 +22,122 @@ class PdfSpider(CrawlSpider):
         Rule(LinkExtractor(allow=("\?kurs\=.*")), callback="parse_course"),
     )
 
+    # suggestions are written to the database off the reactor thread, in batches, and
+    # pages that haven't changed since the last crawl are skipped
+    custom_settings = {
+        "ITEM_PIPELINES": {"tentahjalpen.scraper.pipelines.SuggestionPipeline": 300},
+        "DOWNLOADER_MIDDLEWARES": {
+            "tentahjalpen.scraper.middlewares.ConditionalRequestMiddleware": 580,
+        },
+    }
+
+    # fetch everything again if set to False, see ConditionalRequestMiddleware
+    incremental = True
+
     def __init__(self, *args, **kwargs):
         """ Instantiates spider and saves DBInterface instance for use when submitting exams to database
-        Arguments are passed into CrawlSpider constructor, and argument db is used for DBInterface instance """
+        Arguments are passed into CrawlSpider constructor, argument db is used for DBInterface instance and
+        the optional argument blob_store is used for storing the downloaded PDFs """
 
         super(PdfSpider, self).__init__(*args, **kwargs)
         self.db = kwargs["db"]
-
-    def parse_course(self, response):
-        """ Checks whether given response is of a page containing a course PDF that corresponds to an entry in the
-        database """
-
-        # select rows from DOM
-        rows = response.xpath("//table//table/child::*")
-
-        # check that there is data present
-        if len(rows) <= 2:
-            self.log("No entries")
-            return
+        self.blob_store = kwargs.get("blob_store") or PostgresBlobStore(self.db)
+
+        # index of the exam occasions in the database, loaded when the spider is opened
+        self.occasions = {}
+        self.courses = set()
+        self.course_names = {}
+        self.course_states = {}
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        """ Create spider and have it load its index of the database once it is opened """
+
+        spider = super(PdfSpider, cls).from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.load_occasions, signal=signals.spider_opened)
+        return spider
+
+    def load_occasions(self):
+        """ Load which exam occasions in the database have an exam and a solution, and the
+        course codes of every course name, using a single query. All lookups during the
+        crawl are made in this index rather than in the database. """
+
+        entries = self.db.query(
+            "SELECT code, name, taken, exam_hash IS NOT NULL AS has_exam, "
+            "solution_hash IS NOT NULL AS has_solution FROM results")
+
+        # (code, taken) -> (has_exam, has_solution)
+        self.occasions = {(entry["code"], entry["taken"]): (entry["has_exam"],
+                                                            entry["has_solution"])
+                          for entry in entries}
+
+        # name -> set of course codes using that name
+        self.courses = set()
+        self.course_names = {}
+        for entry in entries:
+            self.courses.add(entry["code"])
+            self.course_names.setdefault(entry["name"], set()).add(entry["code"])
+
+        # code -> digest of the exam occasions of the course, which decide what is
+        # requested from its course page, sorted by their text to tolerate missing dates
+        occasions = {}
+        for (code, taken), pdfs in sorted(self.occasions.items(), key=str):
+            occasions.setdefault(code, []).append((str(taken),) + pdfs)
+        self.course_states = {code: hashlib.sha256(repr(entries).encode()).hexdigest()
+                              for code, entries in occasions.items()}
+
+        self.log("Loaded {} exam occasions".format(len(self.occasions)))
+
+    def course_state(self, code):
+        """ Return digest of the exam occasions in the database of the course with the
+        given code, which changes whenever the PDFs requested from its course page would.
+        Courses that aren't in the database, including None, share the same digest. """
+
+        return self.course_states.get(code, hashlib.sha256().hexdigest())
+
+    def course_code(self, url):
+        """ Return code of the course in the database that the course page at url belongs
+        to, or None if there isn't exactly one """
 
         # gather and clean title of course using url
-        title = response.url.split("kurs=")[-1].split("_")
+        title = url.split("kurs=")[-1].split("_")
         title = " ".join(title)
 
         # check if there is a course code present
         # regex for three uppercase letters followed by three digits
         code = re.search("[A-Z]{3}[0-9]{3}", title)
 
-        # there was a match for the expression
+        # there was a match for the expression, search to see if course is in database
         if code is not None:
             code = code.group(0)
+            return code if code in self.courses else None
 
-            # search to see if course is in database
-            matches = self.db.query(
-                "SELECT * FROM results WHERE code=%s", (code,))
+        # no code present, search for name as last-ditch effort
+        matches = self.course_names.get(title, set())
 
-            # no match
-            if len(matches) <= 0:
-                self.log("Course not in database")
-                return
+        # as long as there is a match and no ambivalence, use result
+        if len(matches) != 1:
+            return None
 
-        # no code present, search for name as last-ditch effort
-        else:
-            matches = self.db.query(
-                "SELECT DISTINCT ON (code) code FROM results WHERE name=%s", (title,))
+        return next(iter(matches))
 
-            # as long as there is a match and no ambivalence, use result
-            if len(matches) != 1:
-                self.log("Either course not found in database, or several matches")
-                return
+    def parse_course(self, response):
+        """ Checks whether given response is of a page containing a course PDF that corresponds to an entry in the
+        database """
 
-            # set course code for when submitting exam suggestion later
-            code = matches[0]["code"]
+        # select rows from DOM
+        rows = response.xpath("//table//table/child::*")
+
+        # check that there is data present
+        if len(rows) <= 2:
+            self.log("No entries")
+            return
+
+        # set course code for when submitting exam suggestion later
+        code = self.course_code(response.url)
+        if code is None:
+            self.log("Either course not found in database, or several matches")
+            return
 
         # iterate over table rows
         # start at the index 2 since the first two entries are just the title of the course and columns
@@ -85,31 +153,34 @@ class PdfSpider(CrawlSpider):
             # gather and validate date
             date = data.xpath(".//text()")[0].get()
             try:
-                date = str(parse(date).date())
+                taken = parse(date).date()
             except ValueError:
                 self.log("Invalid date format, skipping iteration")
                 continue
+            date = str(taken)
 
             # make sure date is present in database
-            matches = self.db.query("SELECT * FROM results WHERE code=%s AND taken=%s",
-                                    (code, date,))
+            occasion = self.occasions.get((code, taken))
 
             # no entry matched
-            if len(matches) <= 0:
+            if occasion is None:
                 self.log("Date not found in database")
                 continue
 
+            has_exam, has_solution = occasion
+
             # make sure exam doesn't already exist
-            if matches[0].get("exam", None) is not None:
+            if has_exam:
                 self.log("Exam already present in database")
                 continue
 
             # let scrapy schedule download of actual pdf
-            yield Request(url="http://chalmerstenta.se" + data[2].xpath("a/@href").get(),
+            yield Request(url=response.urljoin(data[2].xpath("a/@href").get()),
                           callback=self.save_data,
                           meta={"date": date,
                                 "code": code,
-                                "type": "exam"})
+                                "type": "exam",
+                                "page": response.url})
 
             # check if solution is in row
             solution_url = data[3].xpath("a/@href").get()
@@ -118,30 +189,25 @@ class PdfSpider(CrawlSpider):
                 continue
 
             # check if solution is not already present
-            if matches[0].get("solution", None) is not None:
+            if has_solution:
                 self.log("Solution already present in database")
                 continue
 
             # schedule download of solution pdf
-            yield Request(url="http://chalmerstenta.se" + solution_url,
+            yield Request(url=response.urljoin(solution_url),
                           callback=self.save_data,
                           meta={"date": date,
                                 "code": code,
-                                "type": "solution"})
+                                "type": "solution",
+                                "page": response.url})
 
     def save_data(self, response):
-        """ Download PDF and submit exam suggestion using meta entries: date and code"""
+        """ Hand downloaded PDF over to SuggestionPipeline using meta entries: date, code and
+        type, the pipeline stores it and submits the exam suggestion """
 
         self.log("Posting exam suggestion to database")
-        date = response.meta["date"]
-        code = response.meta["code"]
-
-        # insert suggestion
-        if response.meta["type"] == "exam":
-            self.db.query(
-                "INSERT INTO exam_suggestions (taken, code, exam) VALUES (%s, %s, %s)",
-                (date, code, response.body))
-        elif response.meta["type"] == "solution":
-            self.db.query(
-                "INSERT INTO exam_suggestions (taken, code, solution) VALUES (%s, %s, %s)",
-                (date, code, response.body))
+        yield SuggestionItem(code=response.meta["code"],
+                             taken=response.meta["date"],
+                             kind=response.meta["type"],
+                             body=response.body,
+                             url=response.url)
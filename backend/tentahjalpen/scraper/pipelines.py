@@ -0,0 +1,194 @@
+"""
+Item pipelines persisting the output of PdfSpider. Writing to the database is kept off the
+reactor thread, so that the crawl never stalls on a round trip to postgres: items are
+gathered into batches, which are written in single transactions by a pool of threads with
+connections of their own.
+"""
+
+import psycopg2.extras
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, DeferredList
+from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThreadPool
+from twisted.python.threadpool import ThreadPool
+
+from .items import SuggestionItem
+from ..blob_store import blob_hash
+from ..db_interface import transaction_blob_store, ADD_SUGGESTION_QUERY, LOCK_BLOB_QUERY
+from ..db_interface import SUGGESTION_COLUMNS
+from ..pool import ConnectionPool
+
+
+# signal sent with the arguments items and spider once a batch of SuggestionItems has been
+# committed, see ConditionalRequestMiddleware
+suggestions_stored = object()
+
+
+class SuggestionPipeline:
+    """Pipeline storing the PDFs of SuggestionItems in the blob store of the spider and
+    suggesting them through the exam_suggestions table of its database. At most
+    max_batches batches are written at once; items arriving while that many are in
+    flight are held until one of them has been written, which makes scrapy stop
+    downloading more until the database has caught up."""
+
+    def __init__(self, batch_size=50, max_batches=4, threads=2, flush_interval=1.0):
+        """ Create pipeline, the thread pool is started when the spider is opened
+
+        :param batch_size: number of items written in each transaction
+        :param max_batches: number of batches that may be queued or being written at once
+        :param threads: number of threads, and database connections, writing batches
+        :param flush_interval: seconds to wait before writing a batch that isn't full
+        """
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.threads = threads
+        self.flush_interval = flush_interval
+
+        self.signals = None
+        self.spider = None
+        self.blob_store = None
+        self.connections = None
+        self.threadpool = None
+        self.flusher = None
+
+        # items not yet handed to the thread pool, the deferreds of the batches that have
+        # been, and the deferreds of the items waiting for room in the queue
+        self.pending = []
+        self.in_flight = set()
+        self.waiting = []
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        """ Create pipeline configured by the settings of the crawler """
+
+        settings = crawler.settings
+        pipeline = cls(batch_size=settings.getint("SUGGESTION_BATCH_SIZE", 50),
+                       max_batches=settings.getint("SUGGESTION_MAX_BATCHES", 4),
+                       threads=settings.getint("SUGGESTION_THREADS", 2),
+                       flush_interval=settings.getfloat("SUGGESTION_FLUSH_INTERVAL", 1.0))
+        pipeline.signals = crawler.signals
+        return pipeline
+
+    def open_spider(self, spider):
+        """ Start the threads writing batches to the database of the spider """
+
+        self.spider = spider
+        self.blob_store = spider.blob_store
+
+        # connections of their own, the one of the spider is used on the reactor thread
+        self.connections = ConnectionPool(0, self.threads, spider.db.connect)
+        self.threadpool = ThreadPool(minthreads=1, maxthreads=self.threads,
+                                     name="suggestion-pipeline")
+        self.threadpool.start()
+
+        self.flusher = LoopingCall(self.flush)
+        self.flusher.start(self.flush_interval, now=False)
+
+    def close_spider(self, spider):
+        """ Write the remaining items and stop the threads once all batches are written
+
+        :return: deferred firing when everything has been written
+        """
+        self.flusher.stop()
+        self.flush()
+
+        def stop(_):
+            self.threadpool.stop()
+            self.connections.closeall()
+
+        return DeferredList(list(self.in_flight)).addBoth(stop)
+
+    def process_item(self, item, spider):
+        """ Queue SuggestionItems for writing, passing any other items through
+
+        :return: the item, or a deferred firing with it once there is room in the queue
+        """
+        if not isinstance(item, SuggestionItem):
+            return item
+
+        self.pending.append(item)
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+        if len(self.in_flight) < self.max_batches:
+            return item
+
+        waiting = Deferred()
+        self.waiting.append((waiting, item))
+        return waiting
+
+    def flush(self):
+        """ Hand the pending items to the thread pool as one batch """
+
+        if not self.pending:
+            return
+
+        batch, self.pending = self.pending, []
+        written = deferToThreadPool(reactor, self.threadpool, self.write_batch, batch)
+        self.in_flight.add(written)
+        written.addBoth(self._written, written, batch)
+
+    def _written(self, result, written, batch):
+        """ Log the outcome of writing batch, and let waiting items continue """
+
+        self.in_flight.discard(written)
+
+        if isinstance(result, list):
+            for item, submissions in zip(batch, result):
+                if submissions is None:
+                    self.spider.log("Identical PDF already approved for {} {}".format(
+                        item["code"], item["taken"]))
+                elif submissions > 1:
+                    self.spider.log("Identical PDF already suggested for {} {}, submitted "
+                                    "{} times".format(item["code"], item["taken"], submissions))
+
+            if self.signals is not None:
+                self.signals.send_catch_log(suggestions_stored, items=batch, spider=self.spider)
+        else:
+            self.spider.logger.error("Writing %d suggestions failed: %s", len(batch),
+                                     result.getErrorMessage())
+
+        while self.waiting and len(self.in_flight) < self.max_batches:
+            waiting, item = self.waiting.pop(0)
+            waiting.callback(item)
+
+    def write_batch(self, batch):
+        """ Store the PDFs of batch and suggest them in a single transaction, called from
+        the thread pool
+
+        >>> pipeline.write_batch([SuggestionItem(code="EDA322", ...)]) # doctest: +SKIP
+        [1]
+
+        :param batch: list of SuggestionItems
+        :return: list of the values returned by add_suggestion for each item
+        """
+
+        submissions = []
+        connection = self.connections.getconn()
+        try:
+            connection.autocommit = False
+            with connection:
+                with connection.cursor(
+                        cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+
+                    # blobs kept in the database are stored in the same transaction, so a
+                    # failed batch leaves none behind, files are stored right away and are
+                    # deduplicated when the batch is retried
+                    blob_store = transaction_blob_store(self.blob_store, cursor)
+
+                    # keep the pdfs from being released until they are referenced, locking
+                    # in order to avoid deadlocks with other batches
+                    for digest in sorted({blob_hash(item["body"]) for item in batch}):
+                        cursor.execute(LOCK_BLOB_QUERY, (digest,))
+
+                    for item in batch:
+                        digest = blob_store.put(item["body"])
+                        cursor.execute(
+                            ADD_SUGGESTION_QUERY.format(column=SUGGESTION_COLUMNS[item["kind"]]),
+                            {"code": item["code"], "taken": item["taken"], "hash": digest})
+                        entry = cursor.fetchone()
+                        submissions.append(entry["submissions"] if entry else None)
+        finally:
+            self.connections.putconn(connection)
+
+        return submissions
@@ -1,9 +1,16 @@
+import hashlib
+from collections.abc import Mapping
+from datetime import datetime
 from pathlib import Path
 
+import openpyxl
 import pandas as pd
 import requests
 from dateutil.parser import parse
+from psycopg2.extras import execute_values
 from .pdf_spider import PdfSpider
+from ..stats import refresh_course_stats
+from scrapy import signals
 from scrapy.crawler import CrawlerProcess
 
 
@@ -18,72 +25,220 @@ def print_or_log(string, end="\n", app=None):
     else:
         app.logger.info(string)
 
-def scrape_pdfs(db):
-    """ Starts a scrapy CrawlerProcess with PdfSpider to extract exam pdfs from chalmerstenta.se
+def scrape_pdfs(db, blob_store=None, force=False, settings=None, progress=None, **kwargs):
+    """ Starts a scrapy CrawlerProcess with PdfSpider to extract exam pdfs from chalmerstenta.se.
+    Course pages and PDFs that haven't changed since the last finished crawl are skipped.
+    The Twisted reactor can't be restarted, so this can only be called once per process,
+    see the jobs module for running it repeatedly.
 
     :param db: DBInterface object to use when sending exam suggestions
+    :param blob_store: blob store to save downloaded PDFs in, the blobs table is used if not given
+    :param force: fetch every course page and PDF, even those that haven't changed
+    :param settings: dictionary of scrapy settings to run the crawl with
+    :param progress: function called with a message whenever a PDF has been suggested and
+    once the crawl has finished
+    :param kwargs: further attributes of the spider, such as start_urls
     """
-    process = CrawlerProcess()
-    process.crawl(PdfSpider, db=db)
+    process = CrawlerProcess(settings)
+    crawler = process.create_crawler(PdfSpider)
+
+    if progress is not None:
+        def suggested(spider):
+            progress("Fetched {} pages, suggested {} PDFs".format(
+                crawler.stats.get_value("response_received_count", 0),
+                crawler.stats.get_value("item_scraped_count", 0)))
+
+        crawler.signals.connect(suggested, signal=signals.item_scraped)
+        crawler.signals.connect(suggested, signal=signals.spider_closed)
+
+    process.crawl(crawler, db=db, blob_store=blob_store, incremental=not force, **kwargs)
     process.start()
 
 
-def update_db(df, db, app=None):
-    """ Updates database using given pandas DataFrame if the given entry
-    is not already present in database
+def upsert_results(entries, db):
+    """ Merge exam results into the results table using a single transaction. The entries
+    are staged in a temporary table using one multi-row insert, and then merged into
+    results with a single INSERT ... ON CONFLICT, only touching rows whose values changed.
+    The statistics of the changed courses are refreshed in the same transaction.
 
-    >>> update_db(df, db) # doctest: +SKIP
-    Formatting data...
-    9/9
-    Inserting data...
-    20000/20000
-    Inserted 200 entries in database
+    >>> upsert_results([{"taken": "2019-01-14", "code": "EDA322", ...}], db) # doctest: +SKIP
+    {'inserted': 1, 'updated': 0, 'unchanged': 0}
+
+    :param entries: list of dictionaries with the keys taken, code, name, failures, threes,
+    fours and fives, at most one per course code and exam date
+    :param db: DBInterface object to use when merging the results
+    :return: dictionary counting the inserted, updated and unchanged entries
+    """
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not entries:
+        return counts
+
+    with db.transaction() as cursor:
+        cursor.execute("CREATE TEMPORARY TABLE staged_results "
+                       "(LIKE results INCLUDING DEFAULTS) ON COMMIT DROP")
+        execute_values(cursor,
+                       "INSERT INTO staged_results "
+                       "(taken, code, name, failures, threes, fours, fives) VALUES %s",
+                       entries,
+                       template="(%(taken)s, %(code)s, %(name)s, %(failures)s, %(threes)s, "
+                                "%(fours)s, %(fives)s)",
+                       page_size=1000)
+
+        # xmax is only set for rows that existed before the statement
+        cursor.execute("INSERT INTO results (taken, code, name, failures, threes, fours, fives) "
+                       "SELECT taken, code, name, failures, threes, fours, fives "
+                       "FROM staged_results "
+                       "ON CONFLICT (code, taken) DO UPDATE SET "
+                       "name=EXCLUDED.name, failures=EXCLUDED.failures, "
+                       "threes=EXCLUDED.threes, fours=EXCLUDED.fours, fives=EXCLUDED.fives "
+                       "WHERE (results.name, results.failures, results.threes, results.fours, "
+                       "results.fives) IS DISTINCT FROM (EXCLUDED.name, EXCLUDED.failures, "
+                       "EXCLUDED.threes, EXCLUDED.fours, EXCLUDED.fives) "
+                       "RETURNING code, xmax = 0 AS inserted")
+        changed = cursor.fetchall()
+
+        # keep the statistics consistent with the results they are computed from
+        refresh_course_stats(cursor, {row["code"] for row in changed})
+
+    counts["inserted"] = sum(1 for row in changed if row["inserted"])
+    counts["updated"] = len(changed) - counts["inserted"]
+    counts["unchanged"] = len(entries) - len(changed)
+    return counts
+
+
+# columns of the results workbook needed to aggregate the exam results
+WORKBOOK_COLUMNS = ["Kurs", "Kursnamn", "Provnamn", "Betyg", "Antal", "Provdatum"]
+
+# number of rows read from the results workbook at a time
+BATCH_SIZE = 10000
+
+# grades that are recorded for an exam occasion and the result columns they're counted in
+GRADE_COLUMNS = {"U": "failures", "3": "threes", "4": "fours", "5": "fives"}
+
+
+def normalize_date(date):
+    """ Format exam date from workbook as YYYY-MM-DD
+
+    >>> normalize_date("12/26/1998")
+    '1998-12-26'
+
+    :param date: datetime or pandas Timestamp, or string in any format understood by dateutil
+    :return: formatted date, or the given value if it is neither
+    """
+    if isinstance(date, datetime):
+        return str(date.date())
+
+    # necessary because of different date formats in sheets
+    elif type(date) is str:
+        return str(parse(date).date())
 
+    return date
+
+
+def normalize_dates(column):
+    """ Format every exam date in a sheet column, parsing each distinct date only once
+
+    :param column: pandas Series of exam dates
+    :return: pandas Series of dates formatted as YYYY-MM-DD
+    """
+    column = column.astype(object)
+    dates = {date: normalize_date(date) for date in pd.unique(column)}
+    return column.map(dates)
+
+
+def aggregate_batches(batches):
+    """ Collect the exam results of every exam occasion in the given batches of rows. Only
+    the exam occasions are kept between batches, so the rows can be streamed from the
+    workbook using read_workbook.
+
+    >>> aggregate_batches(read_workbook("../results.xlsx")) # doctest: +SKIP
+    [{'taken': '2018-08-31', 'code': 'BMT025', 'name': 'Affärsjuridik', 'failures': 0, ...}]
+
+    :param batches: iterable of (sheet name, DataFrame) pairs containing at least the
+    columns in WORKBOOK_COLUMNS
+    :return: list of dictionaries with the keys taken, code, name, failures, threes, fours
+    and fives, one per course code and exam date in the order they first appear
+    """
+    occasions = []
+    for _, batch in batches:
+        exams = batch.loc[batch["Provnamn"] == "Tentamen"]
+        if exams.empty:
+            continue
+
+        # dates are normalized per batch since the sheets use different formats
+        exams = pd.DataFrame({
+            "Kurs": exams["Kurs"],
+            "Kursnamn": exams["Kursnamn"],
+            "Betyg": exams["Betyg"],
+            "Antal": exams["Antal"],
+            "taken": normalize_dates(exams["Provdatum"]),
+        })
+
+        # the last row of a grade decides the amount when it's given several times, so
+        # summing the remaining row of every grade pivots it into a column of its own
+        grades = exams.loc[exams["Betyg"].isin(list(GRADE_COLUMNS))]
+        grades = grades.drop_duplicates(["Kurs", "taken", "Betyg"], keep="last")
+        grades = grades.pivot_table(index=["Kurs", "taken"], columns="Betyg", values="Antal",
+                                    aggfunc="sum")
+
+        # one row per exam occasion of the batch, with the course name of its first row
+        # and NaN for the grades it lacks
+        names = exams.drop_duplicates(["Kurs", "taken"]).set_index(["Kurs", "taken"])
+        occasions.append(names[["Kursnamn"]].join(grades))
+
+    if not occasions:
+        return []
+
+    # an exam occasion may span several batches, where the grades of the later ones win
+    occasions = pd.concat(occasions, sort=False)
+    grades = [grade for grade in GRADE_COLUMNS if grade in occasions.columns]
+    occasions = occasions.groupby(level=["Kurs", "taken"], sort=False).agg(
+        dict({"Kursnamn": "first"}, **{grade: "last" for grade in grades}))
+    occasions = occasions.reindex(columns=["Kursnamn"] + list(GRADE_COLUMNS))
+    occasions[list(GRADE_COLUMNS)] = occasions[list(GRADE_COLUMNS)].fillna(0).astype(int)
+    occasions = occasions.rename(columns=dict(GRADE_COLUMNS, Kursnamn="name"))
+    occasions = occasions.reset_index().rename(columns={"Kurs": "code"})
+
+    columns = ["taken", "code", "name"] + list(GRADE_COLUMNS.values())
+    return [dict(zip(columns, row))
+            for row in zip(*(occasions[column].tolist() for column in columns))]
+
+
+def aggregate_results(df):
+    """ Collect the exam results of every exam occasion in the given sheets
+
+    >>> aggregate_results(df) # doctest: +SKIP
+    [{'taken': '2018-08-31', 'code': 'BMT025', 'name': 'Affärsjuridik', 'failures': 0, ...}]
 
     :param df: Pandas DataFrame object containing sheets from excel document
-    :param db: DBInterface object to use when sending exam suggestions
+    :return: list of dictionaries with the keys taken, code, name, failures, threes, fours
+    and fives, one per course code and exam date in the order they first appear
     """
-    db = db
+    return aggregate_batches(df.items())
 
-    print_or_log("Formatting data...", app=app)
+
+def aggregate_results_iterrows(df):
+    """ Row by row implementation of aggregate_results, kept as the reference that the
+    vectorized implementation is tested and benchmarked against
+
+    :param df: Pandas DataFrame object containing sheets from excel document
+    :return: same as aggregate_results
+    """
 
     # list to keep track of filtered data
     # keys are the date with the code concatenated
     entries = {}
-    i = 1
-    for key, sheet in df.items():
-
-        # print progress
-        print_or_log("{}/{}".format(i, len(df.items())), end="\r", app=app)
-        i += 1
+    for sheet in df.values():
 
         # prepare exam results from sheet period
-        for index, row in sheet.iterrows():
+        for _, row in sheet.iterrows():
 
             # skip if not exam
             if row["Provnamn"] != "Tentamen":
                 continue
 
-            # retrieve course code
             code = row["Kurs"]
-
-            # retrieve course name
-            name = row["Kursnamn"]
-
-            # retrieve grade
-            grade = row["Betyg"]
-
-            # retrieve amount of results
-            amount = row["Antal"]
-
-            # retrieve exam date
-            date = row["Provdatum"]
-            if type(date) is pd.Timestamp:
-                date = str(date.date())
-
-            # necessary because of different date formats in sheets
-            elif type(date) is str:
-                date = str(parse(date).date())
+            date = normalize_date(row["Provdatum"])
 
             # if exam occasion hasn't been encountered yet, add it
             key = code + date
@@ -91,7 +246,7 @@ def update_db(df, db, app=None):
                 entries[key] = {
                     "taken": date,
                     "code": code,
-                    "name": name,
+                    "name": row["Kursnamn"],
                     "failures": 0,
                     "threes": 0,
                     "fours": 0,
@@ -99,39 +254,171 @@ def update_db(df, db, app=None):
                 }
 
             # now modify grade that this iteration concerns in occasion
-            if grade == "U":
-                entries[key]["failures"] = amount
-            elif grade == "3":
-                entries[key]["threes"] = amount
-            elif grade == "4":
-                entries[key]["fours"] = amount
-            elif grade == "5":
-                entries[key]["fives"] = amount
-
-    print_or_log("\nInserting data...", app=app)
-    insertions = 0
-    i = 1
-
-    # go through entries and add them if they're not already present in the database
-    for key, entry in entries.items():
-
-        # print progress
-        print_or_log("{}/{}".format(i, len(entries.items())), end="\r", app=app)
-        i += 1
-
-        # see if there is an entry matching the course code and exam date
-        db_entry = db.query(
-            "SELECT * FROM results WHERE code=%s AND taken=%s", (entry["code"], entry["taken"]))
-
-        # if there isn't, we can insert the new result in the database
-        if len(db_entry) == 0:
-            insertions += 1
-
-            db.query("INSERT INTO results (taken, code, name, failures, threes, fours, fives) "
-                     "VALUES (%s,%s,%s,%s,%s,%s,%s)", (entry["taken"], entry["code"], entry["name"], entry["failures"],
-                                                       entry["threes"], entry["fours"], entry["fives"]))
-
-    print_or_log("\nInserted " + str(insertions) + " entries in database", app=app)
+            if row["Betyg"] in GRADE_COLUMNS:
+                entries[key][GRADE_COLUMNS[row["Betyg"]]] = row["Antal"]
+
+    return list(entries.values())
+
+
+def update_db(df, db, app=None):
+    """ Updates database using given sheets, inserting exam occasions that aren't present
+    in the database and updating the ones whose results have changed
+
+    >>> update_db(read_workbook("../results.xlsx"), db) # doctest: +SKIP
+    Formatting data...
+    Inserting data...
+    Inserted 200, updated 0 and left 19800 unchanged entries in database
+    {'inserted': 200, 'updated': 0, 'unchanged': 19800}
+
+
+    :param df: Pandas DataFrame object containing sheets from excel document, or iterable
+    of (sheet name, DataFrame) pairs such as the batches yielded by read_workbook
+    :param db: DBInterface object to use when sending exam suggestions
+    :return: dictionary counting the inserted, updated and unchanged entries
+    """
+    print_or_log("Formatting data...", app=app)
+    entries = aggregate_batches(df.items() if isinstance(df, Mapping) else df)
+
+    print_or_log("Inserting data...", app=app)
+    counts = upsert_results(entries, db)
+
+    print_or_log("Inserted {inserted}, updated {updated} and left {unchanged} unchanged "
+                 "entries in database".format(**counts), app=app)
+    return counts
+
+
+def workbook_frame(rows):
+    """ Create DataFrame of rows read from the results workbook
+
+    :param rows: lists of values of the columns in WORKBOOK_COLUMNS
+    :return: DataFrame with the columns in WORKBOOK_COLUMNS, and the amounts of Antal as
+    integers rather than the floats that the cells are stored as
+    """
+    frame = pd.DataFrame(rows, columns=WORKBOOK_COLUMNS)
+    frame["Antal"] = frame["Antal"].astype("Int64")
+    return frame
+
+
+def read_workbook(filename, batch_size=BATCH_SIZE, sheets=None):
+    """ Stream the rows of every sheet except 'Beskrivning' from an excel document in
+    batches, keeping only the columns in WORKBOOK_COLUMNS. At most one batch of rows is
+    held in memory at a time.
+
+    >>> next(read_workbook("../results.xlsx")) # doctest: +SKIP
+    ('läsår 2010_2011',         Kurs                        Kursnamn Provnamn ...
+    0     TDA341  Advanced functional programming  Tentamen ...
+
+    :param filename: filename to use for document
+    :param batch_size: maximum number of rows in every batch
+    :param sheets: names of the sheets to read, every sheet is read if not given
+    :return: generator of (sheet name, DataFrame) pairs
+    """
+    workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+
+            # filter description sheet
+            if sheet.title == "Beskrivning":
+                continue
+
+            if sheets is not None and sheet.title not in sheets:
+                continue
+
+            rows = sheet.iter_rows(values_only=True)
+            header = next(rows, None)
+            if header is None:
+                continue
+
+            try:
+                indices = [header.index(column) for column in WORKBOOK_COLUMNS]
+            except ValueError:
+                raise ValueError("Sheet {} lacks one of the columns {}".format(
+                    sheet.title, ", ".join(WORKBOOK_COLUMNS)))
+
+            batch = []
+            for row in rows:
+                batch.append([row[index] if index < len(row) else None for index in indices])
+                if len(batch) >= batch_size:
+                    yield sheet.title, workbook_frame(batch)
+                    batch = []
+
+            if batch:
+                yield sheet.title, workbook_frame(batch)
+
+    finally:
+        workbook.close()
+
+
+def fingerprint_sheets(batches):
+    """ Compute a fingerprint of the contents of every sheet in the given batches
+
+    >>> fingerprint_sheets(read_workbook("../results.xlsx")) # doctest: +SKIP
+    {'läsår 2010_2011': ('9f86d081884c7d659a2feaa0c55ad015a3bf4f1b2b0b822cd15d6c15b0f00a08',
+    20000), ...}
+
+    :param batches: iterable of (sheet name, DataFrame) pairs such as the batches yielded by
+    read_workbook, fingerprints only match when the batches were read with the same size
+    :return: dictionary mapping sheet names to (content hash, row count) tuples, in the
+    order the sheets appear
+    """
+    hashes = {}
+    rows = {}
+    for name, batch in batches:
+        if name not in hashes:
+            hashes[name] = hashlib.sha256()
+            rows[name] = 0
+
+        hashes[name].update(pd.util.hash_pandas_object(batch, index=False).values.tobytes())
+        rows[name] += len(batch)
+
+    return {name: (hashes[name].hexdigest(), rows[name]) for name in hashes}
+
+
+def ingest_workbook(filename, db, app=None, force=False):
+    """ Update the database with the sheets of the results workbook that are new or have
+    changed since they were last ingested. Fingerprints of the sheets are kept in the
+    workbook_sheets table, and the sheets are expected to cover separate academic years.
+
+    >>> ingest_workbook("../results.xlsx", db) # doctest: +SKIP
+    Skipping unchanged sheets: läsår 2010_2011, läsår 2011_2012
+    Formatting data...
+    Inserting data...
+    Inserted 200, updated 3 and left 19800 unchanged entries in database
+    {'inserted': 200, 'updated': 3, 'unchanged': 19800, 'ingested': [...], 'skipped': [...]}
+
+    :param filename: filename of results workbook
+    :param db: DBInterface object to use when updating the results
+    :param app: flask app object to use when logging
+    :param force: ingest every sheet even if it hasn't changed
+    :return: dictionary counting the inserted, updated and unchanged entries, together
+    with the names of the ingested and the skipped sheets
+    """
+    fingerprints = fingerprint_sheets(read_workbook(filename))
+    ingested = {entry["name"]: (entry["content_hash"], entry["rows"])
+                for entry in db.query("SELECT name, content_hash, rows FROM workbook_sheets")}
+
+    changed = [name for name, fingerprint in fingerprints.items()
+               if force or ingested.get(name) != fingerprint]
+    skipped = [name for name in fingerprints if name not in changed]
+
+    if skipped:
+        print_or_log("Skipping unchanged sheets: " + ", ".join(skipped), app=app)
+
+    counts = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if changed:
+        counts = update_db(read_workbook(filename, sheets=changed), db, app=app)
+
+        # only recorded once the results are in, so a failed ingest is retried next time
+        db.query("INSERT INTO workbook_sheets (name, content_hash, rows) "
+                 "SELECT * FROM unnest(%s::VARCHAR[], %s::CHAR(64)[], %s::INTEGER[]) "
+                 "ON CONFLICT (name) DO UPDATE SET content_hash=EXCLUDED.content_hash, "
+                 "rows=EXCLUDED.rows, ingested=now()",
+                 (changed, [fingerprints[name][0] for name in changed],
+                  [fingerprints[name][1] for name in changed]))
+
+    counts["ingested"] = changed
+    counts["skipped"] = skipped
+    return counts
 
 
 def load_dataframe(filename):
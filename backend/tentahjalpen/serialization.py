@@ -0,0 +1,90 @@
+"""
+Serialization of course responses to JSON. Exam results are shaped for a response in a
+single pass over the rows queried from the database, building the URLs of their PDFs
+from one template per response, while dates are left for the encoder to format. The
+encoder is orjson when it is installed, and the json module of the standard library
+otherwise.
+"""
+
+import json
+from datetime import date
+from urllib.parse import quote
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(value):
+    """ Serialize the values json can't handle by itself, dates become YYYY-MM-DD """
+
+    if isinstance(value, date):
+        return value.isoformat()
+
+    raise TypeError("Object of type {} is not JSON serializable".format(
+        type(value).__name__))
+
+
+def dumps(value):
+    """ Serialize value to UTF-8 encoded JSON
+
+    >>> dumps({"taken": date(2014, 3, 12)})
+    b'{"taken":"2014-03-12"}'
+
+    :param value: value to serialize, may contain dates
+    :return: bytes of JSON document
+    """
+    if orjson is not None:
+        return orjson.dumps(value, default=_default)
+
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"),
+                      default=_default).encode("utf-8")
+
+
+def format_results(entries, courses_url):
+    """ Shape exam results queried from the results table for use in a response, replacing
+    the digests of their PDFs with URLs the PDFs can be downloaded from
+
+    >>> format_results(entries, "http://localhost:5000/courses") # doctest: +SKIP
+    [{'code': 'EDA322', ..., 'exam': 'http://localhost:5000/courses/EDA322/2014-03-12/exam'}]
+
+    :param entries: rows with the columns code, name, taken, failures, threes, fours, fives,
+    exam, solution and adjusted_fail_rate, exam and solution holding digests
+    :param courses_url: external URL of the course list, which the PDF URLs start with
+    :return: list of dictionaries
+    """
+    template = courses_url + "/{}/{}/{}"
+    quoted_codes = {}
+
+    results = []
+    for entry in entries:
+        code = entry["code"]
+        exam = entry["exam"]
+        solution = entry["solution"]
+
+        if exam is not None or solution is not None:
+            quoted = quoted_codes.get(code)
+            if quoted is None:
+                quoted = quoted_codes[code] = quote(code, safe="/:")
+
+            taken = entry["taken"].isoformat()
+            if exam is not None:
+                exam = template.format(quoted, taken, "exam")
+            if solution is not None:
+                solution = template.format(quoted, taken, "solution")
+
+        results.append({
+            "code": code,
+            "name": entry["name"],
+            "taken": entry["taken"],
+            "failures": entry["failures"],
+            "threes": entry["threes"],
+            "fours": entry["fours"],
+            "fives": entry["fives"],
+            "exam": exam,
+            "solution": solution,
+            "adjusted_fail_rate": entry["adjusted_fail_rate"],
+        })
+
+    return results
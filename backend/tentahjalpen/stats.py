@@ -0,0 +1,110 @@
+"""
+Statistics computed from the results of every course at once using pandas, and kept in the
+course_stats table. The adjusted fail rate is the average fail rate of the largest sittings
+of the last few years of a course, leaving out sittings with too few participants. This
+avoids the bias of re-exams, which are taken by fewer students and mainly by those who
+failed before, and of results from long ago.
+"""
+
+import pandas as pd
+from psycopg2.extras import execute_values
+
+
+# the statistics of the courses present when course_stats was added are computed by
+# migrations/0006_course_stats.sql, using the values of these defaults; the tests of the
+# migrations check that both compute the same statistics
+
+# years before the latest sitting of a course that are considered
+WINDOW_YEARS = 3
+
+# number of sittings with the most participants that are averaged
+MAJOR_SITTINGS = 3
+
+# sittings with fewer participants than this are left out
+MIN_PARTICIPANTS = 20
+
+# columns of the results table needed to compute the statistics
+RESULT_COLUMNS = ["code", "taken", "failures", "threes", "fours", "fives"]
+
+
+def adjusted_fail_rates(results, window_years=WINDOW_YEARS, sittings=MAJOR_SITTINGS,
+                        min_participants=MIN_PARTICIPANTS):
+    """ Compute the adjusted fail rate of every course in the given results
+
+    >>> adjusted_fail_rates(results) # doctest: +SKIP
+             adjusted_fail_rate  sittings
+    code
+    EDA322            33.333333         3
+
+    :param results: DataFrame with the columns in RESULT_COLUMNS, one row per sitting
+    :param window_years: years before the latest sitting of a course that are considered
+    :param sittings: number of sittings with the most participants that are averaged
+    :param min_participants: sittings with fewer participants than this are left out
+    :return: DataFrame indexed by course code with the adjusted fail rate in percent, NaN
+    if no sitting qualified, and the number of sittings it is computed from
+    """
+    results = results.loc[results["code"].notnull(), RESULT_COLUMNS].copy()
+    results["taken"] = pd.to_datetime(results["taken"])
+    grades = results[["failures", "threes", "fours", "fives"]].fillna(0)
+    results["participants"] = grades.sum(axis=1)
+    results["fail_rate"] = grades["failures"] / results["participants"] * 100
+
+    latest = results.groupby("code")["taken"].transform("max")
+    recent = results.loc[(results["taken"] > latest - pd.DateOffset(years=window_years))
+                         & (results["participants"] >= max(min_participants, 1))]
+
+    # most participants first, the latest sitting wins ties
+    major = recent.sort_values(["code", "participants", "taken"], ascending=[True, False, False])
+    major = major.groupby("code").head(sittings)
+
+    stats = major.groupby("code")["fail_rate"].agg(["mean", "size"])
+    stats.columns = ["adjusted_fail_rate", "sittings"]
+
+    # courses without any qualifying sitting are kept without a rate
+    stats = stats.reindex(pd.unique(results["code"]))
+    stats["sittings"] = stats["sittings"].fillna(0).astype(int)
+    stats.index.name = "code"
+    return stats
+
+
+def refresh_course_stats(cursor, codes=None):
+    """ Recompute the statistics of the given courses and store them in course_stats
+
+    >>> with db.transaction() as cursor: # doctest: +SKIP
+    ...     refresh_course_stats(cursor, ["EDA322"])
+    1
+
+    :param cursor: cursor to execute the statements with, typically of a transaction that
+    has just changed the results of the courses
+    :param codes: course codes to refresh, every course is refreshed if not given
+    :return: number of courses refreshed
+    """
+    if codes is None:
+        cursor.execute("SELECT " + ", ".join(RESULT_COLUMNS) + " FROM results")
+    else:
+        cursor.execute("SELECT " + ", ".join(RESULT_COLUMNS) + " FROM results "
+                       "WHERE code = ANY(%s)", (list(codes),))
+    results = pd.DataFrame(cursor.fetchall(), columns=RESULT_COLUMNS)
+
+    stats = adjusted_fail_rates(results)
+    rows = [(code, None if pd.isnull(rate) else float(rate), int(sittings))
+            for code, rate, sittings in zip(stats.index, stats["adjusted_fail_rate"],
+                                            stats["sittings"])]
+
+    if rows:
+        execute_values(cursor,
+                       "INSERT INTO course_stats (code, adjusted_fail_rate, sittings) VALUES %s "
+                       "ON CONFLICT (code) DO UPDATE SET "
+                       "adjusted_fail_rate=EXCLUDED.adjusted_fail_rate, "
+                       "sittings=EXCLUDED.sittings, computed=now()",
+                       rows, page_size=1000)
+
+    # drop statistics of courses that no longer have any results
+    if codes is None:
+        cursor.execute("DELETE FROM course_stats WHERE code NOT IN (SELECT code FROM results "
+                       "WHERE code IS NOT NULL)")
+    else:
+        cursor.execute("DELETE FROM course_stats WHERE code = ANY(%s) AND NOT (code = ANY(%s))",
+                       (list(codes), list(stats.index)))
+
+    return len(rows)
@@ -6,6 +6,7 @@ import pytest
 
 import tentahjalpen
 from tentahjalpen.db_interface import DBInterface
+from tentahjalpen.blob_store import PostgresBlobStore
 from db_manager import init_db
 
 
@@ -55,12 +56,13 @@ def suggestion_db(basic_db):
 
     # get test.pdf file to use for mocking exam suggestions
     file_bytes = open("tests/test.pdf", "rb").read()
+    digest = PostgresBlobStore(test_db).put(file_bytes)
 
-    test_db.query("INSERT INTO exam_suggestions (taken, code, exam) VALUES (%s, %s, %s)",
-                  (date(1998, 12, 26), "EDA322", file_bytes))
+    test_db.query("INSERT INTO exam_suggestions (taken, code, exam_hash) VALUES (%s, %s, %s)",
+                  (date(1998, 12, 26), "EDA322", digest))
 
-    test_db.query("INSERT INTO exam_suggestions (taken, code, solution) VALUES (%s, %s, %s)",
-                  (date(2012, 12, 26), "EDA321", file_bytes))
+    test_db.query("INSERT INTO exam_suggestions (taken, code, solution_hash) VALUES (%s, %s, %s)",
+                  (date(2012, 12, 26), "EDA321", digest))
 
     return test_db
 
@@ -74,16 +76,18 @@ def filled_db(inited_db):
 
     # get test.pdf file to use for mocking exam suggestions
     file_bytes = open("tests/test.pdf", "rb").read()
+    digest = PostgresBlobStore(test_db).put(file_bytes)
 
-    test_db.query("INSERT INTO results (taken, code, name, exam, failures, threes, fours, fives)"
+    test_db.query("""INSERT INTO results
+                  (taken, code, name, exam_hash, failures, threes, fours, fives)"""
                   "VALUES (%s,%s,%s,%s,%s,%s,%s,%s)",
-                  (date(1998, 12, 26), "EDA322", "Digital Konstruktion", file_bytes,
+                  (date(1998, 12, 26), "EDA322", "Digital Konstruktion", digest,
                    300, 200, 100, 10))
 
     test_db.query("""INSERT INTO results
-                  (taken, code, name, solution, failures, threes, fours, fives)"""
+                  (taken, code, name, solution_hash, failures, threes, fours, fives)"""
                   "VALUES (%s,%s,%s,%s,%s,%s,%s,%s)",
-                  (date(2012, 12, 26), "EDA321", "Digital Design", file_bytes,
+                  (date(2012, 12, 26), "EDA321", "Digital Design", digest,
                    200, 100, 10, 1))
 
     return test_db
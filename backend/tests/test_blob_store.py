@@ -0,0 +1,134 @@
+"""Unit tests for both backends of the blob store."""
+
+# pylint: disable=redefined-outer-name
+import io
+import pytest
+
+from tentahjalpen.blob_store import PostgresBlobStore, FileBlobStore, BlobTooLarge, blob_hash
+from tentahjalpen.blob_store import move_blobs, rewrite_blobs
+
+
+@pytest.fixture(params=["postgres", "file"])
+def blob_store(request, inited_db, tmpdir):
+    """Blob store using each of the available backends"""
+
+    if request.param == "postgres":
+        return PostgresBlobStore(inited_db)
+
+    return FileBlobStore(str(tmpdir.join("blobs")))
+
+
+def test_put_get(blob_store):
+    """Verify that stored data can be retrieved using the returned digest"""
+
+    file_bytes = open("tests/test.pdf", "rb").read()
+
+    digest = blob_store.put(file_bytes)
+    assert digest == blob_hash(file_bytes)
+    assert blob_store.get(digest) == file_bytes
+
+
+def test_get_missing(blob_store):
+    """Verify that retrieving a digest which hasn't been stored gives None"""
+
+    assert blob_store.get(blob_hash(b"missing")) is None
+    assert not blob_store.exists(blob_hash(b"missing"))
+
+
+def test_put_identical(blob_store):
+    """Verify that identical data is only stored once"""
+
+    first = blob_store.put(b"%PDF-1.4 identical")
+    second = blob_store.put(b"%PDF-1.4 identical")
+
+    assert first == second
+    blob_store.delete(first)
+    assert not blob_store.exists(first)
+
+
+def test_iter_range(blob_store):
+    """Verify that a blob can be read in chunks, in whole and in part"""
+
+    file_bytes = open("tests/test.pdf", "rb").read()
+    digest = blob_store.put(file_bytes)
+
+    assert blob_store.size(digest) == len(file_bytes)
+    assert b"".join(blob_store.iter_range(digest, chunk_size=1000)) == file_bytes
+    assert b"".join(blob_store.iter_range(digest, 10, 2500, chunk_size=1000)) == \
+        file_bytes[10:2500]
+
+
+def test_iter_range_missing(blob_store):
+    """Verify that reading a digest which hasn't been stored gives no chunks"""
+
+    assert blob_store.size(blob_hash(b"missing")) is None
+    assert list(blob_store.iter_range(blob_hash(b"missing"))) == []
+
+
+def test_put_file(blob_store):
+    """Verify that the contents of a file object are stored under their digest"""
+
+    file_bytes = open("tests/test.pdf", "rb").read()
+
+    with open("tests/test.pdf", "rb") as file:
+        digest = blob_store.put_file(file)
+
+    assert digest == blob_hash(file_bytes)
+    assert blob_store.get(digest) == file_bytes
+
+
+def test_put_file_too_large(blob_store):
+    """Verify that contents larger than the maximum size are refused and not stored"""
+
+    with pytest.raises(BlobTooLarge):
+        blob_store.put_file(io.BytesIO(b"%PDF" * 1024), max_size=1024)
+
+    assert not blob_store.exists(blob_hash(b"%PDF" * 1024))
+
+
+def test_postgres_single_row(inited_db):
+    """Verify that the postgres backend keeps a single row for identical data"""
+
+    blob_store = PostgresBlobStore(inited_db)
+    blob_store.put(b"%PDF-1.4 identical")
+    blob_store.put(b"%PDF-1.4 identical")
+
+    assert len(inited_db.query("SELECT hash FROM blobs")) == 1
+
+
+def test_file_invalid_digest(tmpdir):
+    """Verify that the file backend refuses digests that could escape its directory"""
+
+    blob_store = FileBlobStore(str(tmpdir))
+    with pytest.raises(ValueError):
+        blob_store.get("../../etc/passwd")
+
+
+def test_move_blobs(inited_db, tmpdir):
+    """Verify that the blobs in the blobs table are moved to a directory"""
+
+    source = PostgresBlobStore(inited_db)
+    digest = source.put(b"%PDF-1.4 moved")
+    destination = FileBlobStore(str(tmpdir))
+
+    assert move_blobs(inited_db, destination) == 1
+    assert destination.get(digest) == b"%PDF-1.4 moved"
+    assert not source.exists(digest)
+
+    assert move_blobs(inited_db, destination) == 0
+    assert move_blobs(inited_db, source) == 0
+
+
+def test_rewrite_blobs(inited_db):
+    """Verify that blobs stored compressed are rewritten uncompressed, and only those"""
+
+    blob_store = PostgresBlobStore(inited_db)
+    inited_db.query("ALTER TABLE blobs ALTER COLUMN data SET STORAGE EXTENDED")
+    compressed = blob_store.put(b"%PDF-1.4 " + b"0" * 10000)
+    inited_db.query("ALTER TABLE blobs ALTER COLUMN data SET STORAGE EXTERNAL")
+    uncompressed = blob_store.put(b"%PDF-1.4 " + b"1" * 10000)
+
+    assert rewrite_blobs(inited_db) == 1
+    assert rewrite_blobs(inited_db) == 0
+    assert blob_store.get(compressed) == b"%PDF-1.4 " + b"0" * 10000
+    assert blob_store.get(uncompressed) == b"%PDF-1.4 " + b"1" * 10000
@@ -0,0 +1,158 @@
+"""Unit tests for the response cache, and functional tests of its invalidation through
+notifications from the database."""
+
+# pylint: disable=redefined-outer-name
+import time
+import pytest
+
+import tentahjalpen
+from tentahjalpen.cache import ResponseCache
+from tentahjalpen.stats import refresh_course_stats
+
+
+def wait_until(condition, timeout=5.0):
+    """Wait for condition to become true, returning whether it did before the timeout"""
+
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+
+    return True
+
+
+@pytest.fixture()
+def response_cache():
+    """Enabled cache holding at most two responses"""
+
+    response_cache = ResponseCache(2)
+    response_cache.enable()
+    return response_cache
+
+
+@pytest.fixture()
+def listening_app(filled_db):
+    """Application whose response cache is invalidated through notifications"""
+
+    app = tentahjalpen.create_app(test_db=filled_db)
+    listener = app.extensions["results_listener"]
+    listener.start()
+    assert wait_until(lambda: app.extensions["response_cache"].enabled)
+
+    yield app
+    listener.stop()
+    listener.join()
+
+
+def test_lru(response_cache):
+    """Verify that the least recently used response is evicted"""
+
+    generation = response_cache.generation
+    response_cache.put(("get_course", "EDA321", ""), b"1", generation)
+    response_cache.put(("get_course", "EDA322", ""), b"2", generation)
+    assert response_cache.get(("get_course", "EDA321", "")) == b"1"
+
+    response_cache.put(("get_course", "EDA323", ""), b"3", generation)
+    assert response_cache.get(("get_course", "EDA322", "")) is None
+    assert response_cache.get(("get_course", "EDA321", "")) == b"1"
+
+
+def test_invalidate_codes(response_cache):
+    """Verify that only responses for the given codes and for every course are dropped"""
+
+    generation = response_cache.generation
+    response_cache.put(("get_course", "EDA321", ""), b"1", generation)
+    response_cache.put(("get_courses", None, ""), b"[]", generation)
+    response_cache.invalidate(["EDA322"])
+
+    assert response_cache.get(("get_course", "EDA321", "")) == b"1"
+    assert response_cache.get(("get_courses", None, "")) is None
+
+
+def test_invalidate_batch(response_cache):
+    """Verify that responses concerning several courses are dropped along with any of
+    them"""
+
+    generation = response_cache.generation
+    response_cache.put(("get_course_batch", ("EDA321", "EDA322"), ""), b"{}", generation)
+    response_cache.invalidate(["EDA323"])
+    assert response_cache.get(("get_course_batch", ("EDA321", "EDA322"), "")) == b"{}"
+
+    response_cache.invalidate(["EDA322"])
+    assert response_cache.get(("get_course_batch", ("EDA321", "EDA322"), "")) is None
+
+
+def test_put_after_invalidate(response_cache):
+    """Verify that a response built before an invalidation isn't cached"""
+
+    generation = response_cache.generation
+    response_cache.invalidate(["EDA321"])
+    response_cache.put(("get_course", "EDA321", ""), b"1", generation)
+
+    assert response_cache.get(("get_course", "EDA321", "")) is None
+
+
+def test_disabled():
+    """Verify that nothing is cached until the cache is enabled"""
+
+    response_cache = ResponseCache(2)
+    response_cache.put(("get_course", "EDA321", ""), b"1", response_cache.generation)
+
+    assert response_cache.get(("get_course", "EDA321", "")) is None
+
+
+def test_notify_invalidates(listening_app, filled_db):
+    """Verify that a changed course is no longer served from the cache"""
+
+    client = listening_app.test_client()
+    response_cache = listening_app.extensions["response_cache"]
+
+    assert client.get("/courses/EDA322").get_json()[0]["failures"] == 300
+    assert client.get("/courses/EDA321").status_code == 200
+    assert response_cache.hits == 0
+
+    client.get("/courses/EDA322")
+    assert response_cache.hits == 1
+
+    filled_db.query("UPDATE results SET failures=%s WHERE code=%s", (301, "EDA322"))
+    assert wait_until(lambda: response_cache.get(
+        ("get_course", "EDA322", "http://localhost/")) is None)
+
+    assert client.get("/courses/EDA322").get_json()[0]["failures"] == 301
+    assert response_cache.get(("get_course", "EDA321", "http://localhost/")) is not None
+
+
+def test_notify_stats_invalidates(listening_app, filled_db):
+    """Verify that the course list is no longer served from the cache once the statistics
+    of the courses are refreshed, which leaves the results untouched"""
+
+    client = listening_app.test_client()
+    response_cache = listening_app.extensions["response_cache"]
+
+    client.get("/courses")
+    assert response_cache.get(("get_courses", None, "http://localhost/")) is not None
+
+    with filled_db.transaction() as cursor:
+        refresh_course_stats(cursor)
+
+    assert wait_until(lambda: response_cache.get(
+        ("get_courses", None, "http://localhost/")) is None)
+
+
+def test_batch_cached(listening_app, filled_db):
+    """Verify that a batch is served from the cache, keyed by its distinct course codes,
+    until any of its courses changes"""
+
+    client = listening_app.test_client()
+    response_cache = listening_app.extensions["response_cache"]
+    key = ("get_course_batch", ("EDA322", "EDA321"), "http://localhost/")
+
+    client.get("/courses/batch?codes=EDA322,EDA321,EDA322")
+    assert response_cache.get(key) is not None
+
+    filled_db.query("UPDATE results SET failures=%s WHERE code=%s", (301, "EDA321"))
+    assert wait_until(lambda: response_cache.get(key) is None)
+
+    data = client.get("/courses/batch?codes=EDA322,EDA321").get_json()
+    assert data["EDA321"][0]["failures"] == 301
@@ -0,0 +1,31 @@
+"""Unit tests for the compression of response bodies."""
+
+import gzip
+import pytest
+
+from tentahjalpen.compression import encode
+
+
+def test_encode_gzip():
+    """Verify that large bodies are compressed and can be decompressed again"""
+
+    body = b'[{"code": "EDA322", "name": "Digital konstruktion"}]' * 100
+    encoding, compressed = encode(body, "gzip")
+
+    assert encoding == "gzip"
+    assert len(compressed) < len(body)
+    assert gzip.decompress(compressed) == body
+
+
+def test_encode_small():
+    """Verify that bodies below the size threshold are left uncompressed"""
+
+    body = b'[{"code": "EDA322"}]'
+    assert encode(body, "gzip", min_size=len(body) + 1) == (None, body)
+
+
+def test_encode_unsupported():
+    """Verify that an encoding which isn't offered is refused"""
+
+    with pytest.raises(ValueError):
+        encode(b"[]", "compress", min_size=0)
@@ -0,0 +1,52 @@
+"""Unit tests for the course catalog kept up to date by the triggers on results."""
+
+from datetime import date
+
+from tentahjalpen.db_interface import approve
+
+
+def catalog(test_db, code):
+    """Return the catalog entry of the course, or None if it has none"""
+
+    entries = test_db.query("SELECT * FROM course_catalog WHERE code=%s", (code,))
+    return entries[0] if entries else None
+
+
+def test_latest_name(basic_db):
+    """Verify that the catalog holds the name of the latest sitting"""
+
+    test_db = basic_db
+    test_db.query("INSERT INTO results (taken, code, name, failures, threes, fours, fives)"
+                  "VALUES (%s,%s,%s,%s,%s,%s,%s)",
+                  (date(2019, 1, 14), "EDA322", "Digital konstruktion", 1, 2, 3, 4))
+
+    entry = catalog(test_db, "EDA322")
+    assert entry["name"] == "Digital konstruktion"
+    assert entry["sittings"] == 2
+    assert entry["first_taken"] == date(1998, 12, 26)
+    assert entry["last_taken"] == date(2019, 1, 14)
+
+    # other courses are left alone
+    assert catalog(test_db, "EDA321")["sittings"] == 1
+
+
+def test_approve_counts(suggestion_db):
+    """Verify that approving a suggested exam is counted in the catalog"""
+
+    test_db = suggestion_db
+    assert catalog(test_db, "EDA322")["exams"] == 0
+
+    suggestion = test_db.query("SELECT id FROM exam_suggestions WHERE code=%s", ("EDA322",))[0]
+    approve(suggestion["id"], test_db)
+
+    assert catalog(test_db, "EDA322")["exams"] == 1
+
+
+def test_remove_course(basic_db):
+    """Verify that a course without results is removed from the catalog"""
+
+    test_db = basic_db
+    test_db.query("DELETE FROM results WHERE code=%s", ("EDA322",))
+
+    assert catalog(test_db, "EDA322") is None
+    assert catalog(test_db, "EDA321") is not None
@@ -0,0 +1,65 @@
+"""Unit tests for the version of the course data kept by the triggers on results and
+course_stats."""
+
+from tentahjalpen.data_version import DataVersion
+from tentahjalpen.scraper.scraper import upsert_results
+from tentahjalpen.stats import refresh_course_stats
+
+
+def version(test_db):
+    """Return the version in the data_version table"""
+
+    return test_db.query("SELECT version FROM data_version")[0]["version"]
+
+
+def test_bump_on_change(basic_db):
+    """Verify that changing results bumps the version"""
+
+    test_db = basic_db
+    before = version(test_db)
+
+    test_db.query("UPDATE results SET exam_hash=%s WHERE code=%s", ("0" * 64, "EDA322"))
+    assert version(test_db) == before + 1
+
+    test_db.query("DELETE FROM results WHERE code=%s", ("EDA322",))
+    assert version(test_db) == before + 2
+
+
+def test_bump_on_stats(basic_db):
+    """Verify that refreshing the statistics of the courses bumps the version, since they
+    are part of the course list"""
+
+    test_db = basic_db
+    before = version(test_db)
+
+    with test_db.transaction() as cursor:
+        refresh_course_stats(cursor)
+
+    assert version(test_db) == before + 1
+
+
+def test_no_bump_without_change(basic_db):
+    """Verify that statements which don't change any results keep the version"""
+
+    test_db = basic_db
+    before = version(test_db)
+
+    test_db.query("UPDATE results SET exam_hash=%s WHERE code=%s", ("0" * 64, "MEM420"))
+    upsert_results([{"taken": "1998-12-26", "code": "EDA322", "name": "Digital Konstruktion",
+                     "failures": 300, "threes": 200, "fours": 100, "fives": 10}], test_db)
+
+    assert version(test_db) == before
+
+
+def test_data_version_cached(basic_db):
+    """Verify that the version is remembered until invalidated"""
+
+    test_db = basic_db
+    data_version = DataVersion(test_db, ttl=60)
+    current, _ = data_version.get()
+
+    test_db.query("DELETE FROM results WHERE code=%s", ("EDA322",))
+    assert data_version.get()[0] == current
+
+    data_version.invalidate()
+    assert data_version.get()[0] == current + 1
@@ -1,7 +1,12 @@
 """Unit tests for the db_interface class."""
 
-from tentahjalpen.db_interface import list_suggestions, remove, remove_all
-from tentahjalpen.db_interface import approve, approve_all, init_db
+import io
+import threading
+
+from tentahjalpen.db_interface import list_suggestions, remove, remove_all, add_suggestion
+from tentahjalpen.db_interface import approve, approve_all, init_db, release_blob
+from tentahjalpen.db_interface import LOCK_BLOB_QUERY
+from tentahjalpen.blob_store import PostgresBlobStore, blob_hash
 
 
 def test_list(suggestion_db, capfd):
@@ -32,6 +37,81 @@ def test_list_empty(inited_db, capfd):
     assert "solution" not in out
 
 
+def test_add_suggestion_identical(suggestion_db, capfd):
+    """Verify that submitting a PDF identical to a pending suggestion for the same exam
+    only counts another submission, which is shown when listing the suggestions"""
+
+    test_db = suggestion_db
+    digest = test_db.query(
+        "SELECT exam_hash FROM exam_suggestions WHERE code=%s", ("EDA322",))[0]["exam_hash"]
+
+    assert add_suggestion("EDA322", "1998-12-26", "exam", digest, test_db) == 2
+    assert add_suggestion("EDA322", "1998-12-26", "exam", digest, test_db) == 3
+    assert len(test_db.query("SELECT * FROM exam_suggestions WHERE code=%s",
+                             ("EDA322",))) == 1
+
+    # the same pdf suggested as the solution is a suggestion of its own
+    assert add_suggestion("EDA322", "1998-12-26", "solution", digest, test_db) == 1
+
+    list_suggestions(test_db)
+    out, _ = capfd.readouterr()
+
+    assert "Submissions" in out
+    assert "3" in out
+
+
+def test_add_suggestion_approved(filled_db):
+    """Verify that a PDF identical to the approved one isn't suggested again for the
+    same exam"""
+
+    test_db = filled_db
+    digest = test_db.query(
+        "SELECT exam_hash FROM results WHERE code=%s", ("EDA322",))[0]["exam_hash"]
+
+    assert add_suggestion("EDA322", "1998-12-26", "exam", digest, test_db) is None
+    assert test_db.query("SELECT * FROM exam_suggestions") == []
+
+
+def test_add_suggestion_file(basic_db):
+    """Verify that a PDF given as a file is stored along with its suggestion"""
+
+    test_db = basic_db
+    data = b"%PDF-1.4 uploaded"
+
+    assert add_suggestion("EDA322", "1998-12-26", "exam", blob_hash(data), test_db,
+                          file=io.BytesIO(data)) == 1
+    assert PostgresBlobStore(test_db).get(blob_hash(data)) == data
+
+
+def test_release_blob_locked(suggestion_db):
+    """Verify that a blob isn't released while a suggestion of the same PDF is being
+    added, which holds the lock on its digest until it has been committed"""
+
+    test_db = suggestion_db
+    blob_store = PostgresBlobStore(test_db)
+    digest = blob_store.put(b"%PDF-1.4 locked")
+
+    connection = test_db.connect()
+    try:
+        cursor = connection.cursor()
+        cursor.execute(LOCK_BLOB_QUERY, (digest,))
+
+        releasing = threading.Thread(target=release_blob, args=(digest, test_db))
+        releasing.start()
+        releasing.join(0.5)
+        assert releasing.is_alive()
+
+        cursor.execute("INSERT INTO exam_suggestions (taken, code, exam_hash) "
+                       "VALUES (%s, %s, %s)", ("2012-12-26", "EDA321", digest))
+        connection.commit()
+        releasing.join(5)
+    finally:
+        connection.close()
+
+    assert not releasing.is_alive()
+    assert blob_store.exists(digest)
+
+
 def test_remove(suggestion_db):
     """Verify that the function actually removes the entry in exam_suggestions table"""
 
@@ -45,6 +125,9 @@ def test_remove(suggestion_db):
         "SELECT * FROM exam_suggestions WHERE code=%s", ("EDA322",))
     assert not matching
 
+    # the pdf is still suggested for EDA321, so it must be kept
+    assert PostgresBlobStore(test_db).exists(entry["exam_hash"])
+
 
 def test_remove_invalid(suggestion_db):
     """Verify that the function doesn't remove anything when attempting to remove something
@@ -73,6 +156,9 @@ def test_remove_all(suggestion_db):
     num_entries = len(test_db.query("SELECT * FROM exam_suggestions"))
     assert num_entries == 0
 
+    # nothing references the suggested pdfs anymore
+    assert not test_db.query("SELECT * FROM blobs")
+
 
 def test_remove_all_empty(inited_db):
     """Verify that the function doesn't crash when running on empty table"""
@@ -89,11 +175,11 @@ def test_approve(suggestion_db):
 
     r_entry = test_db.query(
         "SELECT * FROM results WHERE code=%s", ("EDA322",))[0]
-    assert r_entry["exam"] is None
+    assert r_entry["exam_hash"] is None
 
     es_entry = test_db.query(
         "SELECT * FROM exam_suggestions WHERE code=%s", ("EDA322",))[0]
-    pdf = es_entry["exam"]
+    pdf = es_entry["exam_hash"]
     approve(es_entry["id"], test_db)
 
     es_entry = test_db.query(
@@ -102,7 +188,43 @@ def test_approve(suggestion_db):
 
     r_entry = test_db.query(
         "SELECT * FROM results WHERE code=%s", ("EDA322",))[0]
-    assert r_entry["exam"] == pdf
+    assert r_entry["exam_hash"] == pdf
+    assert PostgresBlobStore(test_db).exists(pdf)
+
+
+def test_approve_replaces(basic_db):
+    """Verify that approving a suggestion for an exam that already has a PDF releases the
+    replaced PDF"""
+
+    test_db = basic_db
+    blob_store = PostgresBlobStore(test_db)
+    old = blob_store.put(b"%PDF-1.4 old")
+    new = blob_store.put(b"%PDF-1.4 new")
+    test_db.query("UPDATE results SET exam_hash=%s WHERE code=%s", (old, "EDA322"))
+    add_suggestion("EDA322", "1998-12-26", "exam", new, test_db)
+
+    approve(test_db.query("SELECT id FROM exam_suggestions")[0]["id"], test_db)
+
+    assert test_db.query("SELECT exam_hash FROM results WHERE code=%s",
+                         ("EDA322",))[0]["exam_hash"] == new
+    assert not blob_store.exists(old)
+    assert blob_store.exists(new)
+
+
+def test_approve_all_replaces(basic_db):
+    """Verify that approving all suggestions releases the PDFs they replace"""
+
+    test_db = basic_db
+    blob_store = PostgresBlobStore(test_db)
+    old = blob_store.put(b"%PDF-1.4 old")
+    new = blob_store.put(b"%PDF-1.4 new")
+    test_db.query("UPDATE results SET solution_hash=%s WHERE code=%s", (old, "EDA321"))
+    add_suggestion("EDA321", "2012-12-26", "solution", new, test_db)
+
+    approve_all(test_db, blob_store)
+
+    assert not blob_store.exists(old)
+    assert blob_store.exists(new)
 
 
 def test_approve_invalid(basic_db):
@@ -113,7 +235,7 @@ def test_approve_invalid(basic_db):
 
     approve(1, test_db)
 
-    entries = test_db.query("SELECT * FROM results WHERE exam IS NOT NULL")
+    entries = test_db.query("SELECT * FROM results WHERE exam_hash IS NOT NULL")
     assert not entries
 
 
@@ -125,18 +247,60 @@ def test_approve_all(suggestion_db):
     r_entries = test_db.query("SELECT * FROM results")
     assert r_entries
     for entry in r_entries:
-        assert entry["exam"] is None
+        assert entry["exam_hash"] is None
 
-    es_entries = test_db.query("SELECT * FROM exam_suggestions")
-    pdfs = [entry["exam"] for entry in es_entries]
+    es_entries = test_db.query("SELECT * FROM exam_suggestions ORDER BY id")
+    pdfs = [entry["exam_hash"] for entry in es_entries]
     approve_all(test_db)
 
     es_entries = test_db.query("SELECT * FROM exam_suggestions")
     assert not es_entries
 
-    r_entries = test_db.query("SELECT * FROM results")
+    r_entries = test_db.query("SELECT * FROM results ORDER BY id")
     for i, _ in enumerate(r_entries):
-        assert r_entries[i]["exam"] == pdfs[i]
+        assert r_entries[i]["exam_hash"] == pdfs[i]
+
+
+def test_approve_all_most_submitted(suggestion_db):
+    """Verify that the most submitted of several suggestions for the same exam is approved,
+    and that the PDFs of the others are released"""
+
+    test_db = suggestion_db
+    blob_store = PostgresBlobStore(test_db)
+    digest = test_db.query(
+        "SELECT exam_hash FROM exam_suggestions WHERE code=%s", ("EDA322",))[0]["exam_hash"]
+
+    other = blob_store.put(b"%PDF-1.4 other")
+    add_suggestion("EDA322", "1998-12-26", "exam", other, test_db)
+    add_suggestion("EDA322", "1998-12-26", "exam", other, test_db)
+
+    approve_all(test_db, blob_store)
+
+    assert not test_db.query("SELECT * FROM exam_suggestions")
+    assert test_db.query(
+        "SELECT exam_hash FROM results WHERE code=%s", ("EDA322",))[0]["exam_hash"] == other
+
+    # the pdf that lost is still the approved solution of EDA321
+    assert test_db.query(
+        "SELECT solution_hash FROM results WHERE code=%s", ("EDA321",))[0]["solution_hash"] \
+        == digest
+    assert blob_store.exists(digest)
+
+
+def test_approve_all_unknown_exam(basic_db):
+    """Verify that suggestions for exams missing from the results are removed along with
+    their PDFs"""
+
+    test_db = basic_db
+    blob_store = PostgresBlobStore(test_db)
+
+    digest = blob_store.put(b"%PDF-1.4 unknown")
+    add_suggestion("MEM420", "2019-01-14", "exam", digest, test_db)
+
+    approve_all(test_db, blob_store)
+
+    assert not test_db.query("SELECT * FROM exam_suggestions")
+    assert not blob_store.exists(digest)
 
 
 def test_approve_all_empty(basic_db):
@@ -155,8 +319,9 @@ def test_init_db(empty_db):
     results = test_db.query("SELECT * FROM information_schema.tables WHERE table_schema=%s",
                             ("public",))
 
-    assert results[0]["table_name"] == "results"
-    assert results[1]["table_name"] == "exam_suggestions"
+    tables = [result["table_name"] for result in results]
+    assert "results" in tables
+    assert "exam_suggestions" in tables
 
 
 def test_init_db_filled(suggestion_db):
@@ -0,0 +1,69 @@
+"""Verify that the queries performed by the API are served by indexes. Sequential scans
+are disabled for the planner so that it picks an index whenever one is usable, even though
+the testing tables are small enough for a sequential scan to be cheaper."""
+
+# pylint: disable=redefined-outer-name
+import json
+from datetime import date
+import pytest
+import psycopg2
+
+from tentahjalpen.db_interface import COURSE_LIST_QUERY, COURSE_QUERY, COURSE_BATCH_QUERY
+from tentahjalpen.db_interface import PDF_QUERY, BLOB_REFERENCES_QUERY, ADD_SUGGESTION_QUERY
+from tentahjalpen.db_interface import COURSES_EXIST_QUERY
+
+
+TAKEN = date(1998, 12, 26)
+
+# queries performed by the routes, keyed by a description of where they're used
+ROUTE_QUERIES = {
+    "course list": (COURSE_LIST_QUERY, None),
+    "course": (COURSE_QUERY, ("EDA322",)),
+    "course batch": (COURSE_BATCH_QUERY, (["EDA322", "EDA321"],)),
+    "courses exist": (COURSES_EXIST_QUERY, (["EDA322", "EDA321"],)),
+    "exam": (PDF_QUERY.format(column="exam_hash"), ("EDA322", TAKEN)),
+    "solution": (PDF_QUERY.format(column="solution_hash"), ("EDA322", TAKEN)),
+    "suggestion": (ADD_SUGGESTION_QUERY.format(column="exam_hash"),
+                   {"code": "EDA322", "taken": TAKEN, "hash": "0" * 64}),
+    "blob references": (BLOB_REFERENCES_QUERY, {"hash": "0" * 64}),
+}
+
+
+def plan_nodes(plan):
+    """Yield every node of a plan returned by EXPLAIN (FORMAT JSON)"""
+
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+@pytest.fixture()
+def explain(filled_db):
+    """Function returning the node types of the plan for a query"""
+
+    filled_db.query("SET enable_seqscan = off")
+
+    def explain(query, args):
+        plan = filled_db.query("EXPLAIN (FORMAT JSON) " + query, args)[0]["QUERY PLAN"]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return [node["Node Type"] for node in plan_nodes(plan[0]["Plan"])]
+
+    yield explain
+    filled_db.query("RESET enable_seqscan")
+
+
+@pytest.mark.parametrize("route", sorted(ROUTE_QUERIES))
+def test_no_seq_scan(explain, route):
+    """Verify that the query does not fall back to a sequential scan"""
+
+    query, args = ROUTE_QUERIES[route]
+    assert "Seq Scan" not in explain(query, args)
+
+
+def test_unique_occasion(filled_db):
+    """Verify that an exam occasion can only be present once"""
+
+    with pytest.raises(psycopg2.IntegrityError):
+        filled_db.query("INSERT INTO results (taken, code, name) VALUES (%s, %s, %s)",
+                        (TAKEN, "EDA322", "Digital Konstruktion"))
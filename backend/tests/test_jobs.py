@@ -0,0 +1,140 @@
+"""Unit tests for running ingests and crawls in worker processes using JobRunner."""
+
+# pylint: disable=redefined-outer-name
+import time
+import socket
+
+import pytest
+
+from tentahjalpen.jobs import JobRunner
+from db_manager import list_jobs
+
+
+# seconds to wait for a worker, which has to start a new interpreter
+TIMEOUT = 60
+
+
+@pytest.fixture()
+def runner(inited_db, tmpdir):
+    """Runner whose workers connect to the initialized database"""
+
+    runner = JobRunner({"test_connection_url": inited_db.connection.dsn},
+                       log_dir=str(tmpdir), poll_interval=0.1)
+    yield runner
+    for job in runner.jobs():
+        runner.cancel(job.id)
+
+
+def closed_port():
+    """Return a port on localhost that nothing is listening on"""
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_ingest(inited_db, runner):
+    """Verify that the workbook is ingested by the worker, which reports its progress
+    and result"""
+
+    job = runner.wait(runner.submit("ingest", "tests/test.xlsx").id, TIMEOUT)
+
+    assert job.status == "succeeded"
+    assert job.result["inserted"] > 0
+    assert job.progress.startswith("Inserted")
+    assert inited_db.query("SELECT * FROM results")
+
+
+def test_failed(runner):
+    """Verify that jobs raising an exception fail, with the error as their progress and
+    the traceback in their log"""
+
+    job = runner.wait(runner.submit("ingest", "tests/missing.xlsx").id, TIMEOUT)
+
+    assert job.status == "failed"
+    assert "missing.xlsx" in job.progress
+    with open(job.log) as log:
+        assert "Traceback" in log.read()
+
+
+def test_crawl_repeated(runner):
+    """Verify that crawls can be run repeatedly, which isn't possible within a process"""
+
+    url = "http://127.0.0.1:{}/?page=listcourse".format(closed_port())
+    job = runner.wait(runner.submit("crawl", start_urls=[url]).id, TIMEOUT)
+    assert job.status == "succeeded"
+    assert job.progress == "Fetched 0 pages, suggested 0 PDFs"
+
+    job = runner.wait(runner.restart(job.id).id, TIMEOUT)
+    assert job.status == "succeeded"
+    assert job.attempts == 2
+
+
+def test_submit_after(runner):
+    """Verify that a job submitted after another is only started once that has
+    succeeded"""
+
+    ingest = runner.submit("ingest", "tests/test.xlsx")
+    url = "http://127.0.0.1:{}/?page=listcourse".format(closed_port())
+    crawl = runner.submit_after(ingest.id, "crawl", start_urls=[url])
+    assert crawl.status == "pending"
+
+    assert runner.wait(crawl.id, 2 * TIMEOUT).status == "succeeded"
+    assert ingest.status == "succeeded"
+    assert crawl.started >= ingest.finished
+
+
+def test_submit_after_failed(runner):
+    """Verify that a job submitted after one that fails is cancelled without running"""
+
+    ingest = runner.submit("ingest", "tests/missing.xlsx")
+    crawl = runner.wait(runner.submit_after(ingest.id, "crawl").id, TIMEOUT)
+
+    assert crawl.status == "cancelled"
+    assert crawl.attempts == 0
+    assert crawl.progress == "Job {} failed".format(ingest.id)
+
+
+def test_list_jobs_pending(runner, capsys):
+    """Verify that jobs which haven't started yet are listed without a start time"""
+
+    ingest = runner.submit("ingest", "tests/test.xlsx")
+    runner.submit_after(ingest.id, "crawl")
+    list_jobs(runner)
+
+    rows = capsys.readouterr().out.splitlines()[2:]
+    assert rows[0].split()[:3] == [str(ingest.id), "ingest", "tests/test.xlsx"]
+    assert rows[1].split() == [str(ingest.id + 1), "crawl", "pending", "0"]
+
+
+def test_restart_running(runner):
+    """Verify that running jobs can't be restarted"""
+
+    job = runner.submit("ingest", "tests/test.xlsx")
+    with pytest.raises(ValueError):
+        runner.restart(job.id)
+
+
+def test_unknown_kind(runner):
+    """Verify that only known kinds of jobs are accepted"""
+
+    with pytest.raises(ValueError):
+        runner.submit("unknown")
+
+
+def test_schedule(runner):
+    """Verify that scheduled jobs are submitted right away, and only once while running"""
+
+    schedule_id, job = runner.schedule("ingest", 0.1, "tests/test.xlsx")
+    runner.wait(job.id, TIMEOUT)
+
+    # the next round starts shortly after the first job finished
+    while len(runner.jobs()) < 2:
+        time.sleep(0.05)
+    runner.unschedule(schedule_id)
+
+    # rounds were skipped while the first job was running
+    jobs = runner.jobs()
+    assert len(jobs) == 2
+    assert runner.wait(jobs[1].id, TIMEOUT).status == "succeeded"
+    assert jobs[0].status == "succeeded"
@@ -0,0 +1,346 @@
+"""Unit tests for the incremental crawling of chalmerstenta.se by
+ConditionalRequestMiddleware, simulating consecutive crawls without any network access,
+and functional tests crawling a local server shaped like chalmerstenta.se repeatedly."""
+
+# pylint: disable=redefined-outer-name
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import pytest
+from scrapy.exceptions import IgnoreRequest
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+
+from tentahjalpen.jobs import JobRunner
+from tentahjalpen.scraper.middlewares import ConditionalRequestMiddleware
+from tentahjalpen.scraper.pdf_spider import PdfSpider
+
+
+START_URL = "https://chalmerstenta.se/?page=listcourse"
+COURSE_URL = "https://chalmerstenta.se/?kurs=EDA321_Digital_Design"
+PDF_URL = "https://chalmerstenta.se/exam.pdf"
+
+
+@pytest.fixture()
+def crawler():
+    """Crawler of PdfSpider, providing the stats collector of the middleware"""
+
+    crawler = get_crawler(PdfSpider)
+    crawler.stats.open_spider(None)
+    return crawler
+
+
+def open_middleware(crawler, spider):
+    """Return middleware which has loaded its state for spider"""
+
+    middleware = ConditionalRequestMiddleware(crawler.stats)
+    middleware.spider_opened(spider)
+    return middleware
+
+
+def fetch(middleware, spider, url, status=200, body=b"", headers=None):
+    """Pass request for url through middleware, and a response with the given status, body
+    and headers. PDFs are requested from the course page.
+
+    :return: the request as sent, and the response, or None if it was dropped
+    """
+    request = Request(url, meta={"page": COURSE_URL} if url == PDF_URL else {})
+    response = Response(url, status=status, body=body, headers=headers or {},
+                        request=request)
+    try:
+        assert middleware.process_request(request, spider) is None
+        return request, middleware.process_response(request, response, spider)
+    except IgnoreRequest:
+        return request, None
+
+
+def first_crawl(crawler, spider):
+    """Crawl the start URL, the course page and its PDF, store the PDF and finish the
+    crawl"""
+
+    spider.load_occasions()
+    middleware = open_middleware(crawler, spider)
+    fetch(middleware, spider, START_URL, body=b"listing", headers={"ETag": '"listing"'})
+    fetch(middleware, spider, COURSE_URL, body=b"course", headers={"ETag": '"course"'})
+    fetch(middleware, spider, PDF_URL, body=b"%PDF")
+    middleware.suggestions_stored([{"url": PDF_URL}], spider)
+    middleware.spider_closed(spider, "finished")
+
+
+def test_recrawl_unchanged(filled_db, crawler):
+    """Verify that re-crawling a site that hasn't changed only downloads the start URL"""
+
+    spider = PdfSpider(db=filled_db)
+    first_crawl(crawler, spider)
+
+    middleware = open_middleware(crawler, spider)
+
+    # the start URL is always fetched
+    request, response = fetch(middleware, spider, START_URL, body=b"listing")
+    assert "If-None-Match" not in request.headers
+    assert response is not None
+
+    # the course page is validated by its ETag
+    request, response = fetch(middleware, spider, COURSE_URL, status=304)
+    assert request.headers["If-None-Match"] == b'"course"'
+    assert response is None
+
+    # the PDF had no validators, so it isn't fetched again at all
+    request, response = fetch(middleware, spider, PDF_URL, body=b"%PDF")
+    assert response is None
+
+    assert crawler.stats.get_value("incremental/not_modified") == 1
+    assert crawler.stats.get_value("incremental/skipped") == 1
+
+
+def test_recrawl_changed(filled_db, crawler):
+    """Verify that pages which have changed are passed on to the spider"""
+
+    spider = PdfSpider(db=filled_db)
+    first_crawl(crawler, spider)
+
+    middleware = open_middleware(crawler, spider)
+    _, response = fetch(middleware, spider, COURSE_URL, body=b"new course",
+                        headers={"ETag": '"new"'})
+    assert response is not None
+    middleware.spider_closed(spider, "finished")
+
+    assert filled_db.query("SELECT etag FROM crawled_urls WHERE url=%s",
+                           (COURSE_URL,))[0]["etag"] == '"new"'
+
+
+def test_recrawl_course_changed(filled_db, crawler):
+    """Verify that a course page is fetched again once an exam occasion of its course has
+    been added, but not when only the grades of another course have changed"""
+
+    spider = PdfSpider(db=filled_db)
+    first_crawl(crawler, spider)
+
+    filled_db.query("UPDATE results SET fives=fives+1 WHERE code=%s", ("EDA322",))
+    spider.load_occasions()
+    middleware = open_middleware(crawler, spider)
+    request, _ = fetch(middleware, spider, COURSE_URL, status=304)
+    assert request.headers["If-None-Match"] == b'"course"'
+
+    filled_db.query("INSERT INTO results (taken, code, name) VALUES (%s, %s, %s)",
+                    ("2013-01-14", "EDA321", "Digital Design"))
+    spider.load_occasions()
+    middleware = open_middleware(crawler, spider)
+    request, response = fetch(middleware, spider, COURSE_URL, body=b"course")
+    assert "If-None-Match" not in request.headers
+    assert response is not None
+
+
+def test_recrawl_forced(filled_db, crawler):
+    """Verify that non incremental spiders ignore the recorded state"""
+
+    spider = PdfSpider(db=filled_db)
+    first_crawl(crawler, spider)
+
+    spider = PdfSpider(db=filled_db, incremental=False)
+    spider.load_occasions()
+    middleware = open_middleware(crawler, spider)
+    _, response = fetch(middleware, spider, PDF_URL, body=b"%PDF")
+    assert response is not None
+
+
+def test_unfinished_crawl(filled_db, crawler):
+    """Verify that nothing is recorded by crawls that didn't finish"""
+
+    spider = PdfSpider(db=filled_db)
+    spider.load_occasions()
+    middleware = open_middleware(crawler, spider)
+    fetch(middleware, spider, COURSE_URL, body=b"course")
+    middleware.spider_closed(spider, "shutdown")
+
+    assert filled_db.query("SELECT * FROM crawled_urls") == []
+
+
+def test_unstored_pdf(filled_db, crawler):
+    """Verify that neither a PDF whose suggestion wasn't stored, nor the course page it was
+    requested from, are recorded"""
+
+    spider = PdfSpider(db=filled_db)
+    spider.load_occasions()
+    middleware = open_middleware(crawler, spider)
+    fetch(middleware, spider, COURSE_URL, body=b"course", headers={"ETag": '"course"'})
+    fetch(middleware, spider, PDF_URL, body=b"%PDF")
+    middleware.spider_closed(spider, "finished")
+
+    assert filled_db.query("SELECT * FROM crawled_urls") == []
+
+
+# seconds to wait for a crawl, whose worker has to start a new interpreter
+TIMEOUT = 60
+
+COURSE_PAGE = """
+<html><body><table><tr><td><table>
+<tr><td>EDA321 Digital Design</td></tr>
+<tr><td>Datum</td><td>Typ</td><td>Tenta</td><td>Lösning</td></tr>
+<tr><td>2012-12-26</td><td>Tenta</td><td><a href="/exam.pdf">PDF</a></td><td></td></tr>
+</table></td></tr></table></body></html>
+"""
+
+
+class Site(BaseHTTPRequestHandler):
+    """Request handler serving the course list, the course page of EDA321 and the PDF of
+    its exam, answering conditional requests if the server has validators enabled. Every
+    request is logged on the server as (path, If-None-Match header, status, body size)."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ Serve the requested page """
+
+        url = urlsplit(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/exam.pdf":
+            self.respond(b"%PDF-1.4 exam", "application/pdf", '"exam"', self.server.pdf_status)
+        elif query.get("kurs") == ["EDA321_Digital_Design"]:
+            self.respond(COURSE_PAGE.encode("utf-8"), "text/html; charset=utf-8", '"course"')
+        elif query.get("page") == ["listcourse"]:
+            self.respond(b'<html><body><a href="/?kurs=EDA321_Digital_Design">EDA321</a>'
+                         b'</body></html>', "text/html; charset=utf-8")
+        else:
+            self.respond(b"", "text/html", status=404)
+
+    def respond(self, body, content_type, etag=None, status=200):
+        """ Send body, or 304 if the client has the version with the given ETag """
+
+        if not self.server.validators:
+            etag = None
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            status, body = 304, b""
+
+        self.server.requests.append((self.path, self.headers.get("If-None-Match"), status,
+                                     len(body)))
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """ Keep the requests out of the output of the tests """
+
+
+@pytest.fixture()
+def site():
+    """Server of the local site, with validators and a working PDF"""
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Site)
+    server.daemon_threads = True
+    server.validators = True
+    server.pdf_status = 200
+    server.requests = []
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture()
+def site_db(inited_db):
+    """Database holding the exam of EDA321 on the local site, without any PDFs"""
+
+    inited_db.query("INSERT INTO results (taken, code, name) VALUES (%s, %s, %s)",
+                    ("2012-12-26", "EDA321", "Digital Design"))
+    return inited_db
+
+
+@pytest.fixture()
+def crawl(site_db, site, tmpdir):
+    """Function crawling the local site in a worker process, returning the requests the
+    site received"""
+
+    runner = JobRunner({"test_connection_url": site_db.connection.dsn},
+                       log_dir=str(tmpdir), poll_interval=0.1)
+    start_url = "http://127.0.0.1:{}/?page=listcourse".format(site.server_address[1])
+
+    def crawl(force=False):
+        del site.requests[:]
+        job = runner.wait(runner.submit("crawl", force=force, start_urls=[start_url],
+                                        allowed_domains=["127.0.0.1"]).id, TIMEOUT)
+        assert job.status == "succeeded"
+        return {path: (etag, status, size) for path, etag, status, size in site.requests}
+
+    return crawl
+
+
+def suggested(test_db):
+    """Return the number of times the exam of EDA321 has been suggested"""
+
+    entries = test_db.query("SELECT submissions FROM exam_suggestions")
+    return entries[0]["submissions"] if entries else 0
+
+
+def test_crawl_unchanged(site_db, crawl):
+    """Verify that re-crawling a site that hasn't changed downloads nothing but the start
+    URL"""
+
+    requests = crawl()
+    assert requests["/exam.pdf"] == (None, 200, 13)
+    assert suggested(site_db) == 1
+
+    requests = crawl()
+    assert requests["/?kurs=EDA321_Digital_Design"] == ('"course"', 304, 0)
+    assert "/exam.pdf" not in requests
+    assert sum(size for path, (_, _, size) in requests.items()
+               if path != "/?page=listcourse") == 0
+    assert suggested(site_db) == 1
+
+
+def test_crawl_new_occasion(site_db, crawl):
+    """Verify that the course page is fetched again once an exam occasion of the course
+    has been added, while the PDF that was already suggested isn't"""
+
+    crawl()
+    site_db.query("INSERT INTO results (taken, code, name) VALUES (%s, %s, %s)",
+                  ("2013-01-14", "EDA321", "Digital Design"))
+
+    requests = crawl()
+    assert requests["/?kurs=EDA321_Digital_Design"][:2] == (None, 200)
+    assert requests["/exam.pdf"] == ('"exam"', 304, 0)
+    assert suggested(site_db) == 1
+
+
+def test_crawl_without_validators(site, site_db, crawl):
+    """Verify that a PDF that was served without validators isn't downloaded again"""
+
+    site.validators = False
+    crawl()
+
+    requests = crawl()
+    assert "/exam.pdf" not in requests
+    assert suggested(site_db) == 1
+
+
+def test_crawl_failed_pdf(site, site_db, crawl):
+    """Verify that the course page of a PDF that couldn't be downloaded isn't recorded, so
+    that the PDF is requested again by the next crawl"""
+
+    site.pdf_status = 500
+    crawl()
+    assert suggested(site_db) == 0
+    assert site_db.query("SELECT * FROM crawled_urls") == []
+
+    site.pdf_status = 200
+    requests = crawl()
+    assert requests["/?kurs=EDA321_Digital_Design"][:2] == (None, 200)
+    assert requests["/exam.pdf"] == (None, 200, 13)
+    assert suggested(site_db) == 1
+
+
+def test_crawl_forced(site_db, crawl):
+    """Verify that forced crawls download everything again"""
+
+    crawl()
+
+    requests = crawl(force=True)
+    assert requests["/exam.pdf"] == (None, 200, 13)
+    assert suggested(site_db) == 2
@@ -0,0 +1,177 @@
+"""Unit tests for the versioned schema migrations."""
+
+import random
+from datetime import date, timedelta
+import pytest
+
+from tentahjalpen.blob_store import PostgresBlobStore, blob_hash
+from tentahjalpen.migrations import migrate, schema_version, load_migrations
+from tentahjalpen.stats import refresh_course_stats
+
+
+def test_schema_version_empty(empty_db):
+    """Verify that a database without any migrations applied is at version 0"""
+
+    assert schema_version(empty_db) == 0
+
+
+def test_migrate(empty_db):
+    """Verify that migrating an empty database applies every migration"""
+
+    test_db = empty_db
+
+    applied = migrate(test_db)
+    assert applied == [version for version, _ in load_migrations()]
+    assert schema_version(test_db) == applied[-1]
+
+    # the tables are usable afterwards
+    assert test_db.query("SELECT * FROM results") == []
+
+
+def test_migrate_up_to_date(inited_db):
+    """Verify that migrating an up to date database does nothing and keeps its data"""
+
+    test_db = inited_db
+    test_db.query("INSERT INTO results (code) VALUES (%s)", ("EDA322",))
+
+    assert migrate(test_db) == []
+    assert len(test_db.query("SELECT * FROM results")) == 1
+
+
+def test_migrate_pending(inited_db, tmpdir):
+    """Verify that only migrations newer than the current version are applied"""
+
+    test_db = inited_db
+    current = schema_version(test_db)
+
+    tmpdir.join("0001_initial.sql").write("CREATE TABLE should_not_exist (id INTEGER);")
+    tmpdir.join("{:04d}_extra.sql".format(current + 1)).write(
+        "CREATE TABLE extra (id INTEGER);")
+
+    assert migrate(test_db, str(tmpdir)) == [current + 1]
+    assert schema_version(test_db) == current + 1
+    assert test_db.query("SELECT * FROM extra") == []
+    assert not test_db.query(
+        "SELECT 1 FROM information_schema.tables WHERE table_name=%s", ("should_not_exist",))
+
+
+def test_migrate_failure(inited_db, tmpdir):
+    """Verify that a failing migration leaves the database untouched"""
+
+    test_db = inited_db
+    current = schema_version(test_db)
+
+    tmpdir.join("{:04d}_extra.sql".format(current + 1)).write(
+        "CREATE TABLE extra (id INTEGER);")
+    tmpdir.join("{:04d}_broken.sql".format(current + 2)).write("NOT SQL;")
+
+    with pytest.raises(Exception):
+        migrate(test_db, str(tmpdir))
+
+    assert schema_version(test_db) == current
+    assert not test_db.query(
+        "SELECT 1 FROM information_schema.tables WHERE table_name=%s", ("extra",))
+
+
+def test_migrate_legacy(empty_db):
+    """Verify that a database created with the schema from before the migrations, which
+    kept the PDFs in the results and exam_suggestions tables, is converted to the blob
+    store"""
+
+    test_db = empty_db
+    test_db.query("CREATE TABLE results (id SERIAL PRIMARY KEY, taken DATE, code VARCHAR(6), "
+                  "name VARCHAR, failures INTEGER, threes INTEGER, fours INTEGER, "
+                  "fives INTEGER, exam BYTEA, solution BYTEA)")
+    test_db.query("CREATE TABLE exam_suggestions (id SERIAL PRIMARY KEY, taken DATE, "
+                  "code VARCHAR(6), exam BYTEA, solution BYTEA)")
+
+    pdf = open("tests/test.pdf", "rb").read()
+    test_db.query("INSERT INTO results (taken, code, name, exam) VALUES (%s, %s, %s, %s)",
+                  ("1998-12-26", "EDA322", "Digital Konstruktion", pdf))
+    test_db.query("INSERT INTO exam_suggestions (taken, code, solution) VALUES (%s, %s, %s)",
+                  ("1998-12-26", "EDA322", pdf))
+
+    migrate(test_db)
+
+    digest = blob_hash(pdf)
+    result = test_db.query("SELECT * FROM results")[0]
+    assert result["exam_hash"] == digest
+    assert result["solution_hash"] is None
+    assert "exam" not in result
+
+    suggestion = test_db.query("SELECT * FROM exam_suggestions")[0]
+    assert suggestion["solution_hash"] == digest
+    assert PostgresBlobStore(test_db).get(digest) == pdf
+
+
+def create_legacy_results(test_db, rows):
+    """Create the results table as it was before course_stats was added, holding rows of
+    (taken, code, failures, threes, fours, fives)"""
+
+    test_db.query("CREATE TABLE results (id SERIAL PRIMARY KEY, taken DATE, code VARCHAR(6), "
+                  "name VARCHAR, failures INTEGER, threes INTEGER, fours INTEGER, "
+                  "fives INTEGER, exam_hash CHAR(64), solution_hash CHAR(64))")
+    for row in rows:
+        test_db.query("INSERT INTO results (taken, code, failures, threes, fours, fives) "
+                      "VALUES (%s, %s, %s, %s, %s, %s)", row)
+
+
+def migrated_course_stats(test_db):
+    """Migrate the database, returning the statistics computed by the migration and those
+    computed by refresh_course_stats afterwards"""
+
+    query = "SELECT code, adjusted_fail_rate, sittings FROM course_stats ORDER BY code"
+
+    migrate(test_db)
+    migrated = test_db.query(query)
+
+    with test_db.transaction() as cursor:
+        refresh_course_stats(cursor)
+
+    return migrated, test_db.query(query)
+
+
+def test_migrate_course_stats(empty_db):
+    """Verify that the statistics of the results present before course_stats was added are
+    computed by the migration, the same way as by refresh_course_stats"""
+
+    create_legacy_results(empty_db, [
+        ("2019-03-08", "EDA322", 20, 10, 5, 5), ("2019-01-09", "EDA322", 15, 5, 0, 0),
+        ("2018-03-14", "EDA322", 10, 20, 5, 5), ("2017-03-01", "EDA322", 0, 30, 5, 5),
+        ("2015-03-01", "EDA322", 40, 0, 0, 0), ("2019-01-09", "EDA321", 5, 0, 0, 0),
+        ("2019-01-14", "TDA555", 7, None, 13, 0)])
+
+    migrated, refreshed = migrated_course_stats(empty_db)
+
+    assert migrated == refreshed
+    assert [row["sittings"] for row in migrated] == [0, 3, 1]
+
+
+def test_migrate_course_stats_random(empty_db):
+    """Verify that the migration and refresh_course_stats agree on many random courses,
+    including sittings on the edge of the window, tied participants, missing grades and
+    sittings without any participants"""
+
+    generator = random.Random(5541)
+    rows = []
+    for number in range(300):
+        latest = date(2019, 1, 1) + timedelta(days=generator.randrange(730))
+        edge = latest.replace(year=latest.year - 3, day=min(latest.day, 28))
+        days = {latest, edge} | {latest - timedelta(days=generator.randrange(2500))
+                                 for _ in range(generator.randrange(12))}
+        for taken in sorted(days):
+            grades = [generator.choice([None, 0, 5, 10, generator.randrange(60)])
+                      for _ in range(4)]
+            rows.append((taken, "TST{:03}".format(number), *grades))
+
+    create_legacy_results(empty_db, rows)
+    migrated, refreshed = migrated_course_stats(empty_db)
+
+    assert [row["code"] for row in migrated] == [row["code"] for row in refreshed]
+    assert sum(row["adjusted_fail_rate"] is not None for row in migrated) > 200
+    assert [row["sittings"] for row in migrated] == [row["sittings"] for row in refreshed]
+    for before, after in zip(migrated, refreshed):
+        if before["adjusted_fail_rate"] is None:
+            assert after["adjusted_fail_rate"] is None
+        else:
+            assert before["adjusted_fail_rate"] == pytest.approx(after["adjusted_fail_rate"])
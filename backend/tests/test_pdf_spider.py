@@ -0,0 +1,62 @@
+"""Unit tests for the parsing of course pages by PdfSpider, using a page shaped like the
+course pages of chalmerstenta.se."""
+
+from scrapy.http import HtmlResponse
+
+from tentahjalpen.scraper.pdf_spider import PdfSpider
+
+
+COURSE_PAGE = """
+<html><body><table><tr><td><table>
+<tr><td>EDA321 Digital Design</td></tr>
+<tr><td>Datum</td><td>Typ</td><td>Tenta</td><td>Lösning</td></tr>
+<tr><td>2012-12-26</td><td>Tenta</td><td><a href="/exam.pdf">PDF</a></td>
+    <td><a href="/solution.pdf">PDF</a></td></tr>
+<tr><td>2013-01-14</td><td>Tenta</td><td><a href="/other.pdf">PDF</a></td><td></td></tr>
+</table></td></tr></table></body></html>
+"""
+
+
+def course_response(url):
+    """Response for the course page served from the given URL"""
+
+    return HtmlResponse(url=url, body=COURSE_PAGE.encode("utf-8"), encoding="utf-8")
+
+
+def test_parse_course(filled_db):
+    """Verify that only the PDFs missing from the database are requested, without
+    querying the database while parsing"""
+
+    spider = PdfSpider(db=filled_db)
+    spider.load_occasions()
+    spider.db = None
+
+    requests = list(spider.parse_course(
+        course_response("https://chalmerstenta.se/?kurs=EDA321_Digital_Design")))
+
+    # the solution of the exam is already present, and the other date isn't known
+    assert [request.url for request in requests] == ["https://chalmerstenta.se/exam.pdf"]
+    assert requests[0].meta == {"date": "2012-12-26", "code": "EDA321", "type": "exam",
+                                "page": "https://chalmerstenta.se/?kurs=EDA321_Digital_Design"}
+
+
+def test_parse_course_by_name(filled_db):
+    """Verify that courses are matched by name when the URL has no course code"""
+
+    spider = PdfSpider(db=filled_db)
+    spider.load_occasions()
+
+    requests = list(spider.parse_course(
+        course_response("https://chalmerstenta.se/?kurs=Digital_Design")))
+
+    assert [request.meta["code"] for request in requests] == ["EDA321"]
+
+
+def test_parse_course_unknown(filled_db):
+    """Verify that nothing is requested for courses that aren't in the database"""
+
+    spider = PdfSpider(db=filled_db)
+    spider.load_occasions()
+
+    assert list(spider.parse_course(
+        course_response("https://chalmerstenta.se/?kurs=MEM123_Unknown"))) == []
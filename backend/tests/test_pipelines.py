@@ -0,0 +1,56 @@
+"""Unit tests for the pipelines persisting the output of PdfSpider."""
+
+import pytest
+import psycopg2
+
+from tentahjalpen.blob_store import PostgresBlobStore, blob_hash
+from tentahjalpen.pool import ConnectionPool
+from tentahjalpen.scraper.items import SuggestionItem
+from tentahjalpen.scraper.pipelines import SuggestionPipeline
+
+
+def test_write_batch(filled_db):
+    """Verify that a batch is stored and suggested in one go, collapsing identical PDFs
+    and skipping the ones already approved"""
+
+    file_bytes = open("tests/test.pdf", "rb").read()
+
+    pipeline = SuggestionPipeline()
+    pipeline.blob_store = PostgresBlobStore(filled_db)
+    pipeline.connections = ConnectionPool(0, 1, filled_db.connect)
+
+    batch = [
+        SuggestionItem(code="EDA321", taken="2012-12-26", kind="exam", body=b"%PDF-1.4 new"),
+        SuggestionItem(code="EDA321", taken="2012-12-26", kind="exam", body=b"%PDF-1.4 new"),
+        SuggestionItem(code="EDA322", taken="1998-12-26", kind="exam", body=file_bytes),
+    ]
+
+    assert pipeline.write_batch(batch) == [1, 2, None]
+    pipeline.connections.closeall()
+
+    entries = filled_db.query("SELECT * FROM exam_suggestions")
+    assert len(entries) == 1
+    assert entries[0]["submissions"] == 2
+    assert pipeline.blob_store.get(entries[0]["exam_hash"]) == b"%PDF-1.4 new"
+
+
+def test_write_batch_failed(filled_db):
+    """Verify that the PDFs of a batch that fails to be written aren't left in the blobs
+    table without any suggestion referencing them"""
+
+    pipeline = SuggestionPipeline()
+    pipeline.blob_store = PostgresBlobStore(filled_db)
+    pipeline.connections = ConnectionPool(0, 1, filled_db.connect)
+
+    # the exam date is invalid, which fails the batch after the first PDF has been stored
+    batch = [
+        SuggestionItem(code="EDA321", taken="2012-12-26", kind="exam", body=b"%PDF-1.4 new"),
+        SuggestionItem(code="EDA321", taken="2012-13-26", kind="exam", body=b"%PDF-1.4 bad"),
+    ]
+
+    with pytest.raises(psycopg2.DataError):
+        pipeline.write_batch(batch)
+    pipeline.connections.closeall()
+
+    assert filled_db.query("SELECT * FROM exam_suggestions") == []
+    assert not pipeline.blob_store.exists(blob_hash(b"%PDF-1.4 new"))
@@ -0,0 +1,170 @@
+"""Unit tests for the connection pool and the pooled mode of DBInterface."""
+
+# pylint: disable=redefined-outer-name
+import threading
+import pytest
+import psycopg2
+from flask import Flask
+
+from tentahjalpen.db_interface import DBInterface
+from tentahjalpen.pool import ConnectionPool, PoolTimeout, PoolClosed
+
+
+@pytest.fixture()
+def pool(postgresql):
+    """Pool of at most two connections to the testing database"""
+
+    pool = ConnectionPool(1, 2, lambda: psycopg2.connect(postgresql.dsn), timeout=0.5)
+    yield pool
+    pool.closeall()
+
+
+@pytest.fixture()
+def pooled_db(postgresql):
+    """DBInterface instance in pooled mode connected to the testing database"""
+
+    return DBInterface(test_connection_url=postgresql.dsn, min_connections=1,
+                       max_connections=2, pool_timeout=0.5)
+
+
+def test_getconn_autocommit(pool):
+    """Verify that checked out connections are in autocommit mode"""
+
+    connection = pool.getconn()
+    assert connection.autocommit
+    assert pool.stats()["in_use"] == 1
+
+    pool.putconn(connection)
+    assert pool.stats()["in_use"] == 0
+    assert pool.stats()["idle"] == 1
+
+
+def test_getconn_timeout(pool):
+    """Verify that checking out from an exhausted pool times out"""
+
+    first = pool.getconn()
+    second = pool.getconn()
+
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+
+    assert pool.stats()["timeouts"] == 1
+    pool.putconn(first)
+    pool.putconn(second)
+
+
+def test_getconn_waits(pool):
+    """Verify that a checkout waits for a connection to be returned"""
+
+    first = pool.getconn()
+    second = pool.getconn()
+
+    timer = threading.Timer(0.1, pool.putconn, (first,))
+    timer.start()
+
+    assert pool.getconn() is first
+    assert pool.stats()["max_wait_time"] > 0
+    timer.join()
+    pool.putconn(second)
+
+
+def test_reconnect(pool):
+    """Verify that a broken connection is replaced on checkout"""
+
+    connection = pool.getconn()
+    pool.putconn(connection)
+    connection.close()
+
+    replacement = pool.getconn()
+    assert replacement is not connection
+    assert not replacement.closed
+    assert pool.stats()["reconnects"] == 1
+
+
+def test_putconn_rollback(pool):
+    """Verify that an open transaction is rolled back when the connection is returned"""
+
+    connection = pool.getconn()
+    connection.autocommit = False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1")
+    pool.putconn(connection)
+
+    connection = pool.getconn()
+    assert connection.autocommit
+    assert connection.get_transaction_status() == \
+        psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+def test_closeall(pool):
+    """Verify that connections in use are closed once returned to a closed pool, and that
+    no more connections are handed out"""
+
+    connection = pool.getconn()
+    pool.closeall()
+
+    pool.putconn(connection)
+    assert connection.closed
+    assert pool.stats()["size"] == 0
+
+    with pytest.raises(PoolClosed):
+        pool.getconn()
+
+
+def test_pooled_query(pooled_db):
+    """Verify that queries outside of an app context return their connection"""
+
+    assert pooled_db.query("SELECT 1 AS one")[0]["one"] == 1
+    assert pooled_db.pool_stats()["in_use"] == 0
+
+
+def test_pooled_app_context(pooled_db):
+    """Verify that a single connection is used for an app context and released after"""
+
+    app = Flask(__name__)
+
+    with app.app_context():
+        pid = pooled_db.query("SELECT pg_backend_pid() AS pid")[0]["pid"]
+        assert pooled_db.query("SELECT pg_backend_pid() AS pid")[0]["pid"] == pid
+        assert pooled_db.pool_stats()["in_use"] == 1
+
+        pooled_db.release()
+        assert pooled_db.pool_stats()["in_use"] == 0
+
+
+def terminate(postgresql, pooled_db):
+    """Have the server terminate the idle connection of pooled_db, as it does when it
+    restarts or drops idle connections"""
+
+    pid = pooled_db.query("SELECT pg_backend_pid() AS pid")[0]["pid"]
+    with psycopg2.connect(postgresql.dsn) as connection:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_terminate_backend(%s)", (pid,))
+
+    return pid
+
+
+def test_pooled_query_terminated(postgresql, pooled_db):
+    """Verify that a query recovers from a connection that the server terminated while it
+    was idle, which is handed out without a health check since it was idle only briefly"""
+
+    pid = terminate(postgresql, pooled_db)
+
+    assert pooled_db.query("SELECT pg_backend_pid() AS pid")[0]["pid"] != pid
+    assert pooled_db.pool_stats()["size"] == 1
+
+
+def test_pooled_app_context_terminated(postgresql, pooled_db):
+    """Verify that a query within an app context recovers from a terminated connection,
+    and keeps using its replacement"""
+
+    app = Flask(__name__)
+    pid = terminate(postgresql, pooled_db)
+
+    with app.app_context():
+        replaced = pooled_db.query("SELECT pg_backend_pid() AS pid")[0]["pid"]
+        assert replaced != pid
+        assert pooled_db.query("SELECT pg_backend_pid() AS pid")[0]["pid"] == replaced
+
+        pooled_db.release()
+        assert pooled_db.pool_stats()["size"] == 1
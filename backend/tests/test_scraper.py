@@ -2,7 +2,10 @@
 comprised of calls to these more basic functions. Furthermore I have decided to omit scrape_pdfs
 as mocking chalmerstenta.se is low in the list of priorities as of current."""
 
-from tentahjalpen.scraper.scraper import update_db, load_dataframe
+from tentahjalpen.scraper.scraper import update_db, upsert_results, load_dataframe
+from tentahjalpen.scraper.scraper import aggregate_results, aggregate_results_iterrows
+from tentahjalpen.scraper.scraper import aggregate_batches, read_workbook, WORKBOOK_COLUMNS
+from tentahjalpen.scraper.scraper import ingest_workbook
 
 
 def test_load_dataframe():
@@ -20,6 +23,53 @@ def test_load_dataframe_no_description():
     assert "Beskrivning" not in dataframe.keys()
 
 
+def test_aggregate_results():
+    """Verify that the vectorized aggregation gives the same output as iterating the rows"""
+
+    dataframe = load_dataframe("tests/test.xlsx")
+    entries = aggregate_results(dataframe)
+
+    assert entries
+    assert entries == aggregate_results_iterrows(dataframe)
+
+
+def test_aggregate_results_string_dates():
+    """Verify that dates given as strings are parsed and that later sheets override the
+    amounts of earlier ones, the same way as when iterating the rows"""
+
+    dataframe = load_dataframe("tests/test.xlsx")
+    sheet = dataframe["läsår_2017_2018"].copy()
+    sheet["Provdatum"] = sheet["Provdatum"].dt.strftime("%m/%d/%Y")
+    sheet["Antal"] = sheet["Antal"] + 1
+    dataframe["strings"] = sheet
+
+    assert aggregate_results(dataframe) == aggregate_results_iterrows(dataframe)
+
+
+def test_read_workbook():
+    """Verify that the workbook is read in batches of the needed columns, without the
+    'Beskrivning' sheet"""
+
+    batches = list(read_workbook("tests/test.xlsx", batch_size=1000))
+
+    assert len(batches) > 1
+    for name, batch in batches:
+        assert name != "Beskrivning"
+        assert list(batch.columns) == WORKBOOK_COLUMNS
+        assert len(batch) <= 1000
+
+        # the cells store the amounts as floats
+        assert all(isinstance(amount, int) for amount in batch["Antal"].tolist())
+
+
+def test_read_workbook_aggregate():
+    """Verify that aggregating the streamed batches gives the same output as aggregating
+    the whole workbook at once"""
+
+    entries = aggregate_batches(read_workbook("tests/test.xlsx", batch_size=1000))
+    assert entries == aggregate_results(load_dataframe("tests/test.xlsx"))
+
+
 def test_update_db(inited_db):
     """Verify that an entry is added for the arbitrary course EDA322.
         Presupposes that load_dataframe() is working properly"""
@@ -32,3 +82,64 @@ def test_update_db(inited_db):
     update_db(dataframe, test_db)
     entries = test_db.query("SELECT * from results WHERE code=%s", ("EDA322",))
     assert entries
+
+
+def test_update_db_counts(inited_db):
+    """Verify that running the update twice inserts everything once and then leaves it
+    unchanged"""
+
+    test_db = inited_db
+
+    dataframe = load_dataframe("tests/test.xlsx")
+    counts = update_db(dataframe, test_db)
+    total = len(test_db.query("SELECT id FROM results"))
+    assert counts == {"inserted": total, "updated": 0, "unchanged": 0}
+
+    counts = update_db(dataframe, test_db)
+    assert counts == {"inserted": 0, "updated": 0, "unchanged": total}
+
+
+def test_upsert_results(basic_db):
+    """Verify that changed results are updated and that PDFs already attached are kept"""
+
+    test_db = basic_db
+    test_db.query("UPDATE results SET exam_hash=%s WHERE code=%s", ("0" * 64, "EDA322"))
+
+    counts = upsert_results([
+        {"taken": "1998-12-26", "code": "EDA322", "name": "Digital Konstruktion",
+         "failures": 301, "threes": 200, "fours": 100, "fives": 10},
+        {"taken": "2012-12-26", "code": "EDA321", "name": "Digital Design",
+         "failures": 200, "threes": 100, "fours": 10, "fives": 1},
+        {"taken": "2019-01-14", "code": "EDA322", "name": "Digital Konstruktion",
+         "failures": 1, "threes": 2, "fours": 3, "fives": 4},
+    ], test_db)
+    assert counts == {"inserted": 1, "updated": 1, "unchanged": 1}
+
+    entry = test_db.query("SELECT * FROM results WHERE code=%s AND taken=%s",
+                          ("EDA322", "1998-12-26"))[0]
+    assert entry["failures"] == 301
+    assert entry["exam_hash"] == "0" * 64
+
+
+def test_ingest_workbook(inited_db):
+    """Verify that a sheet is only ingested again when it has changed or when forced"""
+
+    test_db = inited_db
+
+    counts = ingest_workbook("tests/test.xlsx", test_db)
+    assert counts["ingested"] == ["läsår_2017_2018"]
+    assert counts["inserted"] > 0
+    assert test_db.query("SELECT * FROM results WHERE code=%s", ("EDA322",))
+
+    counts = ingest_workbook("tests/test.xlsx", test_db)
+    assert counts["ingested"] == []
+    assert counts["skipped"] == ["läsår_2017_2018"]
+
+    # a sheet with a different fingerprint is ingested again
+    test_db.query("UPDATE workbook_sheets SET rows=0")
+    counts = ingest_workbook("tests/test.xlsx", test_db)
+    assert counts["ingested"] == ["läsår_2017_2018"]
+    assert counts["inserted"] == 0
+
+    counts = ingest_workbook("tests/test.xlsx", test_db, force=True)
+    assert counts["ingested"] == ["läsår_2017_2018"]
@@ -0,0 +1,36 @@
+"""Unit tests for the serialization of course responses."""
+
+import json
+from datetime import date
+
+from tentahjalpen.serialization import dumps, format_results
+
+
+def test_dumps_dates():
+    """Verify that dates are serialized as YYYY-MM-DD and text is kept as UTF-8"""
+
+    body = dumps({"taken": date(2014, 3, 12), "name": "Hållfasthetslära"})
+
+    assert json.loads(body.decode("utf-8")) == {"taken": "2014-03-12",
+                                                "name": "Hållfasthetslära"}
+
+
+def test_format_results_urls():
+    """Verify that PDF URLs are only given for the PDFs that are present"""
+
+    entries = [
+        {"code": "EDA322", "name": "Digital konstruktion", "taken": date(1998, 12, 26),
+         "failures": 300, "threes": 200, "fours": 100, "fives": 10,
+         "exam": "a" * 64, "solution": None, "adjusted_fail_rate": 40.0},
+        {"code": "EDA322", "name": "Digital konstruktion", "taken": date(1999, 4, 8),
+         "failures": 30, "threes": 20, "fours": 10, "fives": 1,
+         "exam": None, "solution": "b" * 64, "adjusted_fail_rate": 40.0},
+    ]
+
+    results = format_results(entries, "http://localhost/courses")
+
+    assert results[0]["exam"] == "http://localhost/courses/EDA322/1998-12-26/exam"
+    assert results[0]["solution"] is None
+    assert results[1]["exam"] is None
+    assert results[1]["solution"] == "http://localhost/courses/EDA322/1999-04-08/solution"
+    assert results[1]["taken"] == date(1999, 4, 8)
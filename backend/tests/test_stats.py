@@ -0,0 +1,64 @@
+"""Unit tests for the course statistics."""
+
+from datetime import date
+import pandas as pd
+
+from tentahjalpen.stats import adjusted_fail_rates, refresh_course_stats, RESULT_COLUMNS
+from tentahjalpen.scraper.scraper import upsert_results
+
+
+def sittings(rows):
+    """DataFrame of results from (code, taken, failures, threes, fours, fives) tuples"""
+
+    return pd.DataFrame(rows, columns=RESULT_COLUMNS)
+
+
+def test_adjusted_fail_rate():
+    """Verify that the three largest sittings of the last three years are averaged"""
+
+    stats = adjusted_fail_rates(sittings([
+        ("EDA322", date(2019, 3, 8), 20, 10, 5, 5),   # 50%, 40 participants
+        ("EDA322", date(2019, 1, 9), 15, 5, 0, 0),    # re-exam, only 20 participants
+        ("EDA322", date(2018, 3, 14), 10, 20, 5, 5),  # 25%, 40 participants
+        ("EDA322", date(2017, 3, 1), 0, 30, 5, 5),    # 0%, 40 participants
+        ("EDA322", date(2015, 3, 1), 40, 0, 0, 0),    # older than three years
+    ]))
+
+    assert stats.loc["EDA322", "sittings"] == 3
+    assert stats.loc["EDA322", "adjusted_fail_rate"] == 25
+
+
+def test_adjusted_fail_rate_threshold():
+    """Verify that sittings below the participant threshold are left out"""
+
+    stats = adjusted_fail_rates(sittings([
+        ("EDA322", date(2019, 3, 8), 20, 10, 5, 5),
+        ("EDA322", date(2019, 1, 9), 5, 0, 0, 0),
+        ("EDA321", date(2019, 1, 9), 5, 0, 0, 0),
+    ]))
+
+    assert stats.loc["EDA322", "adjusted_fail_rate"] == 50
+    assert stats.loc["EDA321", "sittings"] == 0
+    assert pd.isnull(stats.loc["EDA321", "adjusted_fail_rate"])
+
+
+def test_refresh_on_upsert(inited_db):
+    """Verify that merging results refreshes the statistics of the changed courses"""
+
+    test_db = inited_db
+    upsert_results([{"taken": "2019-01-14", "code": "EDA322", "name": "Digital Konstruktion",
+                     "failures": 30, "threes": 30, "fours": 30, "fives": 30}], test_db)
+
+    stats = test_db.query("SELECT * FROM course_stats WHERE code=%s", ("EDA322",))[0]
+    assert stats["sittings"] == 1
+    assert stats["adjusted_fail_rate"] == 25
+
+
+def test_refresh_all(basic_db):
+    """Verify that refreshing every course computes statistics for all of them"""
+
+    test_db = basic_db
+    with test_db.transaction() as cursor:
+        assert refresh_course_stats(cursor) == 2
+
+    assert len(test_db.query("SELECT * FROM course_stats")) == 2
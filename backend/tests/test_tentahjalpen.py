@@ -1,7 +1,11 @@
 """Functional tests for all operations of the API"""
 
+import io
+import gzip
 from base64 import b64encode
 from flask import json
+import tentahjalpen
+from tentahjalpen.blob_store import PostgresBlobStore
 
 
 def test_get_courses(client):
@@ -51,6 +55,42 @@ def test_get_exam(client):
     assert resp.data == open("tests/test.pdf", "rb").read()
 
 
+def test_get_exam_range(client):
+    """Verify that a single byte range of an exam is answered with 206 and only that range"""
+
+    file_bytes = open("tests/test.pdf", "rb").read()
+
+    resp = client.get("/courses/EDA322/1998-12-26/exam", headers={"Range": "bytes=4-103"})
+
+    assert resp.status_code == 206
+    assert resp.data == file_bytes[4:104]
+    assert resp.headers["Content-Length"] == "100"
+    assert resp.headers["Content-Range"] == "bytes 4-103/{}".format(len(file_bytes))
+    assert resp.headers["Accept-Ranges"] == "bytes"
+
+
+def test_get_exam_range_not_satisfiable(client):
+    """Verify that we are given a 416 when requesting a range past the end of an exam"""
+
+    size = len(open("tests/test.pdf", "rb").read())
+
+    resp = client.get("/courses/EDA322/1998-12-26/exam",
+                      headers={"Range": "bytes={}-".format(size)})
+
+    assert resp.status_code == 416
+    assert resp.headers["Content-Range"] == "bytes */{}".format(size)
+
+
+def test_get_exam_if_range(client):
+    """Verify that the whole exam is sent when If-Range names another version of it"""
+
+    resp = client.get("/courses/EDA322/1998-12-26/exam",
+                      headers={"Range": "bytes=0-9", "If-Range": '"outdated"'})
+
+    assert resp.status_code == 200
+    assert resp.data == open("tests/test.pdf", "rb").read()
+
+
 def test_get_exam_non_existent(client):
     """Verify that we are given a 404 when accessing non-existent exam"""
 
@@ -88,7 +128,7 @@ def test_put_suggestion(client, filled_db):
     test_db = filled_db
 
     entry = test_db.query("SELECT * FROM results WHERE code=%s", ("EDA321",))[0]
-    assert entry["exam"] is None
+    assert entry["exam_hash"] is None
 
     # get test.pdf file to use for mocking exam suggestions
     file_bytes = open("tests/test.pdf", "rb").read()
@@ -103,7 +143,80 @@ def test_put_suggestion(client, filled_db):
     entry = test_db.query(
         "SELECT * FROM exam_suggestions WHERE code=%s", ("EDA321",))[0]
 
-    assert bytes(entry["exam"]) == file_bytes
+    assert PostgresBlobStore(test_db).get(entry["exam_hash"]) == file_bytes
+
+
+def test_put_suggestion_pdf(client, filled_db):
+    """Verify that an exam suggestion can be uploaded as is with content type
+    application/pdf"""
+
+    file_bytes = open("tests/test.pdf", "rb").read()
+
+    resp = client.put("/courses/EDA321/2012-12-26/exam", data=file_bytes,
+                      content_type="application/pdf")
+    assert resp.status_code == 200
+
+    entry = filled_db.query(
+        "SELECT * FROM exam_suggestions WHERE code=%s", ("EDA321",))[0]
+
+    assert PostgresBlobStore(filled_db).get(entry["exam_hash"]) == file_bytes
+
+
+def test_put_solution_suggestion_multipart(client, filled_db):
+    """Verify that a solution suggestion can be uploaded as a multipart/form-data file"""
+
+    file_bytes = open("tests/test.pdf", "rb").read()
+
+    resp = client.put("/courses/EDA322/1998-12-26/solution",
+                      data={"solution": (io.BytesIO(file_bytes), "solution.pdf")},
+                      content_type="multipart/form-data")
+    assert resp.status_code == 200
+
+    entry = filled_db.query(
+        "SELECT * FROM exam_suggestions WHERE code=%s", ("EDA322",))[0]
+
+    assert PostgresBlobStore(filled_db).get(entry["solution_hash"]) == file_bytes
+
+
+def test_put_suggestion_too_large(filled_db):
+    """Verify that we get a 413 when uploading a PDF larger than the size limit, without
+    anything being stored"""
+
+    app = tentahjalpen.create_app(test_db=filled_db)
+    app.config["MAX_UPLOAD_SIZE"] = 1024
+
+    resp = app.test_client().put("/courses/EDA321/2012-12-26/exam", data=b"%PDF" * 1024,
+                                 content_type="application/pdf")
+    data = json.loads(resp.data)
+
+    assert resp.status_code == 413
+    assert data["error"] == "Upload too large"
+    assert filled_db.query("SELECT * FROM exam_suggestions") == []
+
+
+def test_put_suggestion_unsupported_type(client):
+    """Verify that we get a 415 when uploading a PDF with an unsupported content type"""
+
+    resp = client.put("/courses/EDA321/2012-12-26/exam", data=b"%PDF",
+                      content_type="text/plain")
+
+    assert resp.status_code == 415
+
+
+def test_put_suggestion_resubmitted(client, filled_db):
+    """Verify that submitting the same exam suggestion twice keeps a single suggestion"""
+
+    file_bytes = open("tests/test.pdf", "rb").read()
+
+    for _ in range(2):
+        resp = client.put("/courses/EDA321/2012-12-26/exam", data=file_bytes,
+                          content_type="application/pdf")
+        assert resp.status_code == 200
+
+    entries = filled_db.query("SELECT * FROM exam_suggestions WHERE code=%s", ("EDA321",))
+
+    assert len(entries) == 1
+    assert entries[0]["submissions"] == 2
 
 
 def test_put_suggestion_non_existent(client):
@@ -146,7 +259,7 @@ def test_put_solution_suggestion(client, filled_db):
     test_db = filled_db
 
     entry = test_db.query("SELECT * FROM results WHERE code=%s", ("EDA322",))[0]
-    assert entry["solution"] is None
+    assert entry["solution_hash"] is None
 
     # get test.pdf file to use for mocking exam solution
     file_bytes = open("tests/test.pdf", "rb").read()
@@ -161,7 +274,7 @@ def test_put_solution_suggestion(client, filled_db):
     entry = test_db.query(
         "SELECT * FROM exam_suggestions WHERE code=%s", ("EDA322",))[0]
 
-    assert bytes(entry["solution"]) == file_bytes
+    assert PostgresBlobStore(test_db).get(entry["solution_hash"]) == file_bytes
 
 
 def test_put_solution_suggestion_non_existent(client):
@@ -196,3 +309,171 @@ def test_put_solution_suggestion_conflict(client):
     data = json.loads(resp.data)
 
     assert data["error"] == "Resource already present"
+
+
+def test_get_course_etag(client):
+    """Verify that a course is answered with 304 when the client has the current version"""
+
+    resp = client.get("/courses/EDA322")
+    assert resp.status_code == 200
+    assert resp.headers["ETag"]
+    assert resp.headers["Last-Modified"]
+
+    resp = client.get("/courses/EDA322", headers={"If-None-Match": resp.headers["ETag"]})
+    assert resp.status_code == 304
+    assert not resp.data
+
+    resp = client.get("/courses/EDA322", headers={"If-None-Match": '"0"'})
+    assert resp.status_code == 200
+
+
+def test_get_course_etag_missing(client):
+    """Verify that a missing course is answered with 404 without any validators, even
+    when the client has the current version of the course data"""
+
+    etag = client.get("/courses/EDA322").headers["ETag"]
+
+    resp = client.get("/courses/MEM420", headers={"If-None-Match": etag})
+    assert resp.status_code == 404
+    assert "ETag" not in resp.headers
+    assert "Last-Modified" not in resp.headers
+
+
+def test_get_course_etag_cached(client, monkeypatch):
+    """Verify that a course the client has the current version of is answered with 304
+    without building the response"""
+
+    etag = client.get("/courses/EDA322").headers["ETag"]
+
+    def format_results(*_):
+        raise AssertionError("response built")
+
+    monkeypatch.setattr(tentahjalpen.serialization, "format_results", format_results)
+    resp = client.get("/courses/EDA322", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+    assert resp.headers["ETag"] == etag
+
+    resp = client.get("/courses/batch?codes=EDA322,EDA321", headers={"If-None-Match": etag})
+    assert resp.status_code == 304
+
+
+def test_get_course_batch_etag_missing(client):
+    """Verify that a batch with a missing course is answered with 404, and one with too
+    many courses with 400, even when the client has the current version"""
+
+    etag = client.get("/courses/EDA322").headers["ETag"]
+
+    resp = client.get("/courses/batch?codes=EDA322,MEM420", headers={"If-None-Match": etag})
+    assert resp.status_code == 404
+    assert "ETag" not in resp.headers
+
+    codes = ",".join("EDA{}".format(number) for number in range(100, 200))
+    resp = client.get("/courses/batch?codes=" + codes, headers={"If-None-Match": etag})
+    assert resp.status_code == 400
+
+
+def test_get_courses_last_modified(client):
+    """Verify that the course list is answered with 304 when it hasn't been modified since
+    the given date"""
+
+    resp = client.get("/courses")
+    last_modified = resp.headers["Last-Modified"]
+
+    resp = client.get("/courses", headers={"If-Modified-Since": last_modified})
+    assert resp.status_code == 304
+    assert resp.headers["ETag"]
+
+
+def test_get_course_batch(client):
+    """Verify that several courses are returned grouped by code, shaped as when requested
+    one at a time"""
+
+    resp = client.get("/courses/batch?codes=EDA322,EDA321")
+    data = json.loads(resp.data)
+
+    assert sorted(data) == ["EDA321", "EDA322"]
+    assert data["EDA322"] == json.loads(client.get("/courses/EDA322").data)
+    assert data["EDA321"] == json.loads(client.get("/courses/EDA321").data)
+
+
+def test_get_course_batch_non_existent(client):
+    """Verify that the server responds with 404 when any of the courses doesn't exist"""
+
+    resp = client.get("/courses/batch?codes=EDA322,MEM123")
+    data = json.loads(resp.data)
+
+    assert resp.status_code == 404
+    assert data["error"] == "Not found"
+
+
+def test_get_course_batch_no_codes(client):
+    """Verify that the server responds with 400 when no course codes are given"""
+
+    resp = client.get("/courses/batch")
+    data = json.loads(resp.data)
+
+    assert resp.status_code == 400
+    assert data["error"] == "Bad request"
+
+
+def test_get_courses_adjusted_fail_rate(client):
+    """Verify that the course list carries the adjusted fail rate of every course"""
+
+    resp = client.get("/courses")
+    data = json.loads(resp.data)
+
+    assert all("adjusted_fail_rate" in course for course in data)
+
+
+def test_get_course_adjusted_fail_rate(client):
+    """Verify that the results of a course carry its adjusted fail rate, as given by the
+    course list"""
+
+    courses = {course["code"]: course for course in json.loads(client.get("/courses").data)}
+    data = json.loads(client.get("/courses/EDA322").data)
+
+    assert data[0]["adjusted_fail_rate"] == courses["EDA322"]["adjusted_fail_rate"]
+
+
+def test_get_courses_catalog(client):
+    """Verify that the course list summarizes the results of every course"""
+
+    resp = client.get("/courses")
+    data = json.loads(resp.data)[1]
+
+    assert data["code"] == "EDA322"
+    assert data["name"] == "Digital Konstruktion"
+    assert data["sittings"] == 1
+    assert data["first_taken"] == "1998-12-26"
+    assert data["last_taken"] == "1998-12-26"
+    assert data["exams"] == 1
+    assert data["solutions"] == 0
+
+
+def test_get_course_gzip(filled_db):
+    """Verify that a course is sent compressed to clients accepting gzip, with an ETag
+    of its own which still gives a 304"""
+
+    app = tentahjalpen.create_app(test_db=filled_db)
+    app.config["COMPRESS_MIN_SIZE"] = 0
+    client = app.test_client()
+    plain = client.get("/courses/EDA322")
+
+    resp = client.get("/courses/EDA322", headers={"Accept-Encoding": "gzip"})
+    assert resp.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in resp.headers["Vary"]
+    assert gzip.decompress(resp.data) == plain.data
+    assert resp.headers["ETag"] != plain.headers["ETag"]
+
+    resp = client.get("/courses/EDA322", headers={"Accept-Encoding": "gzip",
+                                                  "If-None-Match": resp.headers["ETag"]})
+    assert resp.status_code == 304
+
+
+def test_get_course_small_uncompressed(client):
+    """Verify that responses below the size threshold are sent uncompressed"""
+
+    resp = client.get("/courses/EDA322", headers={"Accept-Encoding": "gzip"})
+
+    assert "Content-Encoding" not in resp.headers
+    assert resp.get_json()[0]["code"] == "EDA322"
@@ -54,13 +54,13 @@ class ExamAnalytics extends Component
 		this.examPanelElement = React.createRef();
 		this.renderCourseFromList = this.renderCourseFromList.bind(this);
 		this.toggleFailRate = this.toggleFailRate.bind(this);
-		this.fetchCourse = this.fetchCourse.bind(this);
+		this.fetchCourses = this.fetchCourses.bind(this);
 		this.coursesCallback = this.coursesCallback.bind(this);
 		this.updateExamPanel = this.updateExamPanel.bind(this);
 		this.resetExamPanel = this.resetExamPanel.bind(this);
 		this.selectData = this.selectData.bind(this);
 		this.prepareAvgData = this.prepareAvgData.bind(this);
-		this.computeAdjustedFailure = this.computeAdjustedFailure.bind(this);
+		this.adjustedFailure = this.adjustedFailure.bind(this);
 	}
 
 	componentDidMount()
@@ -151,6 +151,7 @@ class ExamAnalytics extends Component
 				{
 					code: fetchedCourses[i][0].code,
 					name: fetchedCourses[i][lastIndex].name,
+					adjustedFailRate: fetchedCourses[i][0].adjusted_fail_rate,
 					exams: [],
 					solutions: [],
 					labels: [],
@@ -248,7 +249,7 @@ class ExamAnalytics extends Component
 
 		this.setState(
 			{
-				adjustedFailure: this.computeAdjustedFailure(courses[0]),
+				adjustedFailure: this.adjustedFailure(courses[0]),
 				loaded: true,
 				courses: courses,
 				rates: rates,
@@ -271,24 +272,20 @@ class ExamAnalytics extends Component
 			});
 	}
 
-	async fetchCourse(course)
+	// fetch all courses using a single request
+	async fetchCourses(codes)
 	{
-		const resp = await fetch(process.env.REACT_APP_SERVER_URL + "courses/" + course);
+		const resp = await fetch(process.env.REACT_APP_SERVER_URL + "courses/batch?codes="
+			+ codes.map(encodeURIComponent).join(","));
 		var respJSON = await resp.json();
 		if ("error" in respJSON)
 		{
 			this.setState({failedLoading: true});
+			this.coursesCallback(codes.map(() => respJSON));
+			return;
 		}
 
-		return respJSON;
-	}
-
-	// return single promise for array of courses
-	async fetchCourses(codes)
-	{
-		const pCourses = codes.map(this.fetchCourse);
-		const courses  = await Promise.all(pCourses);
-		this.coursesCallback(courses);
+		this.coursesCallback(codes.map((code) => respJSON[code]));
 	}
 
 	updateExamPanel(tooltipModel)
@@ -400,85 +397,20 @@ class ExamAnalytics extends Component
 		return partial_sum + a;
 	}
 
-	// compute the adjusted failure by taking the most
-	// attended exam in the past year, and computing
-	// the two previous years results from that date
-	computeAdjustedFailure(course)
+	// the adjusted fail rate is computed by the backend from the sittings
+	// with the most participants during the last few years of the course
+	adjustedFailure(course)
 	{
-		var lastIndex = course.labels.length - 1;
-		var lowerBound  = new Date(course.labels[lastIndex]);
-		lowerBound.setFullYear(lowerBound.getFullYear() - 1);
-
-		// add month to account for varying exam dates
-		lowerBound.setMonth(lowerBound.getMonth() + 1);
-
-		// find major exam date
-		var majorIndex = lastIndex;
-		var largestSum = course.datasets[0].data[lastIndex]
-			+ course.datasets[1].data[lastIndex]
-			+ course.datasets[2].data[lastIndex]
-			+ course.datasets[3].data[lastIndex];
-
-		// index and date reused for other loop
-		var i;
-		var date;
-		for(i = lastIndex; i >= 0; --i)
-		{
-			date = new Date(course.labels[i]);
-			if(date < lowerBound)
-			{
-				break;
-			}
-			var sum = course.datasets[0].data[i]
-				+ course.datasets[1].data[i]
-				+ course.datasets[2].data[i]
-				+ course.datasets[3].data[i];
-
-			if(sum > largestSum)
-			{
-				majorIndex = i;
-			}
-		}
-
-		var majorFailRates = [];
-
-		var upper = new Date(course.labels[majorIndex]);
-		upper.setMonth(upper.getMonth() + 1);
-		var lower = new Date(course.labels[majorIndex]);
-		lower.setMonth(lower.getMonth() - 1);
-
-		for(i = majorIndex; i >= 0; --i)
-		{
-			if(majorFailRates.length >= 3)
-				break;
-
-			date = new Date(course.labels[i]);
-
-			// date was between boundaries
-			if(date < upper && date >= lower)
-			{
-				var failures = course.datasets[0].data[i];
-				var total    = failures
-					+ course.datasets[1].data[i]
-					+ course.datasets[2].data[i]
-					+ course.datasets[3].data[i];
-				var failRate = Math.round(failures / total * 100);
-				majorFailRates.unshift(failRate);
-
-				// update boundaries
-				upper.setFullYear(upper.getFullYear() - 1);
-				lower.setFullYear(lower.getFullYear() - 1);
-			}
-		}
+		if(course.adjustedFailRate === null || course.adjustedFailRate === undefined)
+			return "-";
 
-		// finally compute average of the rates
-		return Math.round(majorFailRates.reduce(this.sumAccumulate) / majorFailRates.length);
+		return Math.round(course.adjustedFailRate);
 	}
 
 	renderCourseFromList(course)
 	{
 		var rates = this.computeGradeRates(course);
-		var adjusted = this.computeAdjustedFailure(course);
+		var adjusted = this.adjustedFailure(course);
 
 		return(
 			<tr key={course.code}>
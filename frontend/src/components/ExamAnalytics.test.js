@@ -9,7 +9,7 @@ function setup_comp(codes)
 };
 
 const config_one = JSON.stringify(
-	[
+	{"EDA322": [
 		{
 			"taken": "2017-03-01",
 			"failures": 5,
@@ -20,6 +20,7 @@ const config_one = JSON.stringify(
 			"name": "Digital Konstruktion",
 			"exam":  null,
 			"solution":  null,
+			"adjusted_fail_rate": 37.5,
 		},
 		{
 			"taken": "2018-03-14",
@@ -31,6 +32,7 @@ const config_one = JSON.stringify(
 			"name": "Digital Konstruktion",
 			"exam":  "http://example.com/exam",
 			"solution":  null,
+			"adjusted_fail_rate": 37.5,
 		},
 		{
 			"taken": "2019-01-09",
@@ -42,6 +44,7 @@ const config_one = JSON.stringify(
 			"name": "Digital Konstruktion",
 			"exam":  null,
 			"solution":  "http://example.com/solution",
+			"adjusted_fail_rate": 37.5,
 		},
 		{
 			"taken": "2019-03-08",
@@ -53,8 +56,9 @@ const config_one = JSON.stringify(
 			"name": "Digital Konstruktion",
 			"exam":  "http://example.com/exam",
 			"solution":  "http://example.com/solution",
+			"adjusted_fail_rate": 37.5,
 		},
-	]);
+	]});
 
 const config_fail = JSON.stringify({error: "Not found"});
 
@@ -91,7 +95,7 @@ describe("Exam analytics component", () =>
 				expect(comp.queryByText("Fives: 20%")).not.toBeNull();
 			});
 
-		test("computes the adjusted grade properly", async () =>
+		test("shows the adjusted fail rate of the course", async () =>
 			{
 				fetch.mockResponseOnce(config_one);
 				const comp = setup_comp(["EDA322"]);
@@ -63,31 +63,20 @@ class ExamPanel extends Component
 	uploadExam(event)
 	{
 		var file = event.target.files[0];
-		var reader = new FileReader();
-		var encoded = "";
-
-		reader.onload = function(readerEvt) {
-			var binaryString = readerEvt.target.result;
-			encoded = btoa(binaryString);
-			var suggestion =
-				{
-					exam:  encoded
-				};
-			var url = process.env.REACT_APP_SERVER_URL + "courses/" + this.props.code + "/" + this.state.data.taken + "/exam";
-			fetch(url,{
-				method: "PUT",
-				mode: "cors",
-				cache: "no-cache",
-				headers: {
-					"Content-Type": "application/json",
-				},
-				body: JSON.stringify(suggestion),
-			})
-				.then(this.showModal)
-				.catch(error => alert("Something went wrong"));
-		}.bind(this);
-
-		reader.readAsBinaryString(file);
+		var url = process.env.REACT_APP_SERVER_URL + "courses/" + this.props.code + "/" + this.state.data.taken + "/exam";
+
+		// the PDF is sent as is, the backend streams it straight to storage
+		fetch(url,{
+			method: "PUT",
+			mode: "cors",
+			cache: "no-cache",
+			headers: {
+				"Content-Type": "application/pdf",
+			},
+			body: file,
+		})
+			.then(this.showModal)
+			.catch(error => alert("Something went wrong"));
 	}
 
 	showModal()